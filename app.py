@@ -2,17 +2,39 @@
 Flask web application for MSP Pricing Tool
 Serves responsive UI with real-time price queries
 """
-from flask import Flask, render_template, request, jsonify, send_file
-import sqlite3
+from flask import Flask, render_template, request, jsonify, g
 import logging
+import base64
+import csv
+import io
+import hashlib
+import json
+import sqlite3
+import threading
+import time
 from functools import wraps
 import subprocess
-import tempfile
 import sys
 from pathlib import Path
 from datetime import datetime
 
-from config import config, BASE_DIR, DB_NAME, PORT, HOST, LOGGING_CONFIG
+from config import (config, BASE_DIR, PORT, HOST, LOGGING_CONFIG,
+                    QUERY_PAGE_SIZE, QUERY_MAX_PAGE_SIZE, STREAM_BATCH_SIZE,
+                    SUGGEST_LIMIT, SUGGEST_MAX_LIMIT)
+from db import read_connection, open_read_only, pool
+from update_db import (add_import_listener, compute_filter_facets, init_database,
+                       refresh_price_indexes)
+from catalog import get_catalog, reload_catalog, read_catalog_version, current_catalog
+from indexes import query_usage, explain, AUTO_INDEX_PREFIX
+from result_cache import result_cache, normalize_query
+from slow_queries import slow_query_log
+import metrics
+from server import serve
+from search import (build_fts_query, fts_available, add_snippets,
+                    RANK_EXPR)
+from quotes import (parse_quote_lines, fetch_quote_rows, price_quote,
+                    render_quote_text, render_quote_html,
+                    parse_grid_request, margin_grid, grid_cache)
 
 # Determine template and static folder locations
 if getattr(sys, 'frozen', False):
@@ -34,7 +56,58 @@ import logging.config
 logging.config.dictConfig(LOGGING_CONFIG)
 logger = logging.getLogger(__name__)
 
-DB_PATH = BASE_DIR / "data" / DB_NAME
+# Rebuild the in-memory catalog whenever an import completes in this process
+add_import_listener(reload_catalog)
+add_import_listener(result_cache.clear)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and time it by route (streamed bodies are timed until the response is built)"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.http_latency.observe(time.perf_counter() - started, method=request.method, route=route)
+        metrics.http_requests.inc(method=request.method, route=route, status=response.status_code)
+    return response
+
+def collect_metrics():
+    """Set the scrape-time gauges from the pool, caches, catalog and import metadata"""
+    stats = pool.stats()
+    metrics.pool_idle.set(stats['idle_connections'])
+    metrics.pool_size.set(stats['pool_size'])
+    for event in ('connections_opened', 'read_checkouts', 'read_reuses', 'write_transactions'):
+        metrics.pool_events.set(stats[event], event=event)
+    metrics.pool_write_wait.set(stats['write_wait_seconds'])
+
+    for name, cache in (('result', result_cache), ('grid', grid_cache)):
+        stats = cache.stats()
+        metrics.cache_entries.set(stats['entries'], cache=name)
+        metrics.cache_lookups.set(stats['hits'], cache=name, result='hit')
+        metrics.cache_lookups.set(stats['misses'], cache=name, result='miss')
+        if 'bytes' in stats:
+            metrics.cache_bytes.set(stats['bytes'], cache=name)
+            metrics.cache_evictions.set(stats['evictions'], cache=name)
+
+    catalog = current_catalog()
+    metrics.catalog_rows.set(catalog.size if catalog is not None else 0)
+
+    # Imports usually run in the updater process, so read what it recorded
+    with get_db_connection() as conn:
+        rows = dict(conn.execute("""
+            SELECT key, value FROM metadata WHERE key IN ('last_import', 'last_import_stats')
+        """).fetchall())
+    if 'last_import' in rows:
+        metrics.last_import_time.set(datetime.fromisoformat(rows['last_import']).timestamp())
+    if 'last_import_stats' in rows:
+        import_stats = json.loads(rows['last_import_stats'])
+        metrics.last_import_rows.set(import_stats.get('rows', 0))
+        metrics.last_import_seconds.set(import_stats.get('seconds', 0))
+
+metrics.registry.add_collector(collect_metrics)
 
 # Basic authentication decorator
 def check_auth(username, password):
@@ -64,21 +137,138 @@ def requires_auth(f):
     return decorated
 
 def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def term_duration_to_human(term):
-    """Convert ISO 8601 duration to human readable"""
-    mapping = {
-        'P1Y': '1 Year (Annual)',
-        'P1M': '1 Month (Monthly)',
-        'P3Y': '3 Years',
-        'P2Y': '2 Years',
-        '': 'Not specified'
-    }
-    return mapping.get(term, term)
+    """Get a pooled read connection (use as a context manager)"""
+    return read_connection()
+
+# Default result order, also the keyset pagination key
+TITLE_SORT = ['ProductTitle', 'SkuTitle', 'id']
+
+# /api/query result columns, in order. Derived pricing columns are stored at
+# import time, so rows need no per-row computation.
+RESULT_COLUMNS = [
+    'id', 'ProductTitle', 'SkuTitle', 'TermDuration', 'TermDurationHuman',
+    'BillingPlan', 'UnitPrice', 'ERPPrice', 'MarkupPercent', 'ProfitPerLicense',
+    'Currency', 'Segment', 'SkuDescription', 'Publisher'
+]
+RESULT_SELECT = ', '.join(
+    f"COALESCE(prices.{c}, 0) AS {c}" if c in ('UnitPrice', 'ERPPrice') else f"prices.{c}"
+    for c in RESULT_COLUMNS
+)
+
+def build_price_query(data, use_fts=False):
+    """
+    Build the SQL for an /api/query filter spec.
+    Returns (query, params, sort_columns); the query is unordered, pass it to
+    paginate_price_query to apply the sort order, cursor and limit.
+    With use_fts, searches go through the prices_fts index and rows carry a
+    SearchRank (bm25, lower is better); pass their results to add_snippets
+    for highlights.
+    """
+    fts_query = build_fts_query(data['search']) if use_fts and data.get('search') else None
+
+    if fts_query:
+        query = (f"SELECT {RESULT_SELECT}, {RANK_EXPR} AS SearchRank "
+                 "FROM prices_fts JOIN prices ON prices.id = prices_fts.rowid "
+                 "WHERE prices_fts MATCH ?")
+        params = [fts_query]
+    else:
+        query = f"SELECT {RESULT_SELECT} FROM prices WHERE 1=1"
+        params = []
+
+    if data.get('product'):
+        query += " AND prices.ProductTitle = ?"
+        params.append(data['product'])
+
+    if data.get('segment'):
+        query += " AND prices.Segment = ?"
+        params.append(data['segment'])
+
+    if data.get('term'):
+        query += " AND prices.TermDuration = ?"
+        params.append(data['term'])
+
+    if data.get('billing'):
+        query += " AND prices.BillingPlan = ?"
+        params.append(data['billing'])
+
+    if fts_query:
+        return query, params, ['SearchRank'] + TITLE_SORT
+
+    if data.get('search'):
+        query += " AND (prices.ProductTitle LIKE ? OR prices.SkuTitle LIKE ? OR prices.SkuDescription LIKE ?)"
+        search_param = f"%{data['search']}%"
+        params.extend([search_param, search_param, search_param])
+
+    return query, params, TITLE_SORT
+
+def paginate_price_query(query, params, sort_columns, after=None, limit=None):
+    """Apply the sort order, a keyset cursor and a limit to a built price query"""
+    columns = ', '.join(sort_columns)
+    query = f"SELECT * FROM ({query})"
+    params = list(params)
+
+    if after is not None:
+        query += f" WHERE ({columns}) > ({', '.join('?' * len(sort_columns))})"
+        params.extend(after)
+
+    query += f" ORDER BY {columns}"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
+
+def iter_price_rows(query, params):
+    """
+    Yield batches of /api/query result dicts straight from a database cursor,
+    so large result sets are never held in memory all at once.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            yield [row_to_result(row) for row in rows]
+
+def wants_stream(data):
+    """Check whether the client asked for a streamed (NDJSON) response"""
+    if data.get('stream'):
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+def encode_cursor(key):
+    """Encode a keyset sort key as an opaque next_cursor string"""
+    if key is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor, raising ValueError if malformed"""
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or len(key) not in (3, 4):
+        raise ValueError("Invalid cursor")
+    return key
+
+def parse_page_limit(value):
+    """Validate the requested page size, applying the default and maximum"""
+    if value is None:
+        return QUERY_PAGE_SIZE
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    return max(1, min(limit, QUERY_MAX_PAGE_SIZE))
+
+def row_to_result(row):
+    """Convert a build_price_query row to an /api/query result dict"""
+    result = dict(row)
+    result.pop('SearchRank', None)
+    return result
 
 @app.route('/')
 @requires_auth
@@ -86,58 +276,56 @@ def index():
     """Main query interface"""
     return render_template('query.html')
 
+# Serialized /api/filters response for the current import version,
+# replaced as a whole so readers never see a half-updated entry
+_filters_cache = {'version': None, 'body': None, 'etag': None}
+_filters_lock = threading.Lock()
+
+def load_filters():
+    """
+    Return (body, etag) for /api/filters.
+    Facets are precomputed by the import and cached here until the
+    last_csv_hash metadata value changes.
+    """
+    global _filters_cache
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT value FROM metadata WHERE key = 'last_csv_hash'").fetchone()
+        version = row[0] if row else None
+
+        cached = _filters_cache
+        if cached['body'] is not None and cached['version'] == version:
+            return cached['body'], cached['etag']
+
+        with _filters_lock:
+            cached = _filters_cache
+            if cached['body'] is not None and cached['version'] == version:
+                return cached['body'], cached['etag']
+
+            row = conn.execute("SELECT value FROM metadata WHERE key = 'filter_facets'").fetchone()
+            stored = json.loads(row[0]) if row else None
+            if stored and stored.get('version') == version:
+                facets = stored['facets']
+            else:
+                # Imported before facets were precomputed
+                facets = compute_filter_facets(conn)
+
+            body = json.dumps(facets).encode('utf-8')
+            etag = hashlib.sha256(body).hexdigest()[:32]
+            _filters_cache = {'version': version, 'body': body, 'etag': etag}
+            return body, etag
+
 @app.route('/api/filters', methods=['GET'])
 @requires_auth
 def get_filters():
     """Get unique values for filter dropdowns"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Get unique products
-        cursor.execute("""
-            SELECT DISTINCT ProductTitle
-            FROM prices
-            WHERE ProductTitle IS NOT NULL
-            ORDER BY ProductTitle
-        """)
-        products = [row[0] for row in cursor.fetchall()]
-
-        # Get unique segments
-        cursor.execute("""
-            SELECT DISTINCT Segment
-            FROM prices
-            WHERE Segment IS NOT NULL
-            ORDER BY Segment
-        """)
-        segments = [row[0] for row in cursor.fetchall()]
-
-        # Get unique term durations
-        cursor.execute("""
-            SELECT DISTINCT TermDuration
-            FROM prices
-            WHERE TermDuration IS NOT NULL
-            ORDER BY TermDuration
-        """)
-        terms = [row[0] for row in cursor.fetchall()]
-
-        # Get unique billing plans
-        cursor.execute("""
-            SELECT DISTINCT BillingPlan
-            FROM prices
-            WHERE BillingPlan IS NOT NULL
-            ORDER BY BillingPlan
-        """)
-        billing = [row[0] for row in cursor.fetchall()]
-
-        conn.close()
+        body, etag = load_filters()
 
-        return jsonify({
-            'products': products,
-            'segments': segments,
-            'terms': terms,
-            'billing': billing
-        })
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        # Browsers may keep the response but must revalidate (cheap 304)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
 
     except Exception as e:
         logger.error(f"Error fetching filters: {e}", exc_info=True)
@@ -146,85 +334,127 @@ def get_filters():
 @app.route('/api/query', methods=['POST'])
 @requires_auth
 def query_prices():
-    """Query prices based on filters"""
+    """
+    Query prices based on filters.
+    Results are returned a page at a time: pass limit (default
+    QUERY_PAGE_SIZE) and the previous response's next_cursor as cursor.
+    With "stream": true (or Accept: application/x-ndjson) every matching
+    row is streamed as newline-delimited JSON instead, unless a limit is given.
+    A search with no exact matches returns close matches instead, ranked by
+    similarity, with fuzzy set in the response.
+    Paged responses are cached per import version (see result_cache).
+    """
     try:
-        data = request.get_json()
-        product = data.get('product')
-        segment = data.get('segment')
-        term = data.get('term')
-        billing = data.get('billing')
-        search = data.get('search', '')
+        try:
+            data = normalize_query(request.get_json() or {})
+            limit = parse_page_limit(data.get('limit'))
+            after = decode_cursor(data.get('cursor'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        query_usage.record(data)
+
+        search = data.get('search')
+        if wants_stream(data):
+            return stream_prices(data, after, limit if 'limit' in data else None)
+
+        with get_db_connection() as conn:
+            # Serve from the in-memory catalog; fall back to SQLite if it is unavailable
+            catalog = get_catalog()
+            version = catalog.version if catalog is not None else read_catalog_version(conn)
+            key = result_cache.key(version, dict(data, limit=limit))
+            body = result_cache.get(key)
+            if body is not None:
+                return app.response_class(body, mimetype='application/json')
+
+            fuzzy = False
+            if catalog is not None:
+                # Searched in memory, ranked like the full-text index but without its lookup
+                ranking = catalog.search_ranking(search) if search else None
+                rows, scores = catalog.select(data, ranking)
+                if search and len(rows) == 0:
+                    # Nothing matched as typed: look for close matches (typos, abbreviations)
+                    rows, scores = catalog.select(data, catalog.fuzzy_ranking(search))
+                    fuzzy = len(rows) > 0
+                if after is not None and len(after) != (4 if scores is not None else 3):
+                    return jsonify({'error': 'Invalid cursor'}), 400
+
+                total = len(rows)
+                rows, scores, next_key = catalog.page(rows, scores, after, limit)
+                results = catalog.records(rows)
+                if ranking is not None and not fuzzy:
+                    add_snippets(search, results)
+            else:
+                query, params, sort_columns = build_price_query(data, use_fts=fts_available(conn))
+                if after is not None and len(after) != len(sort_columns):
+                    return jsonify({'error': 'Invalid cursor'}), 400
+
+                total = conn.execute(f"SELECT COUNT(*) FROM ({query})", params).fetchone()[0]
+                page_query, page_params = paginate_price_query(query, params, sort_columns, after, limit + 1)
+                rows = conn.execute(page_query, page_params).fetchall()
+                next_key = None
+                if len(rows) > limit:
+                    rows = rows[:limit]
+                    next_key = [rows[-1][column] for column in sort_columns]
+                results = [row_to_result(row) for row in rows]
+                if sort_columns[0] == 'SearchRank':
+                    add_snippets(search, results)
+
+        metrics.query_rows.observe(len(results))
+        metrics.query_matches.observe(total)
+        response = jsonify({
+            'results': results,
+            'count': len(results),
+            'total': total,
+            'next_cursor': encode_cursor(next_key),
+            'fuzzy': fuzzy
+        })
+        result_cache.put(key, response.get_data())
+        return response
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    except Exception as e:
+        logger.error(f"Error querying prices: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
 
-        # Build query
-        query = "SELECT * FROM prices WHERE 1=1"
-        params = []
+def stream_prices(data, after=None, limit=None):
+    """Stream query results as NDJSON, serialized while the cursor iterates"""
+    with get_db_connection() as conn:
+        query, params, sort_columns = build_price_query(data, use_fts=fts_available(conn))
+    if after is not None and len(after) != len(sort_columns):
+        return jsonify({'error': 'Invalid cursor'}), 400
+    query, params = paginate_price_query(query, params, sort_columns, after, limit)
 
-        if product:
-            query += " AND ProductTitle = ?"
-            params.append(product)
-
-        if segment:
-            query += " AND Segment = ?"
-            params.append(segment)
-
-        if term:
-            query += " AND TermDuration = ?"
-            params.append(term)
-
-        if billing:
-            query += " AND BillingPlan = ?"
-            params.append(billing)
-
-        if search:
-            query += " AND (ProductTitle LIKE ? OR SkuTitle LIKE ? OR SkuDescription LIKE ?)"
-            search_param = f"%{search}%"
-            params.extend([search_param, search_param, search_param])
-
-        query += " ORDER BY ProductTitle, SkuTitle"
-
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-
-        # Convert to list of dicts
-        results = []
-        for row in rows:
-            unit_price = float(row['UnitPrice']) if row['UnitPrice'] else 0
-            erp_price = float(row['ERPPrice']) if row['ERPPrice'] else 0
-
-            # Calculate markup percentage: ((ERP - MS) / MS) * 100
-            markup_percent = 0
-            if unit_price > 0:
-                markup_percent = ((erp_price - unit_price) / unit_price) * 100
-
-            results.append({
-                'id': row['id'],
-                'ProductTitle': row['ProductTitle'],
-                'SkuTitle': row['SkuTitle'],
-                'TermDuration': row['TermDuration'],
-                'TermDurationHuman': term_duration_to_human(row['TermDuration']),
-                'BillingPlan': row['BillingPlan'],
-                'UnitPrice': unit_price,
-                'ERPPrice': erp_price,
-                'MarkupPercent': round(markup_percent, 1),
-                'ProfitPerLicense': round(erp_price - unit_price, 2),
-                'Currency': row['Currency'],
-                'Segment': row['Segment'],
-                'SkuDescription': row['SkuDescription'],
-                'Publisher': row['Publisher']
-            })
+    ranked = sort_columns[0] == 'SearchRank'
 
-        conn.close()
+    def generate():
+        for batch in iter_price_rows(query, params):
+            if ranked:
+                add_snippets(data['search'], batch)
+            yield ''.join(json.dumps(result) + '\n' for result in batch)
 
-        return jsonify({
-            'results': results,
-            'count': len(results)
-        })
+    return app.response_class(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/suggest', methods=['GET'])
+@requires_auth
+def suggest_titles():
+    """
+    Complete a partly typed search: ?q=text&limit=n returns the best
+    matching product and SKU titles from the catalog's prefix index.
+    Returns no suggestions while the catalog is unavailable.
+    """
+    try:
+        text = request.args.get('q', '')
+        try:
+            limit = int(request.args.get('limit', SUGGEST_LIMIT))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        limit = max(1, min(limit, SUGGEST_MAX_LIMIT))
+
+        catalog = get_catalog()
+        suggestions = catalog.suggestions.suggest(text, limit) if catalog is not None else []
+        return jsonify({'query': text, 'suggestions': suggestions})
 
     except Exception as e:
-        logger.error(f"Error querying prices: {e}", exc_info=True)
+        logger.error(f"Error suggesting titles: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/price/<int:price_id>', methods=['GET'])
@@ -232,31 +462,15 @@ def query_prices():
 def get_price_detail(price_id):
     """Get detailed information for a specific price"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT * FROM prices WHERE id = ?", (price_id,))
-        row = cursor.fetchone()
+        with get_db_connection() as conn:
+            row = conn.execute("SELECT * FROM prices WHERE id = ?", (price_id,)).fetchone()
 
         if not row:
             return jsonify({'error': 'Price not found'}), 404
 
-        unit_price = float(row['UnitPrice']) if row['UnitPrice'] else 0
-        erp_price = float(row['ERPPrice']) if row['ERPPrice'] else 0
-
-        # Calculate markup percentage
-        markup_percent = 0
-        if unit_price > 0:
-            markup_percent = ((erp_price - unit_price) / unit_price) * 100
-
         price_detail = dict(row)
-        price_detail['TermDurationHuman'] = term_duration_to_human(row['TermDuration'])
-        price_detail['UnitPrice'] = unit_price
-        price_detail['ERPPrice'] = erp_price
-        price_detail['MarkupPercent'] = round(markup_percent, 1)
-        price_detail['ProfitPerLicense'] = round(erp_price - unit_price, 2)
-
-        conn.close()
+        price_detail['UnitPrice'] = row['UnitPrice'] or 0
+        price_detail['ERPPrice'] = row['ERPPrice'] or 0
 
         return jsonify(price_detail)
 
@@ -274,11 +488,8 @@ def generate_draft():
         margin = data.get('margin', 20)
         quantity = data.get('quantity', 1)
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT * FROM prices WHERE id = ?", (price_id,))
-        row = cursor.fetchone()
+        with get_db_connection() as conn:
+            row = conn.execute("SELECT * FROM prices WHERE id = ?", (price_id,)).fetchone()
 
         if not row:
             return jsonify({'error': 'Price not found'}), 404
@@ -287,10 +498,7 @@ def generate_draft():
         ms_price = float(row['UnitPrice'])  # What Microsoft charges us (Partner Price)
         erp_price = float(row['ERPPrice']) if row['ERPPrice'] else 0  # Microsoft Retail Price
 
-        # Calculate standard markup
-        standard_markup = 0
-        if ms_price > 0:
-            standard_markup = ((erp_price - ms_price) / ms_price) * 100
+        standard_markup = row['MarkupPercent']  # Stored at import time
 
         # Apply margin adjustment from slider
         final_price = ms_price * (1 + margin / 100)
@@ -324,7 +532,7 @@ MS Retail Price:    ${erp_price:.2f} (Standard Markup: {standard_markup:.1f}%)
 
 CONTRACT DETAILS
 ----------------
-Term:           {term_duration_to_human(row['TermDuration'])}
+Term:           {row['TermDurationHuman']}
 Billing:        {row['BillingPlan']}
 Currency:       {row['Currency']}
 
@@ -352,101 +560,8 @@ NOTES
 ========================================
 """
 
-        conn.close()
-
         # Generate HTML page for browser display
-        html_content = f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Quote Draft - {row['ProductTitle']}</title>
-    <style>
-        body {{
-            font-family: 'Consolas', 'Courier New', monospace;
-            background-color: #1e1e1e;
-            color: #d4d4d4;
-            padding: 20px;
-            margin: 0;
-            line-height: 1.4;
-        }}
-        .container {{
-            max-width: 800px;
-            margin: 0 auto;
-            background-color: #2d2d2d;
-            padding: 30px;
-            border-radius: 8px;
-            box-shadow: 0 4px 12px rgba(0,0,0,0.3);
-        }}
-        pre {{
-            white-space: pre-wrap;
-            word-wrap: break-word;
-            margin: 0;
-            font-size: 14px;
-        }}
-        .actions {{
-            margin-top: 20px;
-            padding-top: 20px;
-            border-top: 1px solid #444;
-            text-align: center;
-        }}
-        button {{
-            background-color: #0078d4;
-            color: white;
-            border: none;
-            padding: 10px 20px;
-            margin: 0 10px;
-            border-radius: 4px;
-            cursor: pointer;
-            font-size: 14px;
-        }}
-        button:hover {{
-            background-color: #106ebe;
-        }}
-        @media print {{
-            body {{
-                background-color: white;
-                color: black;
-            }}
-            .container {{
-                background-color: white;
-                box-shadow: none;
-            }}
-            .actions {{
-                display: none;
-            }}
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <pre>{draft_text}</pre>
-        <div class="actions">
-            <button onclick="window.print()">Print Quote</button>
-            <button onclick="copyToClipboard()">Copy to Clipboard</button>
-            <button onclick="window.close()">Close</button>
-        </div>
-    </div>
-    <script>
-        function copyToClipboard() {{
-            const text = document.querySelector('pre').textContent;
-            navigator.clipboard.writeText(text).then(() => {{
-                alert('Quote copied to clipboard!');
-            }}).catch(err => {{
-                console.error('Failed to copy:', err);
-                // Fallback for older browsers
-                const textarea = document.createElement('textarea');
-                textarea.value = text;
-                document.body.appendChild(textarea);
-                textarea.select();
-                document.execCommand('copy');
-                document.body.removeChild(textarea);
-                alert('Quote copied to clipboard!');
-            }});
-        }}
-    </script>
-</body>
-</html>"""
+        html_content = render_quote_html(f"Quote Draft - {row['ProductTitle']}", draft_text)
 
         return jsonify({'success': True, 'html': html_content})
 
@@ -454,38 +569,124 @@ NOTES
         logger.error(f"Error generating draft: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/export', methods=['POST'])
+@app.route('/api/quotes/batch', methods=['POST'])
 @requires_auth
-def export_csv():
-    """Export current query results to CSV"""
+def generate_batch_quote():
+    """
+    Price a multi-line quote in one request.
+    Body: {"lines": [{"price_id", "quantity", "margin"}, ...], "margin": default}
+    Returns per-line and total figures plus the rendered quote document.
+    """
     try:
-        data = request.get_json()
-        results = data.get('results', [])
+        data = request.get_json(silent=True) or {}
+        try:
+            price_ids, quantities, margins = parse_quote_lines(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        if not results:
-            return jsonify({'error': 'No results to export'}), 400
+        with get_db_connection() as conn:
+            rows_by_id = fetch_quote_rows(conn, price_ids)
 
-        # Create CSV in memory
-        import csv
-        import io
+        missing = sorted(set(price_ids) - set(rows_by_id))
+        if missing:
+            return jsonify({'error': 'Price not found', 'missing': missing}), 404
 
-        output = io.StringIO()
-        if results:
-            writer = csv.DictWriter(output, fieldnames=results[0].keys())
-            writer.writeheader()
-            writer.writerows(results)
+        lines, totals = price_quote([rows_by_id[i] for i in price_ids], quantities, margins)
+        html_content = render_quote_html(f"Quote Draft - {totals['lines']} lines",
+                                         render_quote_text(lines, totals))
 
-        output.seek(0)
+        return jsonify({'success': True, 'lines': lines, 'totals': totals, 'html': html_content})
 
-        # Save to temp file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False, encoding='utf-8-sig') as f:
-            f.write(output.getvalue())
-            temp_path = f.name
+    except Exception as e:
+        logger.error(f"Error generating batch quote: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
 
-        return send_file(temp_path,
-                        mimetype='text/csv',
-                        as_attachment=True,
-                        download_name=f'pricing_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
+@app.route('/api/quotes/grid', methods=['POST'])
+@requires_auth
+def generate_margin_grid():
+    """
+    What-if grid for a basket of SKUs across margins and quantities.
+    Body: {"price_ids": [...], "margins": [...] or {"start", "stop", "step"},
+           "quantities": [...]}
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            price_ids, margins, quantities = parse_grid_request(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        with get_db_connection() as conn:
+            version = read_catalog_version(conn)
+            key = grid_cache.key(version, price_ids, margins, quantities)
+            body = grid_cache.get(key)
+            if body is None:
+                rows_by_id = fetch_quote_rows(conn, price_ids)
+                missing = sorted(set(price_ids) - set(rows_by_id))
+                if missing:
+                    return jsonify({'error': 'Price not found', 'missing': missing}), 404
+                grid = margin_grid([rows_by_id[i] for i in price_ids], margins, quantities)
+                grid['version'] = version
+                # Cache the serialized response so hits skip JSON encoding too
+                body = json.dumps(grid).encode()
+                grid_cache.put(key, body)
+
+        return app.response_class(body, mimetype='application/json')
+
+    except Exception as e:
+        logger.error(f"Error generating margin grid: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+# Columns written by /api/export, in order
+EXPORT_COLUMNS = [
+    'id', 'ProductTitle', 'SkuTitle', 'TermDuration', 'TermDurationHuman',
+    'BillingPlan', 'UnitPrice', 'ERPPrice', 'MarkupPercent', 'ProfitPerLicense',
+    'Currency', 'Segment', 'SkuDescription', 'Publisher'
+]
+
+@app.route('/api/export', methods=['GET', 'POST'])
+@requires_auth
+def export_csv():
+    """
+    Export query results to CSV.
+    Takes the same filter spec as /api/query (JSON body for POST, query
+    string for GET) and streams rows from the database cursor as they are
+    written, so nothing is buffered or written to disk.
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json() or {}
+        else:
+            data = request.args.to_dict()
+        try:
+            data = normalize_query(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        query_usage.record(data)
+
+        with get_db_connection() as conn:
+            query, params, sort_columns = build_price_query(data, use_fts=fts_available(conn))
+        query, params = paginate_price_query(query, params, sort_columns)
+
+        def generate():
+            output = io.StringIO()
+            writer = csv.DictWriter(output, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+            output.write('\ufeff')  # BOM so Excel detects UTF-8
+            writer.writeheader()
+            for batch in iter_price_rows(query, params):
+                writer.writerows(batch)
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate(0)
+            if output.tell():
+                yield output.getvalue()  # Header only: no matching rows
+
+        filename = f'pricing_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        return app.response_class(
+            generate(),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
 
     except Exception as e:
         logger.error(f"Error exporting CSV: {e}", exc_info=True)
@@ -496,27 +697,109 @@ def export_csv():
 def get_stats():
     """Get database statistics"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("SELECT COUNT(*) as count FROM prices")
-        total_count = cursor.fetchone()['count']
+            cursor.execute("SELECT COUNT(*) as count FROM prices")
+            total_count = cursor.fetchone()['count']
 
-        cursor.execute("SELECT value FROM metadata WHERE key = 'last_import'")
-        last_import = cursor.fetchone()
-        last_import_date = last_import['value'] if last_import else 'Never'
+            cursor.execute("SELECT value FROM metadata WHERE key = 'last_import'")
+            last_import = cursor.fetchone()
+            last_import_date = last_import['value'] if last_import else 'Never'
 
-        conn.close()
+            cursor.execute("SELECT value FROM metadata WHERE key = 'last_import_stats'")
+            import_stats = cursor.fetchone()
 
         return jsonify({
             'total_prices': total_count,
-            'last_import': last_import_date
+            'last_import': last_import_date,
+            'last_import_stats': json.loads(import_stats['value']) if import_stats else None,
+            'connection_pool': pool.stats(),
+            'grid_cache': grid_cache.stats(),
+            'result_cache': result_cache.stats()
         })
 
     except Exception as e:
         logger.error(f"Error fetching stats: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+@requires_auth
+def get_metrics():
+    """Prometheus metrics in the text exposition format"""
+    try:
+        return app.response_class(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+    except Exception as e:
+        logger.error(f"Error rendering metrics: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+def query_plan_report():
+    """Describe the prices indexes and the query plan of each recorded filter combination"""
+    with open_read_only() as conn:
+        conn.row_factory = sqlite3.Row
+        indexes = []
+        for index in conn.execute("PRAGMA index_list(prices)").fetchall():
+            columns = [column[2] for column in conn.execute(f"PRAGMA index_info({index[1]})")]
+            indexes.append({
+                'name': index[1],
+                'columns': columns,
+                'auto': index[1].startswith(AUTO_INDEX_PREFIX),
+            })
+
+        plans = []
+        usage = conn.execute(
+            "SELECT filters, hits, last_used FROM query_usage ORDER BY hits DESC, filters"
+        ).fetchall()
+        for row in usage:
+            fields = [field for field in row['filters'].split(',') if field]
+            # Plans do not depend on the filter values
+            query, params, sort_columns = build_price_query({field: '?' for field in fields})
+            query, params = paginate_price_query(query, params, sort_columns, limit=QUERY_PAGE_SIZE)
+            plans.append(dict(explain(conn, query, params), filters=fields,
+                              hits=row['hits'], last_used=row['last_used']))
+
+    return {'indexes': indexes, 'plans': plans}
+
+@app.route('/api/admin/query-plans', methods=['GET'])
+@requires_auth
+def get_query_plans():
+    """Show the prices indexes and how each used filter combination is executed"""
+    try:
+        return jsonify(query_plan_report())
+
+    except Exception as e:
+        logger.error(f"Error explaining query plans: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/indexes', methods=['POST'])
+@requires_auth
+def rebuild_indexes():
+    """Build indexes for the filter combinations used so far without waiting for an import"""
+    try:
+        refresh_price_indexes()
+        return jsonify(query_plan_report())
+
+    except Exception as e:
+        logger.error(f"Error refreshing indexes: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/slow-queries', methods=['GET', 'DELETE'])
+@requires_auth
+def get_slow_queries():
+    """
+    List the most recent statements slower than SLOW_QUERY_MS, newest first,
+    with their parameters, rows, elapsed time and query plan.
+    DELETE empties the log.
+    """
+    try:
+        if request.method == 'DELETE':
+            slow_query_log.clear()
+        return jsonify(dict(slow_query_log.stats(), queries=slow_query_log.entries()))
+
+    except Exception as e:
+        logger.error(f"Error listing slow queries: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
 @app.errorhandler(404)
 def not_found(e):
     return jsonify({'error': 'Not found'}), 404
@@ -526,10 +809,25 @@ def server_error(e):
     logger.error(f"Server error: {e}", exc_info=True)
     return jsonify({'error': 'Internal server error'}), 500
 
-def run_server():
-    """Run the Flask server"""
+def run_server(development=False):
+    """
+    Run the web server: waitress, or Flask's development server if
+    development is set. The catalog and filters are loaded before the
+    first request is accepted.
+    """
     logger.info(f"Starting MSP Pricing Tool web server on {HOST}:{PORT}")
-    app.run(host=HOST, port=PORT, debug=False, threaded=True)
+    init_database()  # Adds any columns missing from an older database
+    reload_catalog()
+    load_filters()
+    if development:
+        app.run(host=HOST, port=PORT, debug=False, threaded=True)
+        return
+
+    try:
+        serve(app)
+    finally:
+        query_usage.flush()
+        pool.close_all()
 
 if __name__ == '__main__':
-    run_server()
+    run_server(development='--dev' in sys.argv)
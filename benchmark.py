@@ -0,0 +1,408 @@
+"""
+Benchmark suite for MSP Pricing Application
+Times ingestion and the web API against synthetic pricelists of increasing size
+
+    python benchmark.py --scales 1 10 100 --output bench.json
+    python benchmark.py --scales 1 10 100 --baseline bench.json
+
+Each scale runs in its own process with its own data directory
+(MSP_PRICING_DATA_DIR), so the real database and settings are never touched
+and memory figures are not inflated by earlier scales.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Rows in a 1x pricelist, about the size of the current NCE license pricelist
+BASE_ROWS = 4000
+
+# Rows generated and written per chunk
+GENERATE_CHUNK_ROWS = 100000
+
+# Pricelist shape: every product has one SKU per segment, each sold on
+# every term/billing combination, so ROWS_PER_PRODUCT rows per product
+SEGMENTS = [  # Segment, SKU title suffix, price factor
+    ('Commercial', '', 1.0),
+    ('Education', ' (Education Faculty Pricing)', 0.6),
+    ('Charity', ' (Non-Profit Pricing)', 0.75),
+    ('Government', ' (Government Pricing)', 1.1),
+]
+TERMS = [  # TermDuration, BillingPlan, price factor
+    ('P1M', 'Monthly', 1.2),
+    ('P1Y', 'Monthly', 1.0),
+    ('P1Y', 'Annual', 12.0),
+    ('P3Y', 'Annual', 12.0),
+    ('P3Y', 'Triennial', 36.0),
+]
+ROWS_PER_PRODUCT = len(SEGMENTS) * len(TERMS)
+
+FAMILIES = [
+    'Microsoft 365', 'Office 365', 'Dynamics 365', 'Power BI', 'Power Apps',
+    'Microsoft Defender for Endpoint', 'Exchange Online', 'SharePoint Online',
+    'Microsoft Teams', 'Microsoft Intune', 'Microsoft Entra ID', 'Windows 365',
+    'Project', 'Visio', 'Microsoft Copilot', 'Microsoft Purview',
+]
+EDITIONS = [
+    'Business Basic', 'Business Standard', 'Business Premium', 'E3', 'E5',
+    'F1', 'F3', 'Plan 1', 'Plan 2', 'Premium', 'Pro', 'Enterprise',
+    'Sales Enterprise', 'Customer Service', 'Field Service', 'Apps for business',
+]
+EFFECTIVE_DATES = [
+    '2024-05-01T00:00:00.0000000Z', '2025-04-01T00:00:00.0000000Z',
+    '2024-10-01T00:00:00.0000000Z', '2025-11-01T00:00:00.0000000Z',
+]
+
+# Requests timed against each scale: name -> (method, path, JSON body, cached)
+# Uncached cases empty the result cache before every request; a price_id of
+# None is replaced with the id of an imported row.
+REQUEST_CASES = {
+    'filters': ('GET', '/api/filters', None, True),
+    'query_unfiltered': ('POST', '/api/query', {}, False),
+    'query_filtered': ('POST', '/api/query', {'segment': 'Commercial', 'term': 'P1Y'}, False),
+    'query_search': ('POST', '/api/query', {'search': 'business premium'}, False),
+    'query_fuzzy': ('POST', '/api/query', {'search': 'busines premum'}, False),
+    'query_cached': ('POST', '/api/query', {'segment': 'Commercial', 'term': 'P1Y'}, True),
+    'suggest': ('GET', '/api/suggest?q=micro', None, True),
+    'draft': ('POST', '/api/draft', {'price_id': None, 'margin': 20, 'quantity': 10}, True),
+    'export': ('POST', '/api/export', {'segment': 'Commercial'}, True),
+}
+
+# Changes smaller than this are noise, whatever the relative difference
+NOISE_FLOOR_MS = 1.0
+
+logger = logging.getLogger('benchmark')
+
+# --- Synthetic pricelists ----------------------------------------------
+
+def product_ids(products):
+    """12-character product ids in the style of CFQ7TTC0HL8Z"""
+    digits = '0123456789ABCDEFGHJKLMNPQRSTVWXZ'
+    ids = []
+    for product in products.tolist():
+        suffix = ''
+        for _ in range(4):
+            product, digit = divmod(product, len(digits))
+            suffix = digits[digit] + suffix
+        ids.append('CFQ7TTC0' + suffix)
+    return ids
+
+def pricelist_chunk(start, stop, seed, revision):
+    """
+    Rows start..stop of a synthetic pricelist as a DataFrame with the CSV
+    headers, reproducible from the seed. Each revision changes the price of
+    about 1% of the products.
+    """
+    rows = np.arange(start, stop)
+    product = rows // ROWS_PER_PRODUCT
+    segment = (rows % ROWS_PER_PRODUCT) // len(TERMS)
+    term = rows % len(TERMS)
+
+    products = np.unique(product)
+    rng = np.random.default_rng([seed, int(products[0])])
+    base_price = np.round(rng.lognormal(mean=3.0, sigma=1.5, size=len(products)), 2)
+    if revision:
+        changed = np.random.default_rng([seed, int(products[0]), revision]).random(len(products)) < 0.01
+        base_price = np.where(changed, np.round(base_price * 1.05, 2), base_price)
+    base_price = base_price[product - products[0]]
+
+    segment_factor = np.array([factor for _, _, factor in SEGMENTS])[segment]
+    term_factor = np.array([factor for _, _, factor in TERMS])[term]
+    unit_price = np.round(base_price * segment_factor * term_factor, 2)
+
+    family = np.array(FAMILIES, dtype=object)[product % len(FAMILIES)]
+    edition = np.array(EDITIONS, dtype=object)[(product // len(FAMILIES)) % len(EDITIONS)]
+    series = product // (len(FAMILIES) * len(EDITIONS))
+    titles = pd.Series(family + ' ' + edition)
+    titles = titles.where(series == 0, titles + ' Series ' + pd.Series(series).astype(str))
+    suffixes = np.array([suffix for _, suffix, _ in SEGMENTS], dtype=object)[segment]
+
+    ids = dict(zip(products.tolist(), product_ids(products)))
+    return pd.DataFrame({
+        'ChangeIndicator': 'Unchanged',
+        'ProductTitle': titles,
+        'ProductId': [ids[p] for p in product.tolist()],
+        'SkuId': pd.Series(segment + 1).astype(str).str.zfill(4),
+        'SkuTitle': titles + suffixes,
+        'Publisher': 'Microsoft Corporation',
+        'SkuDescription': titles + ' for organizations that need ' + edition.astype(str)
+                          + ' capabilities, licensed per user with productivity, security'
+                          + ' and compliance features managed from the admin center.',
+        'UnitOfMeasure': '',
+        'TermDuration': np.array([t for t, _, _ in TERMS], dtype=object)[term],
+        'BillingPlan': np.array([b for _, b, _ in TERMS], dtype=object)[term],
+        'Market': 'US',
+        'Currency': 'USD',
+        'UnitPrice': unit_price,
+        'PricingTierRangeMin': '',
+        'PricingTierRangeMax': '',
+        'EffectiveStartDate': np.array(EFFECTIVE_DATES, dtype=object)[product % len(EFFECTIVE_DATES)],
+        'EffectiveEndDate': '9999-11-30T23:59:59.0000000Z',
+        'Tags': 'License',
+        'ERP Price': np.round(unit_price * 1.25, 2),
+        'Segment': np.array([s for s, _, _ in SEGMENTS], dtype=object)[segment],
+        'PreviousValues': '',
+    })
+
+def write_pricelist(path, rows, seed=0, revision=0):
+    """Write a synthetic pricelist CSV of rows rows; returns its size in bytes"""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        for start in range(0, rows, GENERATE_CHUNK_ROWS):
+            chunk = pricelist_chunk(start, min(start + GENERATE_CHUNK_ROWS, rows), seed, revision)
+            chunk.to_csv(f, index=False, header=start == 0)
+    return Path(path).stat().st_size
+
+# --- Measurement -----------------------------------------------------------
+
+def summarize(seconds, rows=None):
+    """Latency percentiles (ms) and throughput for a list of timings"""
+    ms = np.array(seconds) * 1000
+    total = float(np.sum(seconds))
+    summary = {
+        'iterations': len(seconds),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3),
+        'per_second': round(len(seconds) / total, 2) if total > 0 else None,
+    }
+    if rows is not None:
+        summary['rows'] = rows
+        summary['rows_per_second'] = round(rows * len(seconds) / total) if total > 0 else None
+    return summary
+
+def peak_memory(call):
+    """Peak Python heap allocated while running call(), in bytes (tracemalloc)"""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        call()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_scale(scale, iterations, seed, mode, measure_memory):
+    """
+    Benchmark one scale in this process. MSP_PRICING_DATA_DIR must already
+    point at an empty data directory.
+    """
+    # Imported here: the data directory is fixed when config is first imported
+    from config import config, DATA_DIR
+    from update_db import init_database, ingest_csv
+    from catalog import reload_catalog
+    from result_cache import result_cache
+    from app import app
+    from db import read_connection
+
+    # The app logs every request and slow query; keep the benchmark output readable
+    logging.getLogger().setLevel(logging.ERROR)
+
+    rows = BASE_ROWS * scale
+    results = {'rows': rows, 'cases': {}}
+    cases = results['cases']
+    csv_path = DATA_DIR / f'pricelist_{scale}x.csv'
+    update_path = DATA_DIR / f'pricelist_{scale}x_update.csv'
+
+    started = time.perf_counter()
+    results['csv_bytes'] = write_pricelist(csv_path, rows, seed)
+    write_pricelist(update_path, rows, seed, revision=1)
+    results['generate_seconds'] = round(time.perf_counter() - started, 3)
+
+    init_database()
+
+    def ingest(path, ingest_mode):
+        started = time.perf_counter()
+        if not ingest_csv(path, force=True, mode=ingest_mode):
+            raise RuntimeError(f"Import of {path} failed")
+        return time.perf_counter() - started
+
+    cases['ingest_initial'] = summarize([ingest(csv_path, mode)], rows)
+    cases['ingest_update'] = summarize([ingest(update_path, 'diff')], rows)
+    if measure_memory:
+        cases['ingest_initial']['peak_bytes'] = peak_memory(lambda: ingest(csv_path, mode))
+        cases['ingest_update']['peak_bytes'] = peak_memory(lambda: ingest(update_path, 'diff'))
+
+    cases['catalog_build'] = summarize([timed(reload_catalog) for _ in range(max(3, iterations // 4))], rows)
+    if measure_memory:
+        cases['catalog_build']['peak_bytes'] = peak_memory(reload_catalog)
+
+    client = app.test_client()
+    headers = {}
+    if config.ui_password:
+        import base64
+        credentials = f'{config.ui_username}:{config.ui_password}'.encode()
+        headers['Authorization'] = 'Basic ' + base64.b64encode(credentials).decode()
+
+    with read_connection() as conn:
+        price_id = conn.execute("SELECT MIN(id) FROM prices").fetchone()[0]
+
+    for name, (method, path, body, cached) in REQUEST_CASES.items():
+        if body and 'price_id' in body:
+            body = dict(body, price_id=price_id)
+
+        def request():
+            response = client.open(path, method=method, json=body, headers=headers)
+            data = response.get_data()  # Drains streamed responses
+            if response.status_code != 200:
+                raise RuntimeError(f"{name}: {method} {path} returned {response.status_code}")
+            return data
+
+        def timed_request():
+            if not cached:
+                result_cache.clear()
+            started = time.perf_counter()
+            request()
+            return time.perf_counter() - started
+
+        request()  # Warm up
+        cases[name] = summarize([timed_request() for _ in range(iterations)])
+        if measure_memory:
+            if not cached:
+                result_cache.clear()
+            cases[name]['peak_bytes'] = peak_memory(request)
+        if name == 'export':
+            cases[name]['response_bytes'] = len(request())
+
+    return results
+
+def timed(call):
+    started = time.perf_counter()
+    call()
+    return time.perf_counter() - started
+
+# --- Comparison --------------------------------------------------------
+
+def compare(current, baseline, tolerance):
+    """
+    Compare the p50 latency and peak memory of every case present in both
+    runs; return (report lines, number of regressions). A case regresses
+    when it is more than tolerance (a fraction) slower or larger, and for
+    latency also more than NOISE_FLOOR_MS slower.
+    """
+    lines, regressions = [], 0
+    for scale, result in current['results'].items():
+        base_result = baseline.get('results', {}).get(scale)
+        if base_result is None:
+            continue
+        for name, case in result['cases'].items():
+            base_case = base_result['cases'].get(name)
+            if base_case is None:
+                continue
+            for metric in ('p50_ms', 'peak_bytes'):
+                if metric not in case or metric not in base_case or not base_case[metric]:
+                    continue
+                now, before = case[metric], base_case[metric]
+                change = now / before - 1
+                regressed = change > tolerance and (metric != 'p50_ms' or now - before > NOISE_FLOOR_MS)
+                regressions += regressed
+                lines.append(f"{scale:>5}x {name:<18} {metric:<10} {before:>14,.3f} -> {now:>14,.3f} "
+                             f"{change:+7.1%}{'  REGRESSION' if regressed else ''}")
+    return lines, regressions
+
+def print_results(results):
+    for scale, result in results['results'].items():
+        print(f"\n{scale}x: {result['rows']:,} rows, {result['csv_bytes'] / 1e6:,.1f} MB CSV")
+        print(f"  {'case':<18} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'per sec':>10} {'peak MB':>9}")
+        for name, case in result['cases'].items():
+            peak = case.get('peak_bytes')
+            print(f"  {name:<18} {case['p50_ms']:>10,.2f} {case['p95_ms']:>10,.2f} {case['p99_ms']:>10,.2f} "
+                  f"{case['per_second'] or 0:>10,.1f} {peak / 1e6 if peak else 0:>9,.1f}")
+
+# --- Entry point -------------------------------------------------------
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the MSP Pricing Tool against synthetic pricelists")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help=f"pricelist sizes as multiples of {BASE_ROWS:,} rows (1000 = 4M rows)")
+    parser.add_argument('--iterations', type=int, default=20, help="timed requests per case")
+    parser.add_argument('--seed', type=int, default=0, help="synthetic pricelist seed")
+    parser.add_argument('--mode', choices=['diff', 'full'], default='full',
+                        help="import mode of the initial ingest")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="skip the extra tracemalloc run per case")
+    parser.add_argument('--work-dir', type=Path,
+                        help="directory for the per-scale data directories (default: a temporary one)")
+    parser.add_argument('--keep', action='store_true', help="keep the generated pricelists and databases")
+    parser.add_argument('--output', type=Path, help="write results as JSON to this file")
+    parser.add_argument('--baseline', type=Path, help="compare against the JSON results of an earlier run")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="relative slowdown or growth counted as a regression (default 0.2)")
+    parser.add_argument('--run-scale', type=int, help=argparse.SUPPRESS)    # Child process
+    parser.add_argument('--result-file', type=Path, help=argparse.SUPPRESS)  # Child process
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.run_scale is not None:
+        results = run_scale(args.run_scale, args.iterations, args.seed, args.mode, not args.no_memory)
+        args.result_file.write_text(json.dumps(results))
+        return 0
+
+    work_dir = args.work_dir or Path(tempfile.mkdtemp(prefix='msp_benchmark_'))
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sqlite': sqlite3.sqlite_version,
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+            'iterations': args.iterations,
+            'seed': args.seed,
+            'mode': args.mode,
+        },
+        'results': {},
+    }
+    try:
+        for scale in args.scales:
+            data_dir = work_dir / f'scale_{scale}x'
+            shutil.rmtree(data_dir, ignore_errors=True)
+            data_dir.mkdir(parents=True)
+            result_file = data_dir / 'result.json'
+            logger.info(f"Benchmarking {scale}x ({BASE_ROWS * scale:,} rows) in {data_dir}")
+
+            command = [sys.executable, str(Path(__file__).resolve()), '--run-scale', str(scale),
+                       '--iterations', str(args.iterations), '--seed', str(args.seed),
+                       '--mode', args.mode, '--result-file', str(result_file)]
+            if args.no_memory:
+                command.append('--no-memory')
+            env = dict(os.environ, MSP_PRICING_DATA_DIR=str(data_dir))
+            subprocess.run(command, env=env, check=True)
+            results['results'][str(scale)] = json.loads(result_file.read_text())
+    finally:
+        if not args.keep and args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+        logger.info(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        lines, regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        print(f"\nCompared with {args.baseline} (tolerance {args.tolerance:.0%}):")
+        print('\n'.join(lines) or "  no cases in common")
+        if regressions:
+            print(f"\n{regressions} regression(s)")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,356 @@
+"""
+In-memory price catalog for MSP Pricing Application
+Holds the prices table as NumPy column arrays so queries never touch SQLite
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import CATALOG_REFRESH_SECONDS
+from db import read_connection
+from suggest import SuggestIndex
+from fuzzy import FuzzyIndex, load_synonyms
+from search import BM25_WEIGHTS
+
+logger = logging.getLogger(__name__)
+
+# Text columns returned by /api/query, stored dictionary-encoded
+TEXT_COLUMNS = [
+    'ProductTitle', 'SkuTitle', 'TermDuration', 'TermDurationHuman', 'BillingPlan',
+    'Currency', 'Segment', 'SkuDescription', 'Publisher'
+]
+
+# Numeric columns returned by /api/query; the derived ones are stored at import
+NUMERIC_COLUMNS = ['UnitPrice', 'ERPPrice', 'MarkupPercent', 'ProfitPerLicense']
+
+# Columns matched by the free-text search filter
+SEARCH_COLUMNS = ['ProductTitle', 'SkuTitle', 'SkuDescription']
+
+# Equality filters accepted by select(), keyed by request field
+FILTER_COLUMNS = {
+    'product': 'ProductTitle',
+    'segment': 'Segment',
+    'term': 'TermDuration',
+    'billing': 'BillingPlan',
+}
+
+class EncodedColumn:
+    """
+    Dictionary-encoded text column.
+    values holds the sorted distinct strings, codes indexes into it per row
+    (-1 for NULL). Because values is sorted, comparing codes is equivalent to
+    comparing the strings themselves.
+    """
+
+    def __init__(self, series):
+        codes, values = pd.factorize(series, sort=True)
+        self.codes = codes.astype(np.int32)
+        self.values = np.asarray(values, dtype=object)
+        # Trailing None lets NULL rows (code -1) decode without a branch
+        self._decoder = np.append(self.values, None)
+        # Lowercased values, and a trailing '' for NULL (built on first search)
+        self._lowered = None
+
+    def decode(self, rows):
+        """Return the string values for the given row indices"""
+        return self._decoder[self.codes[rows]]
+
+    def lookup(self, value):
+        """Return the code for value, or None if it does not occur"""
+        pos = int(np.searchsorted(self.values, value))
+        if pos < len(self.values) and self.values[pos] == value:
+            return pos
+        return None
+
+    def compare(self, rows, value):
+        """
+        Return (greater, equal) masks comparing the given rows to value,
+        using the same ordering as the dictionary (NULL sorts first).
+        """
+        codes = self.codes[rows]
+        if value is None:
+            return codes >= 0, codes == -1
+        pos = int(np.searchsorted(self.values, value))
+        if pos < len(self.values) and self.values[pos] == value:
+            return codes > pos, codes == pos
+        return codes >= pos, np.zeros(len(codes), dtype=bool)
+
+    def lowered(self):
+        """Return the lowercased values, with a trailing '' for NULL"""
+        if self._lowered is None:
+            self._lowered = [str(value).lower() for value in self.values] + ['']
+        return self._lowered
+
+    def contains(self, needle):
+        """Boolean row mask of case-insensitive substring matches"""
+        # A plain loop over the distinct values beats the pandas str methods here
+        lowered = self.lowered()
+        hits = np.fromiter((needle in value for value in lowered), dtype=bool, count=len(lowered))
+        return hits[self.codes]
+
+class PriceCatalog:
+    """Immutable columnar snapshot of the prices table"""
+
+    def __init__(self, frame, version, synonyms=None):
+        self.version = version
+        self.size = len(frame)
+        self.ids = frame['id'].to_numpy(dtype=np.int64)
+        self.numeric = {
+            column: pd.to_numeric(frame[column], errors='coerce').fillna(0).to_numpy(dtype=float)
+            for column in NUMERIC_COLUMNS
+        }
+        self.text = {column: EncodedColumn(frame[column]) for column in TEXT_COLUMNS}
+        self.suggestions = SuggestIndex.from_columns(self.text)
+        self.fuzzy = FuzzyIndex(self.text, synonyms)
+
+        # Default sort order: ProductTitle, SkuTitle, id
+        self.order = np.lexsort((
+            self.ids,
+            self.text['SkuTitle'].codes,
+            self.text['ProductTitle'].codes,
+        ))
+        self.position = np.empty(self.size, dtype=np.int64)
+        self.position[self.order] = np.arange(self.size)
+
+        # id -> row index lookup
+        self._id_order = np.argsort(self.ids, kind='stable')
+        self._sorted_ids = self.ids[self._id_order]
+
+    def rows_for_ids(self, ids):
+        """Map price ids to row indices, -1 for ids not in this snapshot"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.size == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted_ids, ids), self.size - 1)
+        found = self._sorted_ids[pos] == ids
+        return np.where(found, self._id_order[pos], -1)
+
+    def search_ranking(self, text):
+        """
+        Match and rank a search in memory: returns (ids, scores) for select()
+        of the rows containing every search word as a case-insensitive
+        substring of a search column. Scores weight each word found by its
+        column, as the bm25 columns (lower score is better).
+        """
+        scores = np.zeros(self.size)
+        mask = np.ones(self.size, dtype=bool)
+        for word in text.lower().split():
+            found = np.zeros(self.size, dtype=bool)
+            for column, weight in zip(SEARCH_COLUMNS, BM25_WEIGHTS):
+                hits = self.text[column].contains(word)
+                found |= hits
+                scores -= weight * hits
+            mask &= found
+            if not mask.any():
+                break
+        rows = np.flatnonzero(mask)
+        return self.ids[rows], scores[rows]
+
+    def fuzzy_ranking(self, text):
+        """
+        Return (ids, scores) of rows fuzzily matching text, in the same form
+        as a full-text ranking for select() (lower score is better).
+        """
+        rows, scores = self.fuzzy.search(text, self.size)
+        return self.ids[rows], -scores
+
+    def select(self, filters, ranking=None):
+        """
+        Return (rows, scores): row indices matching the request filters in
+        display order. filters uses the /api/query field names (product,
+        segment, term, billing, search). ranking is an optional (ids, scores)
+        pair from search_ranking() or fuzzy_ranking(); when given it replaces
+        substring search and rows are ordered by score (returned alongside,
+        else None).
+        """
+        mask = np.ones(self.size, dtype=bool)
+
+        for field, column in FILTER_COLUMNS.items():
+            value = filters.get(field)
+            if not value:
+                continue
+            code = self.text[column].lookup(value)
+            if code is None:
+                empty = np.empty(0, dtype=np.int64)
+                return empty, (np.empty(0) if ranking is not None else None)
+            mask &= self.text[column].codes == code
+
+        if ranking is not None:
+            ids, scores = ranking
+            rows = self.rows_for_ids(ids)
+            keep = rows >= 0
+            rows, scores = rows[keep], scores[keep]
+            keep = mask[rows]
+            rows, scores = rows[keep], scores[keep]
+            order = np.lexsort((self.position[rows], scores))
+            return rows[order], scores[order]
+
+        search = filters.get('search')
+        if search:
+            needle = search.lower()
+            matches = np.zeros(self.size, dtype=bool)
+            for column in SEARCH_COLUMNS:
+                matches |= self.text[column].contains(needle)
+            mask &= matches
+
+        return self.order[mask[self.order]], None
+
+    def sort_key(self, row, score=None):
+        """
+        Keyset pagination key for a row: (ProductTitle, SkuTitle, id),
+        prefixed with the relevance score for ranked results.
+        """
+        key = [
+            self.text['ProductTitle'].decode(row),
+            self.text['SkuTitle'].decode(row),
+            int(self.ids[row]),
+        ]
+        return [float(score)] + key if score is not None else key
+
+    def page(self, rows, scores, after=None, limit=None):
+        """
+        Slice a selection for keyset pagination.
+        Returns (page_rows, page_scores, next_key) where next_key is the
+        sort key to pass as after for the following page, or None.
+        """
+        if after is not None:
+            if scores is not None:
+                score, product, sku, price_id = after
+            else:
+                product, sku, price_id = after
+            gt_p, eq_p = self.text['ProductTitle'].compare(rows, product)
+            gt_s, eq_s = self.text['SkuTitle'].compare(rows, sku)
+            mask = gt_p | (eq_p & (gt_s | (eq_s & (self.ids[rows] > price_id))))
+            if scores is not None:
+                mask = (scores > score) | ((scores == score) & mask)
+                scores = scores[mask]
+            rows = rows[mask]
+
+        next_key = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            if scores is not None:
+                scores = scores[:limit]
+            last = rows[-1]
+            next_key = self.sort_key(last, scores[-1] if scores is not None else None)
+        return rows, scores, next_key
+
+    def records(self, rows):
+        """Build /api/query result dicts for the given row indices"""
+        columns = {
+            'id': self.ids[rows].tolist(),
+            'ProductTitle': self.text['ProductTitle'].decode(rows).tolist(),
+            'SkuTitle': self.text['SkuTitle'].decode(rows).tolist(),
+            'TermDuration': self.text['TermDuration'].decode(rows).tolist(),
+            'TermDurationHuman': self.text['TermDurationHuman'].decode(rows).tolist(),
+            'BillingPlan': self.text['BillingPlan'].decode(rows).tolist(),
+            'UnitPrice': self.numeric['UnitPrice'][rows].tolist(),
+            'ERPPrice': self.numeric['ERPPrice'][rows].tolist(),
+            'MarkupPercent': self.numeric['MarkupPercent'][rows].tolist(),
+            'ProfitPerLicense': self.numeric['ProfitPerLicense'][rows].tolist(),
+            'Currency': self.text['Currency'].decode(rows).tolist(),
+            'Segment': self.text['Segment'].decode(rows).tolist(),
+            'SkuDescription': self.text['SkuDescription'].decode(rows).tolist(),
+            'Publisher': self.text['Publisher'].decode(rows).tolist(),
+        }
+        keys = list(columns)
+        return [dict(zip(keys, values)) for values in zip(*columns.values())]
+
+def read_catalog_version(conn):
+    """Return the import version the catalog is keyed on"""
+    try:
+        row = conn.execute("SELECT value FROM metadata WHERE key = 'last_import'").fetchone()
+        return row[0] if row else None
+    except sqlite3.Error:
+        return None
+
+def build_catalog():
+    """Load the prices table into a new PriceCatalog"""
+    started = time.perf_counter()
+    columns = ', '.join(['id'] + NUMERIC_COLUMNS + TEXT_COLUMNS)
+    with read_connection() as conn:
+        version = read_catalog_version(conn)
+        frame = pd.read_sql_query(f"SELECT {columns} FROM prices", conn)
+        synonyms = load_synonyms(conn)
+
+    catalog = PriceCatalog(frame, version, synonyms)
+    logger.info(f"Built price catalog with {catalog.size} rows "
+                f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return catalog
+
+# Current snapshot. Readers take a reference and keep using it; reload_catalog
+# builds a replacement off to the side and swaps the reference atomically.
+_catalog = None
+_build_lock = threading.Lock()
+_builds_started = 0
+_builds_finished = 0
+_last_check = 0.0
+
+def _rebuild():
+    """Build a new snapshot and swap it in; call with _build_lock held"""
+    global _catalog, _builds_started, _builds_finished, _last_check
+    _builds_started += 1
+    try:
+        _catalog = build_catalog()
+    except Exception as e:
+        logger.error(f"Error building price catalog: {e}", exc_info=True)
+    _builds_finished += 1
+    _last_check = time.monotonic()
+    return _catalog
+
+def reload_catalog():
+    """
+    Rebuild the catalog from the database and swap it in.
+    A caller that waited for another build rebuilds again, unless that build
+    started after the call: it has then read data at least as new.
+    """
+    seen = _builds_started
+    with _build_lock:
+        if _builds_started > seen:
+            return _catalog
+        return _rebuild()
+
+def _first_catalog():
+    """Build the first snapshot; requests waiting on a build in progress share it"""
+    seen = _builds_finished
+    with _build_lock:
+        if _builds_finished > seen:
+            return _catalog  # Built (or failed) while this request waited
+        return _rebuild()
+
+def current_catalog():
+    """Return the current snapshot without building or refreshing it (None if not built)"""
+    return _catalog
+
+def get_catalog():
+    """
+    Return the current catalog snapshot, or None if it cannot be built.
+    Periodically checks whether another process has imported new prices.
+    Only requests arriving before the first snapshot wait on a build, and
+    concurrent ones share it; later reloads run in a background thread while
+    readers keep using the previous snapshot.
+    """
+    global _last_check
+    catalog = _catalog
+    if catalog is None:
+        return _first_catalog()
+
+    if time.monotonic() - _last_check < CATALOG_REFRESH_SECONDS:
+        return catalog
+    if not _build_lock.acquire(blocking=False):
+        return catalog  # Reload already in progress
+    try:
+        _last_check = time.monotonic()
+        with read_connection() as conn:
+            version = read_catalog_version(conn)
+    finally:
+        _build_lock.release()
+
+    if version != catalog.version:
+        logger.info("Database import changed, reloading price catalog in the background")
+        threading.Thread(target=reload_catalog, name='catalog-reload', daemon=True).start()
+    return catalog
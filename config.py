@@ -15,6 +15,58 @@ DB_NAME = "nce_pricing.db"
 PORT = 5000
 HOST = "0.0.0.0"  # Network accessible
 
+# SQLite connection settings
+DB_BUSY_TIMEOUT_MS = 10000           # Wait this long for a lock before failing
+DB_CACHE_SIZE_KIB = 16384            # Page cache per connection
+DB_MMAP_SIZE = 256 * 1024 * 1024     # Memory-mapped I/O window
+DB_POOL_SIZE = 8                     # Idle read connections kept open
+DB_STATEMENT_CACHE_SIZE = 128        # Prepared statements cached per connection
+
+# In-memory catalog settings
+CATALOG_REFRESH_SECONDS = 5  # How often to check the database for a newer import
+
+# /api/query pagination
+QUERY_PAGE_SIZE = 100        # Rows per page when the request gives no limit
+QUERY_MAX_PAGE_SIZE = 1000   # Upper bound on a requested limit
+STREAM_BATCH_SIZE = 500      # Rows fetched and serialized per chunk when streaming
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024       # Memory for cached /api/query responses
+RESULT_CACHE_MAX_ENTRY_BYTES = 2 * 1024 * 1024  # Larger responses are not cached
+
+# Fuzzy search, used when a search has no exact matches
+FUZZY_WORD_SIMILARITY = 0.4  # Trigram similarity needed for a typed word to match a word
+FUZZY_MIN_SCORE = 0.6        # Average word match a row needs to be returned
+FUZZY_MAX_WORD_MATCHES = 32  # Closest indexed words considered per typed word
+FUZZY_MAX_WORDS = 8          # Typed words considered (after expanding abbreviations)
+
+# /api/suggest
+SUGGEST_LIMIT = 10           # Completions returned when the request gives no limit
+SUGGEST_MAX_LIMIT = 25       # Upper bound on a requested limit
+
+# Quotes
+QUOTE_MAX_LINES = 200        # Line items accepted by /api/quotes/batch
+GRID_MAX_CELLS = 200000      # SKUs x margins x quantities accepted by /api/quotes/grid
+GRID_CACHE_MAX_BYTES = 32 * 1024 * 1024        # Memory for cached /api/quotes/grid responses
+GRID_CACHE_MAX_ENTRY_BYTES = 8 * 1024 * 1024   # Larger grids are not cached
+
+# Adaptive indexes
+AUTO_INDEX_MIN_HITS = 20         # Queries using a filter combination before it gets its own index
+AUTO_INDEX_MAX = 8               # Most composite indexes built from recorded usage
+QUERY_USAGE_FLUSH_SECONDS = 60   # How often recorded filter usage is saved to the database
+
+# Production web server (waitress)
+WSGI_THREADS = 16             # Requests handled at once
+WSGI_CONNECTION_LIMIT = 200   # Open connections accepted; more wait in the listen backlog
+WSGI_CHANNEL_TIMEOUT = 120    # Idle keep-alive connections are closed after this many seconds
+WSGI_SHUTDOWN_SECONDS = 10    # Time given to requests in progress when the server stops
+
+# Slow-query log
+SLOW_QUERY_MS = 100          # Statements taking at least this long are logged with their plan
+SLOW_QUERY_LOG_SIZE = 100    # Most recent slow statements kept for /api/admin/slow-queries
+SLOW_QUERY_MAX_PARAMS = 50   # Parameters kept per logged statement
+
+# CSV import
+IMPORT_CHUNK_ROWS = 20000    # Rows parsed and written per chunk; bounds import memory
+
 # Paths - handle PyInstaller frozen executable
 if getattr(sys, 'frozen', False):
     # Running as compiled executable
@@ -23,19 +75,34 @@ else:
     # Running as script
     BASE_DIR = Path(__file__).parent.absolute()
 
-DATA_DIR = BASE_DIR / "data"
+# MSP_PRICING_DATA_DIR points the application at another data directory
+# (database, settings, key), e.g. for benchmarks
+DATA_DIR = Path(os.environ.get('MSP_PRICING_DATA_DIR') or BASE_DIR / "data")
+DB_PATH = DATA_DIR / DB_NAME
 LOGS_DIR = BASE_DIR / "logs"
 CONFIG_FILE = DATA_DIR / "config.json"
 KEY_FILE = DATA_DIR / ".key"
 
 # Ensure directories exist
-DATA_DIR.mkdir(exist_ok=True)
+DATA_DIR.mkdir(parents=True, exist_ok=True)
 LOGS_DIR.mkdir(exist_ok=True)
 
 # Microsoft Partner Center API settings
 AUTHORITY = "https://login.microsoftonline.com"
 SCOPE = ["https://api.partnercenter.microsoft.com/user_impersonation"]
+TOKEN_CACHE_FILE = DATA_DIR / "token_cache.bin"  # Encrypted MSAL token cache
+TOKEN_REFRESH_MARGIN_SECONDS = 300               # Refresh access tokens this long before expiry
 PARTNER_CENTER_API = "https://api.partnercenter.microsoft.com/v1"
+PRICELIST_PATH = "/ratecards/azure"
+
+# Pricelist download settings
+DOWNLOAD_DIR = DATA_DIR / "downloads"  # Spooled pages for resuming downloads
+API_PAGE_SIZE = 2000                   # Items requested per page
+API_DOWNLOAD_WORKERS = 4               # Pages in flight at once
+API_MAX_RETRIES = 5                    # Retries per page on throttling/server errors
+API_BACKOFF_SECONDS = 1.0              # First retry delay, doubled on each retry
+API_TIMEOUT_SECONDS = 60               # Per-request timeout
+API_RESUME_MAX_AGE_HOURS = 12          # Discard spooled pages older than this
 
 # Encryption key management
 def get_or_create_key():
@@ -179,6 +246,14 @@ class Config:
     def update_frequency_days(self, value):
         self.set('update_frequency_days', value)
 
+    @property
+    def import_mode(self):
+        return self.get('import_mode', 'diff')  # 'diff' or 'full'
+
+    @import_mode.setter
+    def import_mode(self, value):
+        self.set('import_mode', value)
+
     @property
     def last_update(self):
         return self.get('last_update')
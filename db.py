@@ -0,0 +1,279 @@
+"""
+SQLite connection management for MSP Pricing Application
+Reuses read connections across requests and serializes all writers
+"""
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+
+from config import (DB_PATH, DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_KIB,
+                    DB_MMAP_SIZE, DB_POOL_SIZE, DB_STATEMENT_CACHE_SIZE)
+
+logger = logging.getLogger(__name__)
+
+# Callbacks notified of every statement run on a pooled connection
+_query_observers = []
+
+def add_query_observer(callback):
+    """
+    Register callback(sql, parameters, seconds, rows) to be called once a
+    statement on a pooled connection is finished with. seconds is the time
+    spent executing it and fetching its rows; rows is the number of rows
+    fetched, or for writes the number changed (None if unknown).
+    """
+    _query_observers.append(callback)
+
+def notify_query_observers(sql, parameters, seconds, rows):
+    """Pass a finished statement to the observers; they must never break a query"""
+    for callback in _query_observers:
+        try:
+            callback(sql, parameters, seconds, rows)
+        except Exception as e:
+            logger.error(f"Query observer {callback!r} failed: {e}", exc_info=True)
+
+class ObservedCursor(sqlite3.Cursor):
+    """
+    Cursor that times its statements for the query observers. Time spent in
+    execute and the fetch methods is added up; the statement is reported
+    when all its rows are fetched, or when the cursor runs another one, is
+    closed or is released. Rows read by iterating over the cursor are not
+    counted (that would slow every row).
+    """
+
+    _statement = None
+
+    def _begin(self, sql, parameters, call, *args):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            self._statement = [sql, parameters, time.perf_counter() - started, None]
+
+    def _fetched(self, started, rows):
+        if self._statement is not None:
+            self._statement[2] += time.perf_counter() - started
+            self._statement[3] = (self._statement[3] or 0) + rows
+
+    def _finish(self):
+        statement, self._statement = self._statement, None
+        if statement is None or not _query_observers:
+            return
+        sql, parameters, seconds, rows = statement
+        if rows is None and self.rowcount >= 0:
+            rows = self.rowcount
+        notify_query_observers(sql, parameters, seconds, rows)
+
+    def execute(self, sql, parameters=()):
+        return self._begin(sql, parameters, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._begin(sql, None, super().executemany, sql, seq_of_parameters)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(started, len(rows))
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows))
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+class ObservedConnection(sqlite3.Connection):
+    """Connection whose cursors, including those of execute(), are ObservedCursors"""
+
+    def cursor(self, factory=ObservedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class ConnectionPool:
+    """
+    Pool of tuned SQLite connections.
+
+    Readers check out an idle connection for the duration of a request; a
+    thread that nests read_connection() calls keeps getting the connection it
+    already holds. Up to pool_size idle connections are kept open for reuse.
+    All writes go through a single writer connection guarded by a reentrant
+    lock, so writers in this process queue instead of failing with
+    "database is locked". WAL journaling lets readers keep working while a
+    write is in progress.
+    """
+
+    def __init__(self, path, pool_size=DB_POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._idle = []
+        self._idle_lock = threading.Lock()
+        self._local = threading.local()
+        self._writer = None
+        self._write_lock = threading.RLock()
+        self._stats = {
+            'connections_opened': 0,
+            'read_checkouts': 0,
+            'read_reuses': 0,
+            'write_transactions': 0,
+            'write_wait_seconds': 0.0,
+        }
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _connect(self):
+        """Open a new connection with the standard pragmas applied"""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+            factory=ObservedConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+        conn.execute(f"PRAGMA cache_size = -{int(DB_CACHE_SIZE_KIB)}")
+        conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        self._count('connections_opened')
+        return conn
+
+    @contextmanager
+    def read_connection(self):
+        """Check out a read connection for the current thread"""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            yield held
+            return
+
+        with self._idle_lock:
+            conn = self._idle.pop() if self._idle else None
+        self._count('read_checkouts')
+        if conn is None:
+            conn = self._connect()
+        else:
+            self._count('read_reuses')
+
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    def _release(self, conn):
+        """Return a read connection to the idle list, or close it if full"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._idle_lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def write_connection(self):
+        """
+        Hold the writer connection for a transaction.
+        Commits when the outermost block exits, rolls back on error.
+        """
+        started = time.perf_counter()
+        with self._write_lock:
+            self._count('write_wait_seconds', time.perf_counter() - started)
+            if self._writer is None:
+                self._writer = self._connect()
+                self._writer.execute("PRAGMA journal_mode = WAL")
+                self._writer.execute("PRAGMA synchronous = NORMAL")
+                # Imports stage and sort whole pricelists; keep that on disk
+                self._writer.execute("PRAGMA temp_store = FILE")
+            conn = self._writer
+
+            depth = getattr(self._local, 'write_depth', 0)
+            self._local.write_depth = depth + 1
+            try:
+                if depth == 0 and not conn.in_transaction:
+                    # Explicit BEGIN: sqlite3 only opens one implicitly before
+                    # DML, which would leave DDL (e.g. a table swap) autocommitted
+                    conn.execute("BEGIN IMMEDIATE")
+                yield conn
+                if depth == 0:
+                    conn.commit()
+                    self._count('write_transactions')
+            except Exception:
+                if depth == 0:
+                    conn.rollback()
+                raise
+            finally:
+                self._local.write_depth = depth
+
+    def stats(self):
+        """Return pool statistics"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        with self._idle_lock:
+            stats['idle_connections'] = len(self._idle)
+        stats['pool_size'] = self.pool_size
+        stats['write_wait_seconds'] = round(stats['write_wait_seconds'], 6)
+        return stats
+
+    def close_all(self):
+        """Close all idle connections and the writer"""
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+# Process-wide pool shared by the web app and the import code
+pool = ConnectionPool(DB_PATH)
+
+def open_read_only():
+    """
+    Open an unpooled, unobserved read-only connection, closed on leaving the
+    with block. Use it for EXPLAIN: SQLite never re-prepares a cached EXPLAIN
+    statement, so a pooled connection keeps reporting plans from before an import.
+    """
+    return closing(sqlite3.connect(f"{DB_PATH.as_uri()}?mode=ro", uri=True))
+
+def read_connection():
+    """Context manager yielding a pooled read connection"""
+    return pool.read_connection()
+
+def write_connection():
+    """Context manager yielding the serialized writer connection"""
+    return pool.write_connection()
@@ -0,0 +1,161 @@
+"""
+Fuzzy search for MSP Pricing Application
+Matches misspelled and abbreviated searches against a trigram index of title words
+"""
+import logging
+import re
+import sqlite3
+from collections import defaultdict
+
+import numpy as np
+
+from config import (FUZZY_WORD_SIMILARITY, FUZZY_MIN_SCORE,
+                    FUZZY_MAX_WORD_MATCHES, FUZZY_MAX_WORDS)
+
+logger = logging.getLogger(__name__)
+
+# Indexed columns and the weight of a word match in each. SKU titles are the
+# most specific, so a SKU that names what was typed ranks above its siblings.
+FUZZY_FIELDS = {'ProductTitle': 0.9, 'SkuTitle': 1.0, 'SkuDescription': 0.7}
+
+# Abbreviations seeded into the search_synonyms table: typed word -> words searched
+DEFAULT_SYNONYMS = {
+    'm365': 'microsoft 365',
+    'o365': 'office 365',
+    'd365': 'dynamics 365',
+    'bb': 'business basic',
+    'bs': 'business standard',
+    'bp': 'business premium',
+    'ems': 'enterprise mobility security',
+    'aad': 'entra id',
+    'mde': 'defender for endpoint',
+    'mdo': 'defender for office 365',
+    'mdi': 'defender for identity',
+    'exo': 'exchange online',
+    'spo': 'sharepoint online',
+    'pbi': 'power bi',
+    'ppu': 'premium per user',
+    'edu': 'education',
+    'gov': 'government',
+}
+
+def create_synonyms_table(cursor):
+    """Create the search_synonyms table and add any missing DEFAULT_SYNONYMS"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS search_synonyms (
+            term TEXT PRIMARY KEY,
+            expansion TEXT NOT NULL
+        )
+    """)
+    cursor.executemany("INSERT OR IGNORE INTO search_synonyms (term, expansion) VALUES (?, ?)",
+                       DEFAULT_SYNONYMS.items())
+
+def load_synonyms(conn):
+    """Return {term: expansion} from search_synonyms, or the defaults if it is missing"""
+    try:
+        rows = conn.execute("SELECT term, expansion FROM search_synonyms").fetchall()
+    except sqlite3.OperationalError:
+        return dict(DEFAULT_SYNONYMS)
+    return {row[0].lower(): row[1].lower() for row in rows}
+
+def words(text):
+    """Lowercase words of text"""
+    return re.findall(r'\w+', text.lower()) if text else []
+
+def trigrams(word):
+    """Trigrams of a word, padded like pg_trgm so short words still have some"""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class FuzzyIndex:
+    """
+    Trigram index over the words of the FUZZY_FIELDS values.
+
+    A typed word matches indexed words whose trigram similarity (shared
+    trigrams over distinct trigrams of both) is at least
+    FUZZY_WORD_SIMILARITY; only the FUZZY_MAX_WORD_MATCHES closest are used.
+    A row scores, for each typed word, its best weighted match in any field,
+    averaged over the typed words; rows scoring below FUZZY_MIN_SCORE are
+    dropped. Abbreviations are expanded through the synonym table first.
+    """
+
+    def __init__(self, columns, synonyms=None):
+        """columns: {column name: EncodedColumn} covering FUZZY_FIELDS"""
+        self.columns = {field: columns[field] for field in FUZZY_FIELDS}
+        self.synonyms = synonyms if synonyms is not None else dict(DEFAULT_SYNONYMS)
+
+        vocabulary = {}
+        postings = {field: defaultdict(list) for field in FUZZY_FIELDS}
+        for field, column in self.columns.items():
+            for value_index, value in enumerate(column.values):
+                for word in set(words(value)):
+                    word_id = vocabulary.setdefault(word, len(vocabulary))
+                    postings[field][word_id].append(value_index)
+        # Word id -> value indices containing it, per field
+        self.postings = {
+            field: {word_id: np.array(values, dtype=np.int64) for word_id, values in lists.items()}
+            for field, lists in postings.items()
+        }
+        self.vocabulary = list(vocabulary)
+
+        by_trigram = defaultdict(list)
+        self.trigram_counts = np.zeros(len(self.vocabulary), dtype=np.int32)
+        for word_id, word in enumerate(self.vocabulary):
+            grams = trigrams(word)
+            self.trigram_counts[word_id] = len(grams)
+            for gram in grams:
+                by_trigram[gram].append(word_id)
+        self.by_trigram = {gram: np.array(ids, dtype=np.int32) for gram, ids in by_trigram.items()}
+
+    def expand(self, text):
+        """Typed words with abbreviations replaced by their expansions"""
+        expanded = []
+        for word in words(text):
+            expanded.extend(words(self.synonyms.get(word, word)))
+        return expanded[:FUZZY_MAX_WORDS]
+
+    def word_matches(self, word):
+        """Return (word ids, similarities) of the indexed words closest to word"""
+        grams = trigrams(word)
+        lists = [self.by_trigram[gram] for gram in grams if gram in self.by_trigram]
+        if not lists:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.vocabulary))
+        candidates = np.flatnonzero(shared)
+        shared = shared[candidates]
+        similarity = shared / (len(grams) + self.trigram_counts[candidates] - shared)
+
+        keep = similarity >= FUZZY_WORD_SIMILARITY
+        candidates, similarity = candidates[keep], similarity[keep]
+        if len(candidates) > FUZZY_MAX_WORD_MATCHES:
+            best = np.argpartition(-similarity, FUZZY_MAX_WORD_MATCHES)[:FUZZY_MAX_WORD_MATCHES]
+            candidates, similarity = candidates[best], similarity[best]
+        return candidates, similarity
+
+    def search(self, text, size):
+        """
+        Return (rows, scores) for the rows of a catalog of size rows that
+        match text, unordered; scores are between FUZZY_MIN_SCORE and 1.
+        """
+        typed = self.expand(text)
+        if not typed:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        total = np.zeros(size)
+        for word in typed:
+            word_ids, similarity = self.word_matches(word)
+            best = np.zeros(size)
+            for field, weight in FUZZY_FIELDS.items():
+                column = self.columns[field]
+                # Trailing slot scores NULL values (code -1) as no match
+                value_scores = np.zeros(len(column.values) + 1)
+                for word_id, score in zip(word_ids.tolist(), similarity.tolist()):
+                    values = self.postings[field].get(word_id)
+                    if values is not None:
+                        value_scores[values] = np.maximum(value_scores[values], score * weight)
+                np.maximum(best, value_scores[column.codes], out=best)
+            total += best
+
+        scores = total / len(typed)
+        rows = np.flatnonzero(scores >= FUZZY_MIN_SCORE)
+        return rows, scores[rows]
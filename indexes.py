@@ -0,0 +1,134 @@
+"""
+Adaptive price indexes for MSP Pricing Application
+Records which filter combinations are queried and picks composite indexes for them
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from config import AUTO_INDEX_MIN_HITS, AUTO_INDEX_MAX, QUERY_USAGE_FLUSH_SECONDS
+from catalog import FILTER_COLUMNS
+from db import write_connection
+
+logger = logging.getLogger(__name__)
+
+# Name prefix of indexes built from recorded usage; anything else is static
+AUTO_INDEX_PREFIX = 'idx_auto_'
+
+# Default result order after the filters (id is the implicit rowid)
+SORT_COLUMNS = ('ProductTitle', 'SkuTitle')
+
+def create_usage_table(cursor):
+    """Create the table of filter combination usage counts"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS query_usage (
+            filters TEXT PRIMARY KEY,
+            hits INTEGER NOT NULL DEFAULT 0,
+            last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def filter_combination(data):
+    """
+    Return the equality filters used by an /api/query request as a key:
+    the request field names in FILTER_COLUMNS order, comma separated
+    ('' when unfiltered). Search text is not an equality filter.
+    """
+    return ','.join(field for field in FILTER_COLUMNS if data.get(field))
+
+def index_columns(combination):
+    """
+    Columns of the composite index serving a filter combination: the
+    filtered columns, then the sort columns not already among them, so rows
+    come out of the index already in result order.
+    """
+    filtered = [FILTER_COLUMNS[field] for field in combination.split(',') if field]
+    return tuple(filtered + [column for column in SORT_COLUMNS if column not in filtered])
+
+def auto_indexes(cursor, exclude=()):
+    """
+    Return {index name: columns} for the most used filter combinations of
+    two or more filters (single filters are covered by the static indexes).
+    Combinations whose columns are in exclude are skipped.
+    """
+    try:
+        rows = cursor.execute("""
+            SELECT filters FROM query_usage
+            WHERE filters LIKE '%,%' AND hits >= ?
+            ORDER BY hits DESC, filters
+        """, (AUTO_INDEX_MIN_HITS,)).fetchall()
+    except sqlite3.OperationalError:
+        return {}  # No usage recorded yet
+
+    chosen = {}
+    for (combination,) in rows:
+        columns = index_columns(combination)
+        if columns in exclude or columns in chosen.values():
+            continue
+        chosen[AUTO_INDEX_PREFIX + combination.replace(',', '_')] = columns
+        if len(chosen) >= AUTO_INDEX_MAX:
+            break
+    return chosen
+
+def explain(conn, query, params):
+    """
+    Return the EXPLAIN QUERY PLAN of a query as a dict with the plan steps
+    and whether it scans the whole table or sorts in a temp B-tree.
+    Full-text searches show as a SCAN of the virtual table but use its index.
+    """
+    steps = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+    return {
+        'plan': steps,
+        'full_scan': any(step.startswith('SCAN') and 'VIRTUAL TABLE' not in step for step in steps),
+        'temp_sort': any('TEMP B-TREE' in step for step in steps),
+    }
+
+class QueryUsage:
+    """
+    Counts filter combinations in memory and adds them to query_usage in the
+    background every QUERY_USAGE_FLUSH_SECONDS, so requests never wait on
+    the writer.
+    """
+
+    def __init__(self, flush_seconds=QUERY_USAGE_FLUSH_SECONDS):
+        self.flush_seconds = flush_seconds
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._flushing = False
+
+    def record(self, data):
+        """Count the filter combination of an /api/query request"""
+        with self._lock:
+            self._pending[filter_combination(data)] += 1
+            due = (not self._flushing
+                   and time.monotonic() - self._last_flush >= self.flush_seconds)
+            if due:
+                self._flushing = True
+        if due:
+            threading.Thread(target=self.flush, name='query-usage', daemon=True).start()
+
+    def flush(self):
+        """Write the pending counts to query_usage"""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._last_flush = time.monotonic()
+        try:
+            if pending:
+                with write_connection() as conn:
+                    create_usage_table(conn.cursor())
+                    conn.executemany("""
+                        INSERT INTO query_usage (filters, hits) VALUES (?, ?)
+                        ON CONFLICT(filters) DO UPDATE
+                        SET hits = hits + excluded.hits, last_used = CURRENT_TIMESTAMP
+                    """, pending.items())
+        except sqlite3.Error as e:
+            logger.warning(f"Could not save query usage: {e}")
+        finally:
+            with self._lock:
+                self._flushing = False
+
+# Process-wide usage counter fed by /api/query and /api/export
+query_usage = QueryUsage()
@@ -58,6 +58,7 @@ if %errorLevel% equ 0 (
 
 echo Installing service...
 nssm install %SERVICE_NAME% "%EXE_PATH%"
+nssm set %SERVICE_NAME% AppParameters --service
 
 REM Configure service
 echo Configuring service...
@@ -69,6 +70,8 @@ nssm set %SERVICE_NAME% AppStdout "%APP_DIR%logs\service_stdout.log"
 nssm set %SERVICE_NAME% AppStderr "%APP_DIR%logs\service_stderr.log"
 nssm set %SERVICE_NAME% AppRotateFiles 1
 nssm set %SERVICE_NAME% AppRotateBytes 10485760
+REM Stop with Ctrl+C and allow in-flight requests to finish (WSGI_SHUTDOWN_SECONDS)
+nssm set %SERVICE_NAME% AppStopMethodConsole 15000
 
 REM Configure firewall rule
 echo Adding firewall rule...
@@ -0,0 +1,283 @@
+"""
+Load test for MSP Pricing Application
+Drives a running server with concurrent simulated users and reports latency per endpoint
+
+    python -m loadtest --url http://pricing-server:5000 --concurrency 25 --duration 60
+    python -m loadtest --concurrency 25 --duration 120 --ingest pricelist.csv --ingest-at 30
+
+Each simulated user sends one request after another (no think time unless
+--think-ms is given), choosing endpoints by the --mix weights. With
+--ingest, the CSV is imported into the server's database from this process
+partway through the run, as the scheduled updater would, and latency is
+reported separately for before, during and after the import. Run it on the
+server itself for that (MSP_PRICING_DATA_DIR selects the data directory).
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+
+import numpy as np
+import requests
+
+logger = logging.getLogger('loadtest')
+
+# Default share of requests per endpoint
+DEFAULT_MIX = {'filters': 10, 'query': 45, 'price': 25, 'draft': 15, 'export': 5}
+
+# Chance that a query or export carries a search rather than only filters
+SEARCH_SHARE = 0.7
+
+# Price ids seen in query responses, reused for detail and draft requests
+ID_POOL_SIZE = 500
+
+def parse_mix(text):
+    """Parse 'filters=10,query=45,...' into {endpoint: weight}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r} (choose from {', '.join(DEFAULT_MIX)})")
+        mix[name] = float(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("at least one endpoint needs a weight above 0")
+    return mix
+
+class Workload:
+    """
+    Request contents shared by the simulated users: filter values and search
+    words taken from /api/filters, and price ids seen in query responses.
+    """
+
+    def __init__(self, facets):
+        self.facets = facets
+        words = {word.lower() for title in facets.get('products', []) for word in title.split()
+                 if len(word) > 3 and word.isalpha()}
+        self.words = sorted(words) or ['microsoft']
+        self.products = facets.get('products') or [None]
+        self.segments = facets.get('segments') or [None]
+        self.terms = facets.get('terms') or [None]
+        self.ids = deque(maxlen=ID_POOL_SIZE)
+
+    def filters(self, rng):
+        """A query body like one from the UI: a search or a product, often narrowed by segment or term"""
+        if rng.random() < SEARCH_SHARE:
+            body = {'search': ' '.join(rng.sample(self.words, k=min(len(self.words), rng.choice((1, 1, 2)))))}
+        else:
+            body = {'product': rng.choice(self.products)}
+        if rng.random() < 0.5:
+            body['segment'] = rng.choice(self.segments)
+        if rng.random() < 0.3:
+            body['term'] = rng.choice(self.terms)
+        return {key: value for key, value in body.items() if value is not None}
+
+    def price_id(self, rng):
+        ids = self.ids
+        return ids[rng.randrange(len(ids))] if ids else None
+
+class Recorder:
+    """Collects (endpoint, started, seconds, ok, error) samples from the workers"""
+
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def add(self, samples):
+        with self._lock:
+            self.samples.extend(samples)
+
+def send(session, base_url, endpoint, workload, rng, timeout):
+    """Send one request for endpoint; returns None on success or an error string"""
+    if endpoint == 'filters':
+        response = session.get(f'{base_url}/api/filters', timeout=timeout)
+    elif endpoint == 'query':
+        response = session.post(f'{base_url}/api/query', json=workload.filters(rng), timeout=timeout)
+        if response.ok:
+            workload.ids.extend(result['id'] for result in response.json().get('results', [])[:20])
+    elif endpoint in ('price', 'draft'):
+        price_id = workload.price_id(rng)
+        if endpoint == 'price':
+            response = session.get(f'{base_url}/api/price/{price_id}', timeout=timeout)
+        else:
+            body = {'price_id': price_id, 'margin': rng.choice((10, 15, 20, 25, 30)),
+                    'quantity': rng.randint(1, 250)}
+            response = session.post(f'{base_url}/api/draft', json=body, timeout=timeout)
+    else:  # export
+        response = session.post(f'{base_url}/api/export', json=workload.filters(rng),
+                                timeout=timeout, stream=True)
+        for _ in response.iter_content(chunk_size=65536):
+            pass  # Read the whole CSV, as a browser download would
+    return None if response.ok else f'HTTP {response.status_code}'
+
+def user(number, args, workload, recorder, started, stop):
+    """One simulated user: send requests until stop is set"""
+    rng = random.Random(args.seed + number)
+    endpoints, weights = zip(*args.mix.items())
+    session = requests.Session()  # Keeps the connection alive between requests
+    session.auth = (args.user, args.password) if args.password else None
+    samples = []
+    while not stop.is_set():
+        endpoint = rng.choices(endpoints, weights)[0]
+        if endpoint in ('price', 'draft') and not workload.ids:
+            endpoint = 'query'  # Users open prices they found by searching first
+        request_started = time.perf_counter()
+        try:
+            error = send(session, args.url, endpoint, workload, rng, args.timeout)
+        except requests.RequestException as e:
+            error = type(e).__name__
+        samples.append((endpoint, request_started - started, time.perf_counter() - request_started,
+                        error is None, error))
+        if args.think_ms:
+            stop.wait(rng.expovariate(1000 / args.think_ms))
+    session.close()
+    recorder.add(samples)
+
+def run_ingest(args, workload, started, window):
+    """
+    Import args.ingest into the server database after args.ingest_at seconds.
+    A full import renumbers the prices, so the ids seen so far are dropped.
+    """
+    # Imported here: only needed, and only valid, on the server machine
+    from update_db import ingest_csv
+    time.sleep(max(0.0, args.ingest_at - (time.perf_counter() - started)))
+    window['start'] = time.perf_counter() - started
+    logger.info(f"Importing {args.ingest} ({args.ingest_mode} mode) at {window['start']:.1f}s")
+    window['ok'] = ingest_csv(args.ingest, force=True, mode=args.ingest_mode)
+    window['end'] = time.perf_counter() - started
+    if args.ingest_mode == 'full':
+        workload.ids.clear()
+    logger.info(f"Import {'finished' if window['ok'] else 'FAILED'} at {window['end']:.1f}s "
+                f"({window['end'] - window['start']:.1f}s)")
+
+def summarize(samples, seconds):
+    """Request count, errors, throughput and latency percentiles for samples over seconds"""
+    if not samples:
+        return {'requests': 0}
+    latency = np.array([sample[2] for sample in samples]) * 1000
+    errors = [sample[4] for sample in samples if not sample[3]]
+    error_kinds = defaultdict(int)
+    for error in errors:
+        error_kinds[error] += 1
+    return {
+        'requests': len(samples),
+        'errors': len(errors),
+        'error_rate': round(len(errors) / len(samples), 4),
+        'per_second': round(len(samples) / seconds, 2) if seconds > 0 else None,
+        'p50_ms': round(float(np.percentile(latency, 50)), 2),
+        'p95_ms': round(float(np.percentile(latency, 95)), 2),
+        'p99_ms': round(float(np.percentile(latency, 99)), 2),
+        'max_ms': round(float(latency.max()), 2),
+        'error_kinds': dict(error_kinds),
+    }
+
+def report(samples, duration, window):
+    """Summaries per endpoint and overall, split by import phase when an import ran"""
+    phases = {'all': (0, duration)}
+    if window.get('start') is not None:
+        end = window.get('end', duration)
+        phases.update(before=(0, window['start']), during=(window['start'], end), after=(end, duration))
+
+    results = {}
+    for phase, (start, end) in phases.items():
+        # A request belongs to the phase in which it started
+        in_phase = [sample for sample in samples if start <= sample[1] < end]
+        by_endpoint = defaultdict(list)
+        for sample in in_phase:
+            by_endpoint[sample[0]].append(sample)
+        seconds = end - start
+        results[phase] = {endpoint: summarize(by_endpoint[endpoint], seconds) for endpoint in sorted(by_endpoint)}
+        results[phase]['total'] = summarize(in_phase, seconds)
+    return results
+
+def print_report(results, args):
+    print(f"\n{args.concurrency} users against {args.url} for {args.duration:.0f}s")
+    for phase, endpoints in results.items():
+        if phase != 'all':
+            print(f"\n{phase} import:")
+        print(f"  {'endpoint':<10} {'requests':>9} {'errors':>7} {'err %':>7} {'req/s':>9} "
+              f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for endpoint, summary in endpoints.items():
+            if not summary['requests']:
+                continue
+            print(f"  {endpoint:<10} {summary['requests']:>9,} {summary['errors']:>7,} "
+                  f"{summary['error_rate']:>7.2%} {summary['per_second'] or 0:>9,.1f} "
+                  f"{summary['p50_ms']:>9,.1f} {summary['p95_ms']:>9,.1f} {summary['p99_ms']:>9,.1f}")
+    errors = results['all']['total'].get('error_kinds')
+    if errors:
+        print(f"\nErrors: {', '.join(f'{kind} x{count}' for kind, count in errors.items())}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test a running MSP Pricing Tool server")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="server base URL")
+    parser.add_argument('--concurrency', type=int, default=10, help="simulated users sending requests at once")
+    parser.add_argument('--duration', type=float, default=60, help="seconds to run")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="endpoint weights, e.g. filters=10,query=45,price=25,draft=15,export=5")
+    parser.add_argument('--think-ms', type=float, default=0, help="mean pause between a user's requests")
+    parser.add_argument('--timeout', type=float, default=30, help="per-request timeout in seconds")
+    parser.add_argument('--user', default='admin', help="web UI username")
+    parser.add_argument('--password', default='', help="web UI password, if one is set")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for the request mix")
+    parser.add_argument('--ingest', type=Path, help="pricelist CSV to import during the run")
+    parser.add_argument('--ingest-at', type=float, default=None, help="seconds into the run to start the import "
+                                                                       "(default: a third of the duration)")
+    parser.add_argument('--ingest-mode', choices=['diff', 'full'], default='diff', help="import mode")
+    parser.add_argument('--output', type=Path, help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+    args.url = args.url.rstrip('/')
+    if args.ingest_at is None:
+        args.ingest_at = args.duration / 3
+    if args.ingest and not 0 <= args.ingest_at < args.duration:
+        parser.error("--ingest-at must be within the run")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    auth = (args.user, args.password) if args.password else None
+    try:
+        response = requests.get(f'{args.url}/api/filters', auth=auth, timeout=args.timeout)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logger.error(f"Cannot reach {args.url}: {e}")
+        return 2
+    workload = Workload(response.json())
+    logger.info(f"Running {args.concurrency} users for {args.duration:.0f}s against {args.url}")
+
+    recorder = Recorder()
+    stop = threading.Event()
+    window = {}
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(number, args, workload, recorder, started, stop),
+                                name=f'user-{number}', daemon=True)
+               for number in range(args.concurrency)]
+    if args.ingest:
+        threads.append(threading.Thread(target=run_ingest, args=(args, workload, started, window),
+                                        name='ingest', daemon=True))
+    for thread in threads:
+        thread.start()
+
+    stop.wait(args.duration)
+    stop.set()
+    duration = time.perf_counter() - started
+    for thread in threads:
+        thread.join()  # Waits for an import still running
+
+    results = report(recorder.samples, duration, window)
+    print_report(results, args)
+    if args.output:
+        args.output.write_text(json.dumps({'url': args.url, 'concurrency': args.concurrency,
+                                           'duration': round(duration, 2), 'ingest': window,
+                                           'results': results}, indent=2))
+        logger.info(f"\nResults written to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
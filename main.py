@@ -9,7 +9,7 @@ from pathlib import Path
 import time
 
 # Configure logging first
-from config import LOGGING_CONFIG, BASE_DIR, DB_NAME
+from config import LOGGING_CONFIG, BASE_DIR, DB_PATH
 import logging.config
 logging.config.dictConfig(LOGGING_CONFIG)
 
@@ -17,8 +17,7 @@ logger = logging.getLogger(__name__)
 
 def check_database_exists():
     """Check if database exists"""
-    db_path = BASE_DIR / "data" / DB_NAME
-    return db_path.exists()
+    return DB_PATH.exists()
 
 def initial_setup():
     """Perform initial setup on first run"""
@@ -51,16 +50,12 @@ def initial_setup():
 def get_db_record_count():
     """Get number of records in database"""
     try:
-        import sqlite3
-        db_path = BASE_DIR / "data" / DB_NAME
-        if not db_path.exists():
+        from db import read_connection
+        if not DB_PATH.exists():
             return 0
 
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM prices")
-        count = cursor.fetchone()[0]
-        conn.close()
+        with read_connection() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
         return count
     except:
         return 0
@@ -81,8 +76,26 @@ def run_tray():
     except Exception as e:
         logger.error(f"Tray icon error: {e}", exc_info=True)
 
+def run_service():
+    """
+    Run only the web server, in the main thread so stop signals shut it
+    down gracefully (used when installed as a Windows service)
+    """
+    if sys.platform == 'win32' and getattr(sys, 'frozen', False):
+        # The executable has no console; give it one so NSSM can stop it with Ctrl+C
+        import ctypes
+        ctypes.windll.kernel32.AllocConsole()
+
+    initial_setup()
+    from app import run_server
+    run_server()
+
 def main():
     """Main entry point"""
+    if '--service' in sys.argv:
+        run_service()
+        return
+
     try:
         # Perform initial setup
         initial_setup()
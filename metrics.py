@@ -0,0 +1,239 @@
+"""
+Metrics for MSP Pricing Application
+Counters, gauges and histograms rendered in the Prometheus text exposition format
+"""
+import logging
+import re
+import threading
+from bisect import bisect_left
+from functools import lru_cache
+
+from db import add_query_observer
+
+logger = logging.getLogger(__name__)
+
+# Content type of the text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogram buckets (upper bounds); +Inf is always added
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+IMPORT_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 200, 500, 1000, 5000, 20000)
+
+def escape(value):
+    """Escape a label value"""
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """A named metric with a fixed set of label names and one value per label combination"""
+
+    type = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) for rendering"""
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield '', key, (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labels, key, extra)} {format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Mirror a count kept elsewhere (it must only increase)"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Gauge(Metric):
+    """Value that can go up and down"""
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+    """Distribution of observed values over cumulative buckets"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', key, (('le', format_value(float(bound))),), cumulative
+            yield '_sum', key, (), total
+            yield '_count', key, (), count
+
+class Registry:
+    """
+    The metrics of this process. Collectors are callables run at scrape time
+    that set gauges from other components' statistics (caches, pools).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, callback):
+        with self._lock:
+            self._collectors.append(callback)
+
+    def render(self):
+        """Return every metric in the text exposition format"""
+        with self._lock:
+            collectors, metrics = list(self._collectors), list(self._metrics)
+        for callback in collectors:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Metrics collector {callback!r} failed: {e}", exc_info=True)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# --- Application metrics ----------------------------------------------
+
+http_requests = registry.counter(
+    'msp_http_requests_total', 'HTTP requests handled, by route and status', ('method', 'route', 'status'))
+http_latency = registry.histogram(
+    'msp_http_request_duration_seconds', 'Time to build an HTTP response, by route', ('method', 'route'))
+db_latency = registry.histogram(
+    'msp_db_query_duration_seconds', 'Time executing and fetching SQLite statements', ('operation', 'table'))
+query_rows = registry.histogram(
+    'msp_query_result_rows', 'Rows returned per /api/query page', (), ROW_BUCKETS)
+query_matches = registry.histogram(
+    'msp_query_matching_rows', 'Rows matching each /api/query request', (), ROW_BUCKETS)
+import_latency = registry.histogram(
+    'msp_import_duration_seconds', 'Pricelist import duration', ('source', 'mode'), IMPORT_BUCKETS)
+import_rows = registry.counter(
+    'msp_import_rows_total', 'Pricelist rows processed by imports, by outcome', ('source', 'change'))
+
+# Set at scrape time from component statistics
+last_import_time = registry.gauge(
+    'msp_last_import_timestamp_seconds', 'When the current pricelist was imported (any process)')
+last_import_rows = registry.gauge(
+    'msp_last_import_rows', 'Rows in the last import (any process)')
+last_import_seconds = registry.gauge(
+    'msp_last_import_duration_seconds', 'Duration of the last import (any process)')
+catalog_rows = registry.gauge(
+    'msp_catalog_rows', 'Rows in the in-memory price catalog')
+cache_entries = registry.gauge(
+    'msp_cache_entries', 'Entries held by a response cache', ('cache',))
+cache_bytes = registry.gauge(
+    'msp_cache_bytes', 'Bytes held by a response cache', ('cache',))
+cache_lookups = registry.counter(
+    'msp_cache_lookups_total', 'Response cache lookups, by result', ('cache', 'result'))
+cache_evictions = registry.counter(
+    'msp_cache_evictions_total', 'Entries evicted from a response cache to stay within its size', ('cache',))
+pool_idle = registry.gauge(
+    'msp_db_pool_idle_connections', 'Idle SQLite read connections in the pool')
+pool_size = registry.gauge(
+    'msp_db_pool_size', 'Most idle read connections the pool keeps')
+pool_events = registry.counter(
+    'msp_db_pool_events_total', 'SQLite connection pool activity, by event', ('event',))
+pool_write_wait = registry.counter(
+    'msp_db_write_wait_seconds_total', 'Time spent waiting for the writer connection')
+
+# Operation and main table of a statement, for low-cardinality labels
+OPERATION_PATTERN = re.compile(r'\s*(\w+)(?:(?:\s+OR\s+\w+)?\s+(?:(?:temp|main)\.)?(\w+))?', re.IGNORECASE)
+TABLE_PATTERN = re.compile(
+    r'\b(?:FROM|INTO|TABLE|ON)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(?:(?:temp|main)\.)?(\w+)',
+    re.IGNORECASE)
+
+@lru_cache(maxsize=1024)
+def statement_labels(sql):
+    """Return (operation, table) labels for a SQL statement"""
+    match = OPERATION_PATTERN.match(sql)
+    if not match:
+        return 'OTHER', ''
+    operation = match.group(1).upper()
+    if operation == 'UPDATE':
+        return operation, match.group(2) or ''
+    table = TABLE_PATTERN.search(sql)
+    return operation, table.group(1) if table else ''
+
+def observe_query(sql, parameters, seconds, rows):
+    """db query observer: time every statement by operation and table"""
+    operation, table = statement_labels(sql)
+    db_latency.observe(seconds, operation=operation, table=table)
+
+def record_import(source, mode, seconds, counts):
+    """Record a completed pricelist import"""
+    import_latency.observe(seconds, source=source, mode=mode)
+    for change in ('inserted', 'updated', 'deleted', 'unchanged'):
+        import_rows.inc(counts.get(change, 0), source=source, change=change)
+
+# Time every SQLite statement of this process
+add_query_observer(observe_query)
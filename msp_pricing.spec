@@ -13,7 +13,9 @@ a = Analysis(
     ],
     hiddenimports=[
         'flask',
+        'waitress',
         'pandas',
+        'numpy',
         'msal',
         'requests',
         'pystray',
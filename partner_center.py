@@ -0,0 +1,336 @@
+"""
+Partner Center pricelist downloader for MSP Pricing Application
+Fetches paged pricelist responses concurrently, with retries, resume and
+conditional requests, and keeps a compressed copy of the last download
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+from config import (PARTNER_CENTER_API, PRICELIST_PATH, DOWNLOAD_DIR, API_PAGE_SIZE,
+                    API_DOWNLOAD_WORKERS, API_MAX_RETRIES, API_BACKOFF_SECONDS,
+                    API_TIMEOUT_SECONDS, API_RESUME_MAX_AGE_HOURS)
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying: throttling and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Header carrying the continuation token on follow-up page requests
+CONTINUATION_HEADER = 'MS-ContinuationToken'
+
+# Where the pages of the last imported download are kept for offline re-import
+CACHE_DIR = DOWNLOAD_DIR / "pricelist-last"
+
+class DownloadError(Exception):
+    """A page could not be downloaded, or the download came back incomplete"""
+
+def next_link(page):
+    """Return the continuation link {'uri', 'token'} of a page, or None"""
+    link = (page.get('links') or {}).get('next')
+    if not link or not link.get('uri'):
+        return None
+    token = None
+    for header in link.get('headers') or []:
+        if header.get('key') == CONTINUATION_HEADER:
+            token = header.get('value')
+    return {'uri': link['uri'], 'token': token}
+
+def retry_after(response):
+    """Seconds the server asked us to wait (Retry-After), or None"""
+    try:
+        return max(0.0, float(response.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
+
+class PricelistDownloader:
+    """
+    Downloads a paged Partner Center pricelist.
+
+    Pages use the Partner Center collection format:
+    {"totalCount": n, "items": [...], "links": {"next": {"uri", "headers"}}}.
+    If the first page has a continuation link, pages are followed in order
+    and the next page is fetched while the caller processes the current one.
+    Otherwise, if it reports totalCount, the remaining pages are requested
+    concurrently by offset. At most `workers` pages are in flight, and
+    pages() always yields them in order.
+
+    Each page is spooled gzip-compressed under spool_dir, so a download that
+    is interrupted (or whose import fails) resumes from the pages already
+    on disk. session and base_url can be replaced, e.g. to test against a
+    local HTTP server.
+
+    validators ({'etag', 'last_modified'} from a previous download) make the
+    first page request conditional. If the server answers 304 Not Modified,
+    pages() yields nothing and not_modified is set. The validators of this
+    download are available as validators.
+    """
+
+    def __init__(self, token_provider, token=None, base_url=PARTNER_CENTER_API,
+                 path=PRICELIST_PATH, session=None, page_size=API_PAGE_SIZE,
+                 workers=API_DOWNLOAD_WORKERS, max_retries=API_MAX_RETRIES,
+                 backoff=API_BACKOFF_SECONDS, timeout=API_TIMEOUT_SECONDS,
+                 spool_dir=DOWNLOAD_DIR / "pricelist", validators=None):
+        self.token_provider = token_provider
+        self.base_url = base_url.rstrip('/')
+        self.url = self.base_url + path
+        self.session = session or requests.Session()
+        self.page_size = page_size
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.spool_dir = spool_dir
+        self.content_hash = None
+        self.previous_validators = validators or {}
+        self.validators = {}
+        self.not_modified = False
+        self.stats = {'pages_downloaded': 0, 'pages_resumed': 0, 'retries': 0, 'items': 0}
+        self._token = token
+        self._token_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    # --- Spool ---------------------------------------------------------
+
+    def _page_path(self, index):
+        return self.spool_dir / f"page-{index:06d}.json.gz"
+
+    def _prepare_spool(self):
+        """Keep spooled pages from a recent, matching download; clear anything else"""
+        manifest_path = self.spool_dir / "manifest.json"
+        try:
+            manifest = json.loads(manifest_path.read_text())
+            started = datetime.fromisoformat(manifest['started'])
+            resumable = (
+                manifest.get('url') == self.url
+                and manifest.get('page_size') == self.page_size
+                and datetime.now() - started < timedelta(hours=API_RESUME_MAX_AGE_HOURS)
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            resumable = False
+
+        if resumable:
+            logger.info(f"Resuming pricelist download started {manifest['started']}")
+            self.validators = manifest.get('validators') or {}
+            return
+
+        self.discard()
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path.write_text(json.dumps({
+            'url': self.url,
+            'page_size': self.page_size,
+            'started': datetime.now().isoformat(),
+        }))
+
+    def _save_validators(self, response):
+        """Record the ETag/Last-Modified of the first page in the manifest"""
+        self.validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        manifest_path = self.spool_dir / "manifest.json"
+        manifest = json.loads(manifest_path.read_text())
+        manifest['validators'] = self.validators
+        manifest_path.write_text(json.dumps(manifest))
+
+    def discard(self):
+        """Delete spooled pages (call once they have been imported)"""
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    def keep_as_cache(self, cache_dir=CACHE_DIR):
+        """
+        Keep the spooled pages of an imported download as the offline copy
+        read by CachedPricelist, replacing the previous one.
+        """
+        manifest_path = self.spool_dir / "manifest.json"
+        manifest = json.loads(manifest_path.read_text())
+        manifest['content_hash'] = self.content_hash
+        manifest_path.write_text(json.dumps(manifest))
+
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.replace(self.spool_dir, cache_dir)
+
+    # --- HTTP ----------------------------------------------------------
+
+    def _headers(self, refresh=False):
+        with self._token_lock:
+            if refresh or not self._token:
+                self._token = self.token_provider()
+                if not self._token:
+                    raise DownloadError("Failed to acquire access token")
+            return {"Authorization": f"Bearer {self._token}", "Accept": "application/json"}
+
+    def _get(self, url, params=None, headers=None):
+        """GET with retries and exponential backoff on throttling and server errors"""
+        refreshed = False
+        attempt = 0
+        while True:
+            request_headers = dict(self._headers(), **(headers or {}))
+            delay = None
+            try:
+                response = self.session.get(url, params=params, headers=request_headers,
+                                            timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code == 401 and not refreshed:
+                    # Token expired mid-download: refresh once and retry
+                    self._headers(refresh=True)
+                    refreshed = True
+                    continue
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                error = f"HTTP {response.status_code}"
+                delay = retry_after(response)
+
+            if attempt >= self.max_retries:
+                raise DownloadError(f"Giving up on {url} after {attempt} retries: {error}")
+            if delay is None:
+                delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            attempt += 1
+            self._count('retries')
+            logger.warning(f"Retrying {url} in {delay:.1f}s (attempt {attempt}/{self.max_retries}): {error}")
+            time.sleep(delay)
+
+    def _page(self, index, link=None):
+        """
+        Return the raw body of page index, from the spool if it was already
+        downloaded. link is the continuation link from the previous page;
+        without one the page is requested by offset.
+        """
+        path = self._page_path(index)
+        if path.exists():
+            self._count('pages_resumed')
+            return gzip.decompress(path.read_bytes())
+
+        if link:
+            uri = link['uri']
+            url = uri if uri.startswith('http') else self.base_url + '/' + uri.lstrip('/')
+            headers = {CONTINUATION_HEADER: link['token']} if link['token'] else None
+            body = self._get(url, headers=headers).content
+        else:
+            params = {'size': self.page_size, 'offset': index * self.page_size}
+            headers = {}
+            if index == 0:
+                if self.previous_validators.get('etag'):
+                    headers['If-None-Match'] = self.previous_validators['etag']
+                if self.previous_validators.get('last_modified'):
+                    headers['If-Modified-Since'] = self.previous_validators['last_modified']
+            response = self._get(self.url, params=params, headers=headers)
+            if response.status_code == 304:
+                return None
+            if index == 0:
+                self._save_validators(response)
+            body = response.content
+
+        # Write then rename, so a partial file is never mistaken for a page
+        partial = path.with_suffix('.part')
+        partial.write_bytes(gzip.compress(body, compresslevel=6))
+        os.replace(partial, path)
+        self._count('pages_downloaded')
+        return body
+
+    # --- Iteration -----------------------------------------------------
+
+    def pages(self):
+        """
+        Yield the items of each page in order. content_hash is set once the
+        last page has been yielded. Yields nothing if the pricelist has not
+        changed since the download described by validators.
+        """
+        self._prepare_spool()
+        hasher = hashlib.md5()
+
+        def accept(body):
+            hasher.update(body)
+            page = json.loads(body)
+            items = page.get('items') or []
+            self._count('items', len(items))
+            return page, items
+
+        first = self._page(0)
+        if first is None:
+            self.not_modified = True
+            self.discard()
+            logger.info("Pricelist not modified since the last download")
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='pricelist') as executor:
+            page, items = accept(first)
+            total = page.get('totalCount')
+            link = next_link(page)
+            yield items
+
+            if link:
+                index = 1
+                future = executor.submit(self._page, index, link)
+                while future is not None:
+                    page, items = accept(future.result())
+                    link = next_link(page)
+                    index += 1
+                    future = executor.submit(self._page, index, link) if link else None
+                    yield items
+
+            elif total and total > len(items):
+                page_count = -(-total // self.page_size)
+                pending = deque()
+                submitted = 1
+                while submitted < page_count or pending:
+                    while submitted < page_count and len(pending) < self.workers:
+                        pending.append(executor.submit(self._page, submitted))
+                        submitted += 1
+                    page, items = accept(pending.popleft().result())
+                    yield items
+
+        if total is not None and self.stats['items'] < total:
+            raise DownloadError(f"Download incomplete: {self.stats['items']} of {total} items")
+        self.content_hash = hasher.hexdigest()
+        logger.info(f"Downloaded pricelist: {self.stats['items']} items, "
+                    f"{self.stats['pages_downloaded']} pages fetched, "
+                    f"{self.stats['pages_resumed']} resumed, {self.stats['retries']} retries")
+
+class CachedPricelist:
+    """
+    The pages of the last imported download, read back from CACHE_DIR.
+    Same interface as PricelistDownloader: pages() yields the items of each
+    page in order and sets content_hash when done.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.content_hash = None
+
+    def exists(self):
+        """Check whether a cached download is available"""
+        return (self.cache_dir / "manifest.json").exists()
+
+    def manifest(self):
+        """Return the manifest of the cached download (url, validators, content_hash)"""
+        return json.loads((self.cache_dir / "manifest.json").read_text())
+
+    def pages(self):
+        """Yield the items of each cached page in order"""
+        if not self.exists():
+            raise FileNotFoundError(f"No cached pricelist in {self.cache_dir}")
+        hasher = hashlib.md5()
+        for path in sorted(self.cache_dir.glob("page-*.json.gz")):
+            body = gzip.decompress(path.read_bytes())
+            hasher.update(body)
+            yield json.loads(body).get('items') or []
+        self.content_hash = hasher.hexdigest()
@@ -0,0 +1,400 @@
+"""
+Quote engine for MSP Pricing Application
+Prices multi-line quotes in one pass and renders quote documents
+"""
+import logging
+import math
+import re
+from datetime import datetime
+
+import numpy as np
+
+from config import QUOTE_MAX_LINES, GRID_MAX_CELLS, GRID_CACHE_MAX_BYTES, GRID_CACHE_MAX_ENTRY_BYTES
+from result_cache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+# Default markup applied over the partner price, in percent
+DEFAULT_MARGIN = 20
+
+# prices columns needed to price and describe a quote line
+QUOTE_COLUMNS = [
+    'id', 'ProductTitle', 'SkuTitle', 'Segment', 'TermDuration', 'TermDurationHuman',
+    'BillingPlan', 'Currency', 'UnitPrice', 'ERPPrice', 'MarkupPercent', 'SkuDescription'
+]
+
+# Per-line amounts returned by price_quote(), in output order
+LINE_AMOUNTS = [
+    'UnitPrice', 'ERPPrice', 'StandardMarkup', 'QuotePrice', 'ProfitPerLicense',
+    'TotalCost', 'TotalPrice', 'TotalProfit', 'AnnualCost', 'AnnualPrice', 'AnnualProfit'
+]
+
+def parse_quote_lines(data):
+    """
+    Validate a batch quote request body.
+    Returns (price_ids, quantities, margins) lists; raises ValueError with a
+    message suitable for the client on bad input.
+    """
+    lines = data.get('lines')
+    if not isinstance(lines, list) or not lines:
+        raise ValueError("lines must be a non-empty list")
+    if len(lines) > QUOTE_MAX_LINES:
+        raise ValueError(f"A quote can have at most {QUOTE_MAX_LINES} lines")
+
+    default_margin = data.get('margin', DEFAULT_MARGIN)
+    price_ids, quantities, margins = [], [], []
+    for number, line in enumerate(lines, start=1):
+        if not isinstance(line, dict):
+            raise ValueError(f"Line {number}: expected an object")
+        try:
+            price_ids.append(int(line['price_id']))
+            quantities.append(float(line.get('quantity', 1)))
+            margins.append(float(line.get('margin', default_margin)))
+        except (KeyError, TypeError, ValueError, OverflowError):
+            raise ValueError(f"Line {number}: price_id, quantity and margin must be numbers")
+        # NaN and infinity would come back as NaN/Infinity, which is not valid JSON
+        for field, value in (('quantity', quantities[-1]), ('margin', margins[-1])):
+            if not math.isfinite(value):
+                raise ValueError(f"Line {number}: {field} must be a finite number")
+        if quantities[-1] <= 0:
+            raise ValueError(f"Line {number}: quantity must be positive")
+    return price_ids, quantities, margins
+
+def fetch_quote_rows(conn, price_ids):
+    """Fetch the prices rows for a quote in one query, as {id: row}"""
+    ids = sorted(set(price_ids))
+    placeholders = ', '.join('?' * len(ids))
+    rows = conn.execute(
+        f"SELECT {', '.join(QUOTE_COLUMNS)} FROM prices WHERE id IN ({placeholders})", ids
+    ).fetchall()
+    return {row['id']: row for row in rows}
+
+def term_months(term):
+    """Length of an ISO 8601 term (P1M, P1Y, P3Y...) in months, or None"""
+    match = re.fullmatch(r'P(\d+)([MY])', term or '')
+    if not match:
+        return None
+    return int(match.group(1)) * (12 if match.group(2) == 'Y' else 1)
+
+def price_quote(rows, quantities, margins):
+    """
+    Price quote lines. rows are prices rows in line order; quantities and
+    margins are per line. All arithmetic is done on whole columns at once.
+
+    UnitPrice and ERPPrice cover a license for the whole term, so annual
+    figures scale line totals by 12 / term months (a 3-year term counts a
+    third of its total per year; monthly terms count twelve times).
+
+    Returns (lines, totals): a list of per-line dicts and a dict of totals.
+    """
+    quantity = np.asarray(quantities, dtype=float)
+    margin = np.asarray(margins, dtype=float)
+    unit = np.array([row['UnitPrice'] or 0 for row in rows], dtype=float)
+    erp = np.array([row['ERPPrice'] or 0 for row in rows], dtype=float)
+    months = np.array([term_months(row['TermDuration']) or 12 for row in rows], dtype=float)
+    standard_markup = np.array([row['MarkupPercent'] for row in rows], dtype=float)
+
+    quote_price = unit * (1 + margin / 100)
+    total_cost = unit * quantity
+    total_price = quote_price * quantity
+    per_year = 12 / months
+
+    amounts = {
+        'UnitPrice': unit,
+        'ERPPrice': erp,
+        'StandardMarkup': standard_markup,
+        'QuotePrice': quote_price,
+        'ProfitPerLicense': quote_price - unit,
+        'TotalCost': total_cost,
+        'TotalPrice': total_price,
+        'TotalProfit': total_price - total_cost,
+        'AnnualCost': total_cost * per_year,
+        'AnnualPrice': total_price * per_year,
+        'AnnualProfit': (total_price - total_cost) * per_year,
+    }
+    columns = {name: np.round(values, 2).tolist() for name, values in amounts.items()}
+    columns['StandardMarkup'] = amounts['StandardMarkup'].tolist()
+
+    lines = []
+    for i, row in enumerate(rows):
+        line = {
+            'price_id': row['id'],
+            'ProductTitle': row['ProductTitle'],
+            'SkuTitle': row['SkuTitle'],
+            'Segment': row['Segment'],
+            'TermDuration': row['TermDuration'],
+            'TermDurationHuman': row['TermDurationHuman'],
+            'BillingPlan': row['BillingPlan'],
+            'Currency': row['Currency'],
+            'SkuDescription': row['SkuDescription'],
+            'quantity': quantities[i],
+            'margin': margins[i],
+        }
+        line.update((name, columns[name][i]) for name in LINE_AMOUNTS)
+        lines.append(line)
+
+    cost, price = total_cost.sum(), total_price.sum()
+    totals = {
+        'lines': len(rows),
+        'licenses': float(quantity.sum()),
+        'cost': round(float(cost), 2),
+        'price': round(float(price), 2),
+        'profit': round(float(price - cost), 2),
+        'annual_cost': round(float(amounts['AnnualCost'].sum()), 2),
+        'annual_price': round(float(amounts['AnnualPrice'].sum()), 2),
+        'annual_profit': round(float(amounts['AnnualProfit'].sum()), 2),
+        'markup_percent': round(float((price - cost) / cost * 100), 1) if cost > 0 else 0.0,
+        'currencies': sorted({row['Currency'] for row in rows if row['Currency']}),
+    }
+    return lines, totals
+
+def parse_grid_request(data):
+    """
+    Validate a margin grid request body.
+    margins is a list of percentages or {"start", "stop", "step"} (inclusive);
+    quantities is a list of license counts.
+    Returns (price_ids, margins, quantities); raises ValueError on bad input.
+    """
+    price_ids = data.get('price_ids')
+    if not isinstance(price_ids, list) or not price_ids:
+        raise ValueError("price_ids must be a non-empty list")
+    if len(price_ids) > QUOTE_MAX_LINES:
+        raise ValueError(f"A basket can have at most {QUOTE_MAX_LINES} SKUs")
+
+    margins = data.get('margins', [DEFAULT_MARGIN])
+    quantities = data.get('quantities', [1])
+    margin_range = None
+    try:
+        price_ids = [int(price_id) for price_id in price_ids]
+        if isinstance(margins, dict):
+            margin_range = [float(margins['start']), float(margins['stop']), float(margins.get('step', 1))]
+        else:
+            margins = np.asarray(margins, dtype=float)
+        quantities = np.asarray(quantities, dtype=float)
+    except (KeyError, TypeError, ValueError, OverflowError):
+        raise ValueError("price_ids, margins and quantities must be numbers")
+
+    if margin_range is not None:
+        start, stop, step = margin_range
+        if not all(math.isfinite(value) for value in margin_range):
+            raise ValueError("margin start, stop and step must be finite numbers")
+        if step <= 0:
+            raise ValueError("margin step must be positive")
+        # Size the range before building it: a tiny step would allocate gigabytes
+        count = max(0, math.floor((stop - start) / step + 1e-9) + 1)
+    else:
+        count = margins.size if margins.ndim == 1 else 0
+    if not count or quantities.ndim != 1 or not quantities.size:
+        raise ValueError("margins and quantities must be non-empty lists "
+                         "(a margin range needs start <= stop)")
+    cells = len(price_ids) * count * quantities.size
+    if cells > GRID_MAX_CELLS:
+        raise ValueError(f"Grid too large ({cells} cells, at most {GRID_MAX_CELLS})")
+
+    if margin_range is not None:
+        margins = start + step * np.arange(count)
+    if not np.isfinite(margins).all() or not np.isfinite(quantities).all():
+        raise ValueError("margins and quantities must be finite numbers")
+    if (quantities <= 0).any():
+        raise ValueError("quantities must be positive")
+    return price_ids, np.round(margins, 4), quantities
+
+def margin_grid(rows, margins, quantities):
+    """
+    Price a basket across every margin and quantity at once.
+    Arrays broadcast as SKU x margin (x quantity):
+      quote_price[s][m]    per-license quote price
+      erp_markup[s][m]     quote price relative to ERPPrice, in percent
+      total_price[s][m][q] quote price x quantity
+      profit[s][m][q]      (quote price - partner price) x quantity
+    basket sums total_price and profit over all SKUs per margin/quantity.
+    """
+    unit = np.array([row['UnitPrice'] or 0 for row in rows], dtype=float)[:, None]
+    erp = np.array([row['ERPPrice'] or 0 for row in rows], dtype=float)[:, None]
+    quote_price = unit * (1 + margins[None, :] / 100)                # (s, m)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        erp_markup = np.where(erp > 0, (quote_price - erp) / erp * 100, 0)
+    total_price = quote_price[:, :, None] * quantities[None, None, :]  # (s, m, q)
+    profit = (quote_price - unit)[:, :, None] * quantities[None, None, :]
+
+    return {
+        'skus': [{
+            'price_id': row['id'],
+            'ProductTitle': row['ProductTitle'],
+            'SkuTitle': row['SkuTitle'],
+            'TermDuration': row['TermDuration'],
+            'BillingPlan': row['BillingPlan'],
+            'Currency': row['Currency'],
+            'UnitPrice': row['UnitPrice'],
+            'ERPPrice': row['ERPPrice'],
+        } for row in rows],
+        'margins': margins.tolist(),
+        'quantities': quantities.tolist(),
+        'quote_price': np.round(quote_price, 2).tolist(),
+        'erp_markup': np.round(erp_markup, 1).tolist(),
+        'total_price': np.round(total_price, 2).tolist(),
+        'profit': np.round(profit, 2).tolist(),
+        'basket': {
+            'cost': np.round(unit.sum() * quantities, 2).tolist(),
+            'total_price': np.round(total_price.sum(axis=0), 2).tolist(),
+            'profit': np.round(profit.sum(axis=0), 2).tolist(),
+        },
+    }
+
+class GridCache(ResultCache):
+    """
+    LRU cache of serialized margin grid responses, bounded by total size in
+    bytes like the query result cache. Keys include the import version, so
+    grids computed against an older pricelist are never served and simply
+    age out.
+    """
+
+    def __init__(self, max_bytes=GRID_CACHE_MAX_BYTES, max_entry_bytes=GRID_CACHE_MAX_ENTRY_BYTES):
+        super().__init__(max_bytes, max_entry_bytes)
+
+    @staticmethod
+    def key(version, price_ids, margins, quantities):
+        return (version, tuple(price_ids), tuple(margins.tolist()), tuple(quantities.tolist()))
+
+grid_cache = GridCache()
+
+def render_quote_text(lines, totals):
+    """Render a priced quote as the plain-text quote document"""
+    items = []
+    for number, line in enumerate(lines, start=1):
+        items.append(f"""{number:>2}. {line['ProductTitle']}
+    SKU:        {line['SkuTitle']}
+    Term:       {line['TermDurationHuman']} / {line['BillingPlan']} billing / {line['Segment']}
+    Price:      ${line['UnitPrice']:.2f} partner + {line['margin']:.1f}% = ${line['QuotePrice']:.2f} per license
+    Quantity:   {line['quantity']:g}
+    Total:      ${line['TotalPrice']:.2f} (cost ${line['TotalCost']:.2f}, profit ${line['TotalProfit']:.2f})
+    Annualized: ${line['AnnualPrice']:.2f}
+""")
+
+    return f"""
+========================================
+        QUOTE DRAFT SUMMARY
+========================================
+
+Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+Currency:  {', '.join(totals['currencies']) or 'N/A'}
+
+LINE ITEMS
+----------
+{chr(10).join(items)}
+TOTALS ({totals['lines']} lines, {totals['licenses']:g} licenses)
+-------------------------------------------
+Total Cost:        ${totals['cost']:.2f}
+Total Quote:       ${totals['price']:.2f}
+Total Profit:      ${totals['profit']:.2f} ({totals['markup_percent']:.1f}% markup)
+
+Annualized Cost:   ${totals['annual_cost']:.2f}
+Annualized Quote:  ${totals['annual_price']:.2f}
+Annualized Profit: ${totals['annual_profit']:.2f}
+
+NOTES
+-----
+- Pricing is based on Microsoft NCE License-Based pricing
+- Prices are per license for the full term; annualized figures spread
+  multi-year terms evenly and count monthly terms twelve times
+- Contact eMazzanti Technologies for final quote approval
+
+========================================
+       eMazzanti Technologies
+========================================
+"""
+
+def render_quote_html(title, text):
+    """Wrap a plain-text quote document in the printable HTML page"""
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{title}</title>
+    <style>
+        body {{
+            font-family: 'Consolas', 'Courier New', monospace;
+            background-color: #1e1e1e;
+            color: #d4d4d4;
+            padding: 20px;
+            margin: 0;
+            line-height: 1.4;
+        }}
+        .container {{
+            max-width: 800px;
+            margin: 0 auto;
+            background-color: #2d2d2d;
+            padding: 30px;
+            border-radius: 8px;
+            box-shadow: 0 4px 12px rgba(0,0,0,0.3);
+        }}
+        pre {{
+            white-space: pre-wrap;
+            word-wrap: break-word;
+            margin: 0;
+            font-size: 14px;
+        }}
+        .actions {{
+            margin-top: 20px;
+            padding-top: 20px;
+            border-top: 1px solid #444;
+            text-align: center;
+        }}
+        button {{
+            background-color: #0078d4;
+            color: white;
+            border: none;
+            padding: 10px 20px;
+            margin: 0 10px;
+            border-radius: 4px;
+            cursor: pointer;
+            font-size: 14px;
+        }}
+        button:hover {{
+            background-color: #106ebe;
+        }}
+        @media print {{
+            body {{
+                background-color: white;
+                color: black;
+            }}
+            .container {{
+                background-color: white;
+                box-shadow: none;
+            }}
+            .actions {{
+                display: none;
+            }}
+        }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <pre>{text}</pre>
+        <div class="actions">
+            <button onclick="window.print()">Print Quote</button>
+            <button onclick="copyToClipboard()">Copy to Clipboard</button>
+            <button onclick="window.close()">Close</button>
+        </div>
+    </div>
+    <script>
+        function copyToClipboard() {{
+            const text = document.querySelector('pre').textContent;
+            navigator.clipboard.writeText(text).then(() => {{
+                alert('Quote copied to clipboard!');
+            }}).catch(err => {{
+                console.error('Failed to copy:', err);
+                // Fallback for older browsers
+                const textarea = document.createElement('textarea');
+                textarea.value = text;
+                document.body.appendChild(textarea);
+                textarea.select();
+                document.execCommand('copy');
+                document.body.removeChild(textarea);
+                alert('Quote copied to clipboard!');
+            }});
+        }}
+    </script>
+</body>
+</html>"""
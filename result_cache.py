@@ -0,0 +1,110 @@
+"""
+Query result cache for MSP Pricing Application
+Keeps serialized /api/query responses in a memory-capped LRU
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+from config import RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_ENTRY_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Request fields that change an /api/query response
+QUERY_KEY_FIELDS = ('product', 'segment', 'term', 'billing', 'search', 'limit', 'cursor')
+
+# Request fields that filter the prices
+FILTER_FIELDS = ('product', 'segment', 'term', 'billing', 'search')
+
+# Rough per-entry overhead (key tuple, dict slot) counted against the cap
+ENTRY_OVERHEAD_BYTES = 256
+
+def normalize_query(data):
+    """
+    Return a copy of an /api/query body with its filters normalized: strings
+    stripped, runs of whitespace in search collapsed, empty values dropped.
+    Queries run on the normalized body, so requests sharing a cache key
+    always get the same results. Raises ValueError, with a message suitable
+    for the client, if the body is not an object or a filter is not a string.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    data = dict(data)
+    for field in FILTER_FIELDS:
+        value = data.pop(field, None)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"{field} must be a string")
+        if isinstance(value, str):
+            value = ' '.join(value.split()) if field == 'search' else value.strip()
+        if value not in ('', None):
+            data[field] = value
+    return data
+
+class ResultCache:
+    """
+    LRU cache of serialized responses, bounded by total size in bytes.
+    Keys include the import version, so results from an older pricelist are
+    never served; clear() drops them as soon as an import completes.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, max_entry_bytes=RESULT_CACHE_MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(version, data):
+        """Cache key for a normalized /api/query body (see normalize_query)"""
+        return (version,) + tuple(data.get(field) for field in QUERY_KEY_FIELDS)
+
+    def get(self, key):
+        """Return the cached body for key, or None"""
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        """Cache a response body, evicting least recently used entries to fit"""
+        size = len(body) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_entry_bytes:
+            return  # One huge page would push out many typical ones
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous) + ENTRY_OVERHEAD_BYTES
+            self._entries[key] = body
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted) + ENTRY_OVERHEAD_BYTES
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry (counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+# Process-wide cache in front of /api/query
+result_cache = ResultCache()
@@ -0,0 +1,77 @@
+"""
+Full-text search helpers for MSP Pricing Application
+Builds prices_fts FTS5 queries and highlights search matches
+"""
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# bm25() column weights: ProductTitle, SkuTitle, SkuDescription
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+RANK_EXPR = f"bm25(prices_fts, {', '.join(str(w) for w in BM25_WEIGHTS)})"
+
+# Highlights: result columns they are taken from (first wins a tie), and the
+# longest one in words before it is cut down around the first match
+SNIPPET_COLUMNS = ('ProductTitle', 'SkuTitle', 'SkuDescription')
+SNIPPET_WORDS = 12
+
+# Shortest word the trigram index can match; shorter ones need a substring scan
+MIN_FTS_WORD = 3
+
+def build_fts_query(text):
+    """
+    Convert free text into an FTS5 MATCH expression for the trigram index.
+    Every word must occur somewhere in the row, as a case-insensitive
+    substring, so "defender end" finds "Microsoft Defender for Endpoint".
+    Returns None if text has no words or a word is too short for the index;
+    callers then fall back to substring matching.
+    """
+    words = text.split()
+    if not words or any(len(word) < MIN_FTS_WORD for word in words):
+        return None
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in words)
+
+def fts_available(conn):
+    """Check whether the search index exists in this database"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'prices_fts'"
+    ).fetchone()
+    return row is not None
+
+def snippet(value, pattern):
+    """Highlight the matches of pattern in value, cut to SNIPPET_WORDS words around the first"""
+    words = value.split(' ')
+    if len(words) > SNIPPET_WORDS:
+        first = value[:pattern.search(value).start()].count(' ')
+        start = max(0, min(first - 2, len(words) - SNIPPET_WORDS))
+        end = start + SNIPPET_WORDS
+        value = ('…' if start else '') + ' '.join(words[start:end]) + ('…' if end < len(words) else '')
+    return pattern.sub(lambda match: f'<mark>{match.group()}</mark>', value)
+
+def add_snippets(text, results):
+    """
+    Set a highlighted Snippet on each search result dict: the column matching
+    the most search words, with every match in <mark>. Built from the result
+    text itself, so it costs no query; a page repeats the same titles and
+    descriptions, so each distinct value is only examined once.
+    """
+    words = sorted(set(text.lower().split()), key=len, reverse=True)
+    if not words:
+        return
+    pattern = re.compile('|'.join(re.escape(word) for word in words), re.IGNORECASE)
+    found = {}
+    snippets = {}
+    for result in results:
+        best, best_count = None, 0
+        for column in SNIPPET_COLUMNS:
+            value = result.get(column) or ''
+            count = found.get(value)
+            if count is None:
+                lowered = value.lower()
+                count = found[value] = sum(word in lowered for word in words)
+            if count > best_count:
+                best, best_count = value, count
+        if best is not None and best not in snippets:
+            snippets[best] = snippet(best, pattern)
+        result['Snippet'] = snippets.get(best)
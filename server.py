@@ -0,0 +1,143 @@
+"""
+Production web server for MSP Pricing Application
+Serves the Flask app with waitress and drains in-flight requests on shutdown
+"""
+import _thread
+import logging
+import signal
+import threading
+import time
+
+from config import (HOST, PORT, WSGI_THREADS, WSGI_CONNECTION_LIMIT,
+                    WSGI_CHANNEL_TIMEOUT, WSGI_SHUTDOWN_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+# Signals that stop the server (SIGBREAK: Ctrl+Break or console close on Windows)
+STOP_SIGNALS = [signal.SIGINT, signal.SIGTERM] + ([signal.SIGBREAK] if hasattr(signal, 'SIGBREAK') else [])
+
+class RequestTracker:
+    """
+    WSGI middleware counting requests in progress, streamed responses
+    included until their last chunk is sent. Once draining, new requests
+    are refused with 503 so the ones in progress can finish.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.active = 0
+        self.draining = False
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            if self.draining:
+                refuse = True
+            else:
+                refuse = False
+                self.active += 1
+        if refuse:
+            start_response('503 Service Unavailable', [
+                ('Content-Type', 'application/json'),
+                ('Retry-After', str(WSGI_SHUTDOWN_SECONDS)),
+            ])
+            return [b'{"error": "Server is shutting down"}']
+
+        try:
+            return TrackedResponse(self.app(environ, start_response), self._finished)
+        except BaseException:
+            self._finished()
+            raise
+
+    def _finished(self):
+        with self._lock:
+            self.active -= 1
+            if self.active == 0:
+                self._idle.notify_all()
+
+    def drain(self, timeout):
+        """Refuse new requests and wait up to timeout seconds for active ones; True if none are left"""
+        with self._lock:
+            self.draining = True
+            return self._idle.wait_for(lambda: self.active == 0, timeout)
+
+class TrackedResponse:
+    """Response iterable that reports when the server is done with it"""
+
+    def __init__(self, response, on_close):
+        self.response = response
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.response)
+
+    def close(self):
+        try:
+            if hasattr(self.response, 'close'):
+                self.response.close()
+        finally:
+            self.on_close()
+
+def serve(app):
+    """
+    Serve app with waitress until a stop signal (Ctrl+C, SIGTERM, Ctrl+Break)
+    arrives, then stop taking requests, give those in progress up to
+    WSGI_SHUTDOWN_SECONDS to finish, and return. A second signal stops
+    without waiting; once stopping, further stop signals are ignored.
+    Stop signals can only be handled when called from the main thread.
+    """
+    from waitress.server import create_server
+
+    tracker = RequestTracker(app)
+    server = create_server(
+        tracker,
+        host=HOST,
+        port=PORT,
+        threads=WSGI_THREADS,
+        connection_limit=WSGI_CONNECTION_LIMIT,
+        channel_timeout=WSGI_CHANNEL_TIMEOUT,
+    )
+
+    def unsent_bytes():
+        # Response bytes buffered by waitress but not yet sent to the clients
+        return sum(getattr(channel, 'total_outbufs_len', 0)
+                   for channel in list(getattr(server, 'active_channels', {}).values()))
+
+    def drain():
+        deadline = time.monotonic() + WSGI_SHUTDOWN_SECONDS
+        finished = tracker.drain(WSGI_SHUTDOWN_SECONDS)
+        while finished and unsent_bytes() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if finished and not unsent_bytes():
+            logger.info(f"In-flight requests finished in {WSGI_SHUTDOWN_SECONDS - (deadline - time.monotonic()):.1f}s")
+        else:
+            logger.warning(f"Requests still running after {WSGI_SHUTDOWN_SECONDS}s; stopping anyway")
+        _thread.interrupt_main()  # Runs stop() again in the main thread
+
+    def stopping(signum, frame):
+        logger.info(f"Received {signal.Signals(signum).name}, already stopping")
+
+    def stop(signum, frame):
+        if tracker.draining:
+            # From drain(), or a second signal: end server.run(). Ignore any
+            # later signal so the cleanup after serve() runs to completion
+            # (a Python handler, as SIG_IGN races with signals already pending).
+            for stop_signal in STOP_SIGNALS:
+                signal.signal(stop_signal, stopping)
+            raise KeyboardInterrupt
+        logger.info(f"Received {signal.Signals(signum).name}, stopping web server")
+        tracker.draining = True
+        threading.Thread(target=drain, name='drain', daemon=True).start()
+
+    if threading.current_thread() is threading.main_thread():
+        for signum in STOP_SIGNALS:
+            signal.signal(signum, stop)
+
+    logger.info(f"Serving on http://{HOST}:{PORT} with waitress "
+                f"({WSGI_THREADS} threads, up to {WSGI_CONNECTION_LIMIT} connections)")
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass  # Raised by stop() outside waitress's own handler, e.g. during its shutdown
+    logger.info("Web server stopped")
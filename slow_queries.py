@@ -0,0 +1,91 @@
+"""
+Slow-query log for MSP Pricing Application
+Keeps the most recent slow SQLite statements with their parameters and query plan
+"""
+import logging
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime
+
+from config import SLOW_QUERY_MS, SLOW_QUERY_LOG_SIZE, SLOW_QUERY_MAX_PARAMS
+from db import add_query_observer, open_read_only
+from indexes import explain
+
+logger = logging.getLogger(__name__)
+
+# Statements worth explaining; the plan of anything else (PRAGMA, DDL) says nothing
+EXPLAINED_STATEMENTS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+def loggable_parameters(parameters):
+    """Parameters as JSON-friendly values, at most SLOW_QUERY_MAX_PARAMS of them"""
+    if parameters is None:
+        return None  # executemany
+    if isinstance(parameters, dict):
+        items = list(parameters.items())[:SLOW_QUERY_MAX_PARAMS]
+        return {key: value if not isinstance(value, bytes) else repr(value) for key, value in items}
+    values = list(parameters)[:SLOW_QUERY_MAX_PARAMS]
+    return [value if not isinstance(value, bytes) else repr(value) for value in values]
+
+class SlowQueryLog:
+    """
+    Ring buffer of statements that took at least threshold_ms, fed by the db
+    query observer. Each entry holds the SQL, parameters, rows, elapsed time
+    and the EXPLAIN QUERY PLAN captured when it was logged, so indexes can
+    be tuned from the plans of the queries users actually ran.
+    """
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, size=SLOW_QUERY_LOG_SIZE):
+        self.threshold_ms = threshold_ms
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.total = 0
+
+    def observe(self, sql, parameters, seconds, rows):
+        """db query observer: log the statement if it was slow"""
+        elapsed_ms = seconds * 1000
+        if elapsed_ms < self.threshold_ms:
+            return
+
+        sql = sql.strip()
+        entry = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'elapsed_ms': round(elapsed_ms, 2),
+            'rows': rows,
+            'sql': sql,
+            'parameters': loggable_parameters(parameters),
+            'plan': None,
+        }
+        if sql.split(None, 1)[0].upper() in EXPLAINED_STATEMENTS and parameters is not None:
+            try:
+                with open_read_only() as conn:
+                    entry['plan'] = explain(conn, sql, parameters)
+            except sqlite3.Error as e:
+                entry['plan_error'] = str(e)  # e.g. a TEMP table only the writer can see
+
+        with self._lock:
+            self._entries.append(entry)
+            self.total += 1
+        logger.warning(f"Slow query ({elapsed_ms:.0f} ms, {rows} rows): {' '.join(sql.split())[:200]}")
+
+    def entries(self):
+        """Logged statements, newest first"""
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'threshold_ms': self.threshold_ms,
+                'size': self._entries.maxlen,
+                'logged': len(self._entries),
+                'total': self.total,
+            }
+
+# Process-wide log of slow statements
+slow_query_log = SlowQueryLog()
+add_query_observer(slow_query_log.observe)
@@ -0,0 +1,99 @@
+"""
+Search suggestions for MSP Pricing Application
+Completes product and SKU titles as the user types, from a sorted prefix index
+"""
+import logging
+import re
+from bisect import bisect_left
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Title columns offered as completions, and the type reported for each
+SUGGEST_COLUMNS = {'ProductTitle': 'product', 'SkuTitle': 'sku'}
+
+# Sorts after any character that can follow a prefix
+PREFIX_END = '\U0010ffff'
+
+def normalize_prefix(text):
+    """Lowercase text and collapse whitespace, as index keys are stored"""
+    return ' '.join(text.lower().split())
+
+def word_starts(text):
+    """Offsets in text where a word begins"""
+    return [match.start() for match in re.finditer(r'\w+', text)]
+
+class SuggestIndex:
+    """
+    Sorted prefix index over distinct titles.
+
+    Every title is entered once per word, keyed by the lowercased text from
+    that word to the end, so "prem" completes "Microsoft 365 Business
+    Premium". Titles are numbered best first (most price rows, then
+    alphabetical), so the best completions for a prefix are the smallest
+    numbers in its key range. Titles that start with the prefix rank ahead
+    of titles where it starts a later word. A title that is both a product
+    and a SKU title is listed once, with the type given first.
+    """
+
+    def __init__(self, titles):
+        """titles: iterable of (text, type, weight), weight being the number of price rows"""
+        merged = {}
+        for text, kind, weight in titles:
+            if not text:
+                continue
+            if text in merged:
+                kind, weight = merged[text][0], merged[text][1] + weight
+            merged[text] = (kind, weight)
+        entries = sorted(
+            ((text, kind, weight) for text, (kind, weight) in merged.items()),
+            key=lambda entry: (-entry[2], entry[0]),
+        )
+        self.texts = [text for text, _, _ in entries]
+        self.types = [kind for _, kind, _ in entries]
+
+        whole, words = [], []
+        for rank, text in enumerate(self.texts):
+            lowered = normalize_prefix(text)
+            whole.append((lowered, rank))
+            words.extend((lowered[start:], rank) for start in word_starts(lowered)[1:])
+        whole.sort()
+        words.sort()
+        self._whole_keys = [key for key, _ in whole]
+        self._whole_ranks = np.array([rank for _, rank in whole], dtype=np.int32)
+        self._word_keys = [key for key, _ in words]
+        self._word_ranks = np.array([rank for _, rank in words], dtype=np.int32)
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Build from {column name: EncodedColumn} for the SUGGEST_COLUMNS"""
+        titles = []
+        for column, kind in SUGGEST_COLUMNS.items():
+            encoded = columns[column]
+            codes = encoded.codes[encoded.codes >= 0]
+            counts = np.bincount(codes, minlength=len(encoded.values))
+            titles.extend(zip(encoded.values.tolist(), [kind] * len(counts), counts.tolist()))
+        return cls(titles)
+
+    def __len__(self):
+        return len(self.texts)
+
+    @staticmethod
+    def _ranks(keys, ranks, prefix):
+        lo = bisect_left(keys, prefix)
+        hi = bisect_left(keys, prefix + PREFIX_END, lo)
+        return np.unique(ranks[lo:hi])  # Sorted, so best first
+
+    def suggest(self, text, limit=10):
+        """Return up to limit completions [{'text', 'type'}] for the typed text"""
+        prefix = normalize_prefix(text)
+        if not prefix:
+            return []
+
+        ranks = self._ranks(self._whole_keys, self._whole_ranks, prefix)[:limit].tolist()
+        if len(ranks) < limit:
+            seen = set(ranks)
+            more = self._ranks(self._word_keys, self._word_ranks, prefix)
+            ranks.extend(rank for rank in more[:limit + len(seen)].tolist() if rank not in seen)
+        return [{'text': self.texts[rank], 'type': self.types[rank]} for rank in ranks[:limit]]
@@ -0,0 +1,106 @@
+"""
+Shared test setup: runs the application against a throwaway data directory
+holding a small synthetic pricelist, never the real database.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+# Must happen before config is imported anywhere
+os.environ['MSP_PRICING_DATA_DIR'] = tempfile.mkdtemp(prefix='msp-pricing-tests-')
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# Rows in the test pricelist: 50 products in every segment/term combination
+PRICELIST_ROWS = 1000
+
+@pytest.fixture(scope='session')
+def pricelist(tmp_path_factory):
+    """Import a synthetic pricelist into the test database; returns the CSV path"""
+    from benchmark import write_pricelist
+    from update_db import init_database, ingest_csv
+
+    path = tmp_path_factory.mktemp('pricelist') / 'pricelist.csv'
+    write_pricelist(path, PRICELIST_ROWS)
+    init_database()
+    assert ingest_csv(path, force=True)
+    return path
+
+@pytest.fixture
+def client(pricelist):
+    from app import app
+    from result_cache import result_cache
+
+    result_cache.clear()
+    return app.test_client()
+
+@pytest.fixture
+def scratch_prices(pricelist):
+    """For tests importing other pricelists: re-imports the test pricelist afterwards"""
+    from update_db import ingest_csv
+
+    yield
+    assert ingest_csv(pricelist, force=True, mode='full')
+
+# --- Partner Center stand-in ----------------------------------------------
+
+ETAG = '"pricelist-v1"'
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Partner Center pricelist API: serves items by
+    offset with etag (None for no ETag header), records the requested
+    offsets and answers 503 for those in failing.
+    """
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), PricelistHandler)
+        self.items = []
+        self.etag = ETAG
+        self.offsets = []
+        self.failing = set()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+class PricelistHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        offset, size = int(query['offset'][0]), int(query['size'][0])
+        self.server.offsets.append(offset)
+        if offset in self.server.failing:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.server.etag and self.headers.get('If-None-Match') == self.server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        items = self.server.items
+        body = json.dumps({'totalCount': len(items), 'items': items[offset:offset + size]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.etag:
+            self.send_header('ETag', self.server.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def pricelist_server():
+    server = StandInServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,51 @@
+"""Tests for building and refreshing the in-memory catalog"""
+import threading
+import time
+
+import catalog
+
+def slow_build(counter, release=None):
+    """Stand-in for build_catalog that counts builds and takes a while"""
+    def build():
+        counter.append(threading.current_thread().name)
+        if release is not None:
+            release.wait(5)
+        else:
+            time.sleep(0.2)
+        return catalog.PriceCatalog.__new__(catalog.PriceCatalog)
+    return build
+
+def test_concurrent_cold_start_builds_once(monkeypatch):
+    builds = []
+    monkeypatch.setattr(catalog, '_catalog', None)
+    monkeypatch.setattr(catalog, 'build_catalog', slow_build(builds))
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(catalog.get_catalog())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(builds) == 1
+    assert len(results) == 8 and len({id(result) for result in results}) == 1
+
+def test_version_change_reloads_in_background(monkeypatch, pricelist):
+    builds = []
+    release = threading.Event()
+    old = catalog.reload_catalog()
+    monkeypatch.setattr(catalog, '_catalog', old)  # Put back after the test
+    monkeypatch.setattr(catalog, '_last_check', 0.0)
+    monkeypatch.setattr(catalog, 'read_catalog_version', lambda conn: 'newer import')
+    monkeypatch.setattr(catalog, 'build_catalog', slow_build(builds, release))
+
+    started = time.perf_counter()
+    assert catalog.get_catalog() is old
+    assert time.perf_counter() - started < 1
+    release.set()
+    for _ in range(100):
+        if catalog.current_catalog() is not old:
+            break
+        time.sleep(0.01)
+    assert builds == ['catalog-reload']
+    assert catalog.current_catalog() is not old
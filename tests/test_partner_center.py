@@ -0,0 +1,45 @@
+"""Tests for the Partner Center pricelist downloader against a local stand-in server"""
+import pytest
+
+from conftest import ETAG
+from partner_center import PricelistDownloader, DownloadError
+
+ITEMS = [{'productTitle': f'Product {i}', 'unitPrice': i} for i in range(10)]
+PAGE_SIZE = 3
+
+@pytest.fixture
+def server(pricelist_server):
+    pricelist_server.items = ITEMS
+    return pricelist_server
+
+def downloader(server, spool_dir, **kwargs):
+    return PricelistDownloader(token_provider=lambda: 'token', token='token', base_url=server.url,
+                               path='/pricelist', page_size=PAGE_SIZE, workers=2, max_retries=0,
+                               backoff=0, spool_dir=spool_dir, **kwargs)
+
+def download(downloader):
+    return [item for items in downloader.pages() for item in items]
+
+def test_interrupted_download_resumes_from_spooled_pages(server, tmp_path):
+    server.failing = {6}
+    with pytest.raises(DownloadError):
+        download(downloader(server, tmp_path / 'spool'))
+
+    server.failing = set()
+    server.offsets.clear()
+    resumed = downloader(server, tmp_path / 'spool')
+    assert download(resumed) == ITEMS
+    assert 0 not in server.offsets and 6 in server.offsets
+    assert resumed.stats['pages_resumed'] >= 1
+    assert resumed.validators['etag'] == ETAG
+
+def test_unchanged_pricelist_is_not_downloaded(server, tmp_path):
+    first = downloader(server, tmp_path / 'first')
+    download(first)
+
+    server.offsets.clear()
+    again = downloader(server, tmp_path / 'again', validators=first.validators)
+    assert download(again) == []
+    assert again.not_modified
+    assert server.offsets == [0]
+    assert not (tmp_path / 'again').exists()
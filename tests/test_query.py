@@ -0,0 +1,37 @@
+"""Tests for /api/query"""
+import pytest
+
+PRODUCT = 'Microsoft 365 Business Premium'
+
+def query(client, body):
+    response = client.post('/api/query', json=body)
+    assert response.status_code == 200
+    return response.get_json()
+
+def test_padded_product_matches_and_shares_cache_entry(client):
+    padded = query(client, {'product': PRODUCT + ' '})
+    clean = query(client, {'product': PRODUCT})
+    assert clean['total'] > 0
+    assert padded['total'] == clean['total']
+
+def test_search_whitespace_is_collapsed_before_matching(client):
+    spaced = query(client, {'search': '  business   premium '})
+    clean = query(client, {'search': 'business premium'})
+    assert clean['total'] > 0
+    assert spaced['total'] == clean['total']
+
+@pytest.mark.parametrize('body', [
+    {'product': ['a']},
+    {'search': 123},
+    {'segment': {'a': 1}},
+    {'search': 123, 'stream': True},
+    ['product'],
+])
+def test_non_string_filters_are_bad_requests(client, body):
+    response = client.post('/api/query', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_export_rejects_non_string_filters(client):
+    response = client.post('/api/export', json={'term': 12})
+    assert response.status_code == 400
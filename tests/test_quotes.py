@@ -0,0 +1,71 @@
+"""Tests for quote request validation"""
+import pytest
+
+from quotes import parse_quote_lines, parse_grid_request, GridCache
+from result_cache import ENTRY_OVERHEAD_BYTES
+
+@pytest.mark.parametrize('field', ['quantity', 'margin'])
+@pytest.mark.parametrize('value', ['nan', 'inf', '-inf', '1e309', float('nan'), float('inf')])
+def test_quote_lines_reject_non_finite_numbers(field, value):
+    with pytest.raises(ValueError, match=field):
+        parse_quote_lines({'lines': [{'price_id': 1, field: value}]})
+
+def test_quote_lines_reject_infinite_price_id():
+    with pytest.raises(ValueError, match='price_id'):
+        parse_quote_lines({'lines': [{'price_id': float('inf')}]})
+
+def test_batch_quote_with_nan_margin_is_a_bad_request(client):
+    response = client.post('/api/quotes/batch', json={'lines': [{'price_id': 1, 'margin': 'nan'}]})
+    assert response.status_code == 400
+    assert 'margin' in response.get_json()['error']
+
+def test_grid_range_is_sized_before_it_is_built():
+    with pytest.raises(ValueError, match='Grid too large'):
+        parse_grid_request({'price_ids': [1], 'margins': {'start': 0, 'stop': 2e8, 'step': 1}})
+
+@pytest.mark.parametrize('margins', [
+    {'start': 0, 'stop': 10, 'step': 0},
+    {'start': 0, 'stop': 10, 'step': -1},
+    {'start': 0, 'stop': 'inf', 'step': 1},
+    {'start': 'nan', 'stop': 10, 'step': 1},
+    {'start': 0, 'stop': 10, 'step': 'nan'},
+])
+def test_grid_rejects_bad_margin_ranges(margins):
+    with pytest.raises(ValueError, match='margin'):
+        parse_grid_request({'price_ids': [1], 'margins': margins})
+
+@pytest.mark.parametrize('body', [
+    {'margins': [10, 'nan']},
+    {'quantities': [1, 'inf']},
+    {'quantities': ['1e309']},
+])
+def test_grid_rejects_non_finite_lists(body):
+    with pytest.raises(ValueError, match='finite'):
+        parse_grid_request(dict(body, price_ids=[1]))
+
+def test_grid_range_includes_stop():
+    _, margins, _ = parse_grid_request({'price_ids': [1], 'margins': {'start': 10, 'stop': 11, 'step': 0.1}})
+    assert margins.tolist() == [10, 10.1, 10.2, 10.3, 10.4, 10.5, 10.6, 10.7, 10.8, 10.9, 11]
+
+def test_grid_cache_is_bounded_by_serialized_size():
+    cache = GridCache(max_bytes=3 * (1000 + ENTRY_OVERHEAD_BYTES), max_entry_bytes=2000)
+    for version in range(4):
+        cache.put(('grid', version), b'x' * 1000)
+    cache.put(('huge',), b'x' * 5000)
+
+    stats = cache.stats()
+    assert stats['entries'] == 3
+    assert stats['bytes'] == 3 * (1000 + ENTRY_OVERHEAD_BYTES)
+    assert stats['evictions'] == 1
+    assert cache.get(('grid', 0)) is None
+    assert cache.get(('huge',)) is None
+    assert cache.get(('grid', 3)) == b'x' * 1000
+
+def test_grid_response_is_cached(client, pricelist):
+    body = {'price_ids': [1, 2], 'margins': [10, 20], 'quantities': [1, 5]}
+    first = client.post('/api/quotes/grid', json=body)
+    hits = client.get('/api/stats').get_json()['grid_cache']['hits']
+    second = client.post('/api/quotes/grid', json=body)
+    assert first.status_code == second.status_code == 200
+    assert second.get_data() == first.get_data()
+    assert client.get('/api/stats').get_json()['grid_cache']['hits'] == hits + 1
@@ -0,0 +1,56 @@
+"""Tests for product/SKU search"""
+import json
+
+import pytest
+
+from db import read_connection
+from search import build_fts_query, add_snippets
+
+def like_count(text):
+    """Rows the substring (LIKE) search matches, the behaviour search must keep"""
+    with read_connection() as conn:
+        return conn.execute("""
+            SELECT COUNT(*) FROM prices
+            WHERE ProductTitle LIKE ?1 OR SkuTitle LIKE ?1 OR SkuDescription LIKE ?1
+        """, (f'%{text}%',)).fetchone()[0]
+
+@pytest.mark.parametrize('text', ['point', 'remium', 'Premium', 'business premium', 'e3', 'Microsoft 365 E3'])
+def test_single_phrase_search_matches_substrings(client, text):
+    response = client.post('/api/query', json={'search': text, 'limit': 1}).get_json()
+    assert like_count(text) > 0
+    assert response['total'] == like_count(text)
+    assert not response['fuzzy']
+
+def test_search_words_match_anywhere(client):
+    response = client.post('/api/query', json={'search': 'premium business'}).get_json()
+    assert response['total'] == like_count('business premium')
+
+def test_symbols_are_not_dropped_from_search(client):
+    response = client.post('/api/query', json={'search': 'c++'}).get_json()
+    assert like_count('c++') == 0
+    assert response['total'] == 0 or response['fuzzy']
+
+@pytest.mark.parametrize('text', ['e3', 'c', 'Microsoft 365 E3', '   '])
+def test_short_words_fall_back_to_substring_search(text):
+    assert build_fts_query(text) is None
+
+def test_fts_query_quotes_words():
+    assert build_fts_query('say "hi" there') == '"say" """hi""" "there"'
+
+def test_search_results_are_highlighted(client):
+    results = client.post('/api/query', json={'search': 'premium business'}).get_json()['results']
+    assert results
+    for result in results:
+        assert '<mark>Business</mark>' in result['Snippet'] and '<mark>Premium</mark>' in result['Snippet']
+
+def test_long_snippets_are_cut_around_the_first_match():
+    results = [{'ProductTitle': 'Other', 'SkuTitle': 'Other',
+                'SkuDescription': ' '.join(f'word{i}' for i in range(30)) + ' endpoint security'}]
+    add_snippets('point', results)
+    assert results[0]['Snippet'] == '…' + ' '.join(f'word{i}' for i in range(20, 30)) + ' end<mark>point</mark> security'
+
+def test_streamed_search_results_are_highlighted(client):
+    response = client.post('/api/query', json={'search': 'remium', 'stream': True})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(lines) == like_count('remium')
+    assert all('<mark>remium</mark>' in line['Snippet'] for line in lines)
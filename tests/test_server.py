@@ -0,0 +1,21 @@
+"""Tests for the production server wrapper"""
+import signal
+
+import waitress.server
+
+import server
+
+class InterruptedServer:
+    """Stands in for a waitress server whose run() is ended by stop()'s KeyboardInterrupt"""
+
+    def run(self):
+        raise KeyboardInterrupt
+
+def test_serve_returns_normally_when_stopped(monkeypatch, caplog):
+    monkeypatch.setattr(waitress.server, 'create_server', lambda *args, **kwargs: InterruptedServer())
+    monkeypatch.setattr(signal, 'signal', lambda signum, handler: None)  # Leave pytest's handlers alone
+    caplog.set_level('INFO', logger='server')
+
+    server.serve(lambda environ, start_response: [])
+
+    assert "Web server stopped" in caplog.text
@@ -0,0 +1,126 @@
+"""Tests for pricelist imports"""
+import functools
+
+import pytest
+
+import update_db
+from db import write_connection
+from partner_center import PricelistDownloader
+
+def api_items(count, price=10.0):
+    """Partner Center pricelist items for count products"""
+    return [{
+        'productTitle': f'API Product {i}', 'productId': f'API{i:04d}', 'skuId': '0001',
+        'skuTitle': f'API Product {i}', 'skuDescription': f'API product number {i}',
+        'termDuration': 'P1Y', 'billingPlan': 'Annual', 'market': 'US', 'currency': 'USD',
+        'unitPrice': price, 'erpPrice': price * 1.2, 'segment': 'Commercial',
+        'effectiveStartDate': '2024-01-01T00:00:00Z', 'effectiveEndDate': '9999-12-31T00:00:00Z',
+    } for i in range(count)]
+
+@pytest.fixture
+def partner_center(monkeypatch, pricelist_server):
+    """Point fetch_from_partner_center_api at the stand-in server; returns the import calls"""
+    monkeypatch.setattr(update_db, 'acquire_token_silent', lambda force_refresh=False: 'token')
+    monkeypatch.setattr(update_db, 'PricelistDownloader', functools.partial(
+        PricelistDownloader, base_url=pricelist_server.url, path='/pricelist', page_size=4))
+    imports = []
+    original = update_db.import_prices
+    monkeypatch.setattr(update_db, 'import_prices', lambda *args, **kwargs: imports.append(args) or original(*args, **kwargs))
+    return imports
+
+def test_unchanged_content_without_validators_is_not_reimported(partner_center, pricelist_server, scratch_prices):
+    pricelist_server.etag = None
+    pricelist_server.items = api_items(10)
+    assert update_db.fetch_from_partner_center_api(mode='diff')
+    assert len(partner_center) == 1
+
+    assert update_db.fetch_from_partner_center_api(mode='diff')
+    assert len(partner_center) == 1
+    assert pricelist_server.offsets.count(0) == 2  # Downloaded again, but not imported
+
+    pricelist_server.items = api_items(10, price=11.0)
+    assert update_db.fetch_from_partner_center_api(mode='diff')
+    assert len(partner_center) == 2
+
+def price_ids(conn):
+    """Map each price's ProductId to its row id"""
+    return dict(conn.execute("SELECT ProductId, id FROM prices").fetchall())
+
+def check_search_index(conn):
+    """Raise if prices_fts disagrees with prices (rank 1 compares against the content table)"""
+    conn.execute("INSERT INTO prices_fts(prices_fts, rank) VALUES ('integrity-check', 1)")
+
+def test_differential_import_applies_only_the_changes(scratch_prices):
+    items = api_items(5)
+    items[4]['billingPlan'] = None  # NULL key part, matched with IS
+    assert update_db.import_prices([update_db.api_items_to_frame(items)], 'before', mode='full')
+    with write_connection() as conn:
+        before = price_ids(conn)
+
+    changed = api_items(6)[:3] + api_items(6)[4:]
+    changed[2]['unitPrice'] = 12.5   # Updated
+    changed[3]['billingPlan'] = None  # Unchanged; API0003 is gone, API0005 is new
+    with write_connection() as conn:
+        counts = update_db.apply_differential_import(conn, [update_db.api_items_to_frame(changed)])
+        after = price_ids(conn)
+        updated = conn.execute("SELECT UnitPrice, ProfitPerLicense FROM prices WHERE ProductId = 'API0002'").fetchone()
+        found = [row[0] for row in conn.execute(
+            "SELECT rowid FROM prices_fts WHERE prices_fts MATCH '\"product number 5\"'")]
+        check_search_index(conn)
+
+    assert counts == {'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 3}
+    assert set(after) == {'API0000', 'API0001', 'API0002', 'API0004', 'API0005'}
+    for product_id in ('API0000', 'API0001', 'API0002', 'API0004'):
+        assert after[product_id] == before[product_id]
+    assert after['API0005'] > max(before.values())
+    assert tuple(updated) == (12.5, 12.0 - 12.5)
+    assert found == [after['API0005']]
+
+def price_index_columns(conn):
+    """Column tuples of the indexes on prices"""
+    return {tuple(column[2] for column in conn.execute(f"PRAGMA index_info({index[1]})"))
+            for index in conn.execute("PRAGMA index_list(prices)")}
+
+def test_full_import_swaps_in_the_complete_shadow_table(scratch_prices):
+    with write_connection() as conn:
+        last_id = conn.execute("SELECT MAX(id) FROM prices").fetchone()[0]
+
+    assert update_db.import_prices([update_db.api_items_to_frame(api_items(20))], 'full', mode='full')
+
+    with write_connection() as conn:
+        assert tuple(conn.execute("SELECT COUNT(*), MIN(id) FROM prices").fetchone()) == (20, last_id + 1)
+        assert set(update_db.PRICE_INDEXES.values()) <= price_index_columns(conn)
+        triggers = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'prices'")}
+        assert triggers == {'prices_fts_insert', 'prices_fts_delete', 'prices_fts_update'}
+        assert not update_db.table_exists(conn.cursor(), update_db.SHADOW_TABLE)
+        assert not update_db.table_exists(conn.cursor(), update_db.SHADOW_SEARCH_TABLE)
+        assert 'trigram' in update_db.search_table_sql(conn.cursor())
+        check_search_index(conn)
+
+        # The recreated triggers keep the swapped-in index in sync
+        conn.execute("UPDATE prices SET ProductTitle = 'Renamed Product' WHERE ProductId = 'API0007'")
+        found = [row[0] for row in conn.execute(
+            "SELECT p.ProductId FROM prices_fts JOIN prices AS p ON p.id = prices_fts.rowid "
+            "WHERE prices_fts MATCH '\"renamed\"'")]
+        check_search_index(conn)
+        conn.rollback()
+    assert found == ['API0007']
+
+def test_failed_shadow_validation_leaves_prices_untouched(scratch_prices, monkeypatch):
+    with write_connection() as conn:
+        before = [tuple(row) for row in conn.execute("SELECT id, ProductId, UnitPrice FROM prices ORDER BY id")]
+    last_hash = update_db.get_last_csv_hash()
+
+    # Lose a row on its way into the shadow table
+    price_rows = update_db.price_rows
+    monkeypatch.setattr(update_db, 'price_rows', lambda df: list(price_rows(df))[:-1])
+    with pytest.raises(ValueError, match='Shadow table has 19 rows, expected 20'):
+        update_db.import_prices([update_db.api_items_to_frame(api_items(20))], 'failed', mode='full')
+
+    with write_connection() as conn:
+        assert [tuple(row) for row in conn.execute("SELECT id, ProductId, UnitPrice FROM prices ORDER BY id")] == before
+        assert not update_db.table_exists(conn.cursor(), update_db.SHADOW_TABLE)
+        assert not update_db.table_exists(conn.cursor(), update_db.SHADOW_SEARCH_TABLE)
+        check_search_index(conn)
+    assert update_db.get_last_csv_hash() == last_hash
@@ -3,29 +3,130 @@ Database update module for MSP Pricing Application
 Handles CSV ingestion and Partner Center API fetching
 """
 import sqlite3
+import numpy as np
 import pandas as pd
 import hashlib
+import itertools
 import logging
-import requests
-from datetime import datetime, timedelta
+import os
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
 from msal import PublicClientApplication, SerializableTokenCache
+from cryptography.fernet import InvalidToken
+import functools
 import json
 
-from config import config, BASE_DIR, DB_NAME, AUTHORITY, SCOPE, PARTNER_CENTER_API
+from config import (config, cipher, BASE_DIR, AUTHORITY, SCOPE,
+                    IMPORT_CHUNK_ROWS, TOKEN_CACHE_FILE, TOKEN_REFRESH_MARGIN_SECONDS)
+from db import read_connection, write_connection
+from partner_center import PricelistDownloader, CachedPricelist
+from indexes import AUTO_INDEX_PREFIX, create_usage_table, auto_indexes, query_usage
+from fuzzy import create_synonyms_table
+from metrics import record_import
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-DB_PATH = BASE_DIR / "data" / DB_NAME
+# Pricelist columns stored in the prices table, in CSV order
+PRICE_COLUMNS = [
+    'ChangeIndicator', 'ProductTitle', 'ProductId', 'SkuId', 'SkuTitle',
+    'Publisher', 'SkuDescription', 'UnitOfMeasure', 'TermDuration',
+    'BillingPlan', 'Market', 'Currency', 'UnitPrice', 'PricingTierRangeMin',
+    'PricingTierRangeMax', 'EffectiveStartDate', 'EffectiveEndDate', 'Tags',
+    'ERPPrice', 'Segment', 'PreviousValues'
+]
+
+# Numeric price columns; everything else is stored as text
+NUMERIC_PRICE_COLUMNS = ['UnitPrice', 'ERPPrice']
+
+# Columns computed from the pricelist at import time and stored alongside it
+DERIVED_COLUMNS = ['MarkupPercent', 'ProfitPerLicense', 'TermDurationHuman']
+
+# Every column written by an import
+STORED_COLUMNS = PRICE_COLUMNS + DERIVED_COLUMNS
+
+# CSV column types, keyed by CSV header (the CSV spells ERPPrice 'ERP Price')
+CSV_DTYPES = {
+    ('ERP Price' if column == 'ERPPrice' else column):
+        (float if column in NUMERIC_PRICE_COLUMNS else str)
+    for column in PRICE_COLUMNS
+}
+
+# Columns identifying a price across imports (the prices UNIQUE constraint)
+PRICE_KEY_COLUMNS = [
+    'ProductId', 'SkuId', 'TermDuration', 'BillingPlan', 'Segment', 'EffectiveStartDate'
+]
+
+# Import modes: 'diff' upserts changes in place, 'full' replaces every row
+IMPORT_MODES = ('diff', 'full')
+
+# Callbacks run after every successful import (e.g. to rebuild in-memory caches)
+_import_listeners = []
+
+def add_import_listener(callback):
+    """Register a callable to be run after each successful import"""
+    if callback not in _import_listeners:
+        _import_listeners.append(callback)
+
+def notify_import_listeners():
+    """Run all registered import listeners, logging (not raising) failures"""
+    for callback in list(_import_listeners):
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Import listener {callback!r} failed: {e}", exc_info=True)
+
+# Display names for ISO 8601 term durations (others are shown as-is)
+TERM_DURATION_NAMES = {
+    'P1Y': '1 Year (Annual)',
+    'P1M': '1 Month (Monthly)',
+    'P3Y': '3 Years',
+    'P2Y': '2 Years',
+    '': 'Not specified'
+}
+
+def term_duration_to_human(term):
+    """Convert ISO 8601 duration to human readable"""
+    return TERM_DURATION_NAMES.get(term, term)
 
 def init_database():
     """Initialize SQLite database with schema"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    with write_connection() as conn:
+        _create_schema(conn.cursor())
+    logger.info("Database initialized successfully")
+
+def _create_schema(cursor):
+    """Create tables, indexes and the search index if missing"""
 
+    create_prices_table(cursor)
+    migrate_prices_table(cursor)
+    create_usage_table(cursor)
+    create_synonyms_table(cursor)
+
+    # Create indexes for faster queries
+    create_price_indexes(cursor)
+
+    # Full-text search index over product/SKU text
+    try:
+        create_search_index(cursor)
+    except sqlite3.OperationalError as e:
+        logger.warning(f"FTS5 unavailable, search will fall back to substring scans: {e}")
+
+    # Metadata table for tracking updates
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS prices (
+        CREATE TABLE IF NOT EXISTS metadata (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def create_prices_table(cursor, table='prices'):
+    """Create a table with the prices schema (also used for the import shadow table)"""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             ChangeIndicator TEXT,
             ProductTitle TEXT,
@@ -48,30 +149,176 @@ def init_database():
             ERPPrice REAL,
             Segment TEXT,
             PreviousValues TEXT,
+            MarkupPercent REAL NOT NULL DEFAULT 0,
+            ProfitPerLicense REAL NOT NULL DEFAULT 0,
+            TermDurationHuman TEXT,
             imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             UNIQUE(ProductId, SkuId, TermDuration, BillingPlan, Segment, EffectiveStartDate)
         )
     """)
 
-    # Create indexes for faster queries
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_title ON prices(ProductTitle)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_segment ON prices(Segment)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_term ON prices(TermDuration)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_billing ON prices(BillingPlan)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_effective ON prices(EffectiveStartDate, EffectiveEndDate)")
+# SQL expressions computing DERIVED_COLUMNS from the stored pricelist,
+# used to backfill rows imported before the columns existed
+DERIVED_COLUMN_SQL = {
+    'MarkupPercent': "CASE WHEN UnitPrice > 0 THEN ROUND((IFNULL(ERPPrice, 0) - UnitPrice) / UnitPrice * 100, 1) ELSE 0 END",
+    'ProfitPerLicense': "ROUND(IFNULL(ERPPrice, 0) - IFNULL(UnitPrice, 0), 2)",
+    'TermDurationHuman': "CASE TermDuration {} ELSE TermDuration END".format(
+        ' '.join(f"WHEN '{term}' THEN '{name}'" for term, name in TERM_DURATION_NAMES.items())),
+}
+
+def migrate_prices_table(cursor, table='prices'):
+    """Add DERIVED_COLUMNS to a prices table created before they existed, and fill them in"""
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    missing = [column for column in DERIVED_COLUMNS if column not in existing]
+    if not missing:
+        return
+
+    for column in missing:
+        column_type = 'TEXT' if column == 'TermDurationHuman' else 'REAL NOT NULL DEFAULT 0'
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+    assignments = ', '.join(f"{column} = {DERIVED_COLUMN_SQL[column]}" for column in missing)
+    cursor.execute(f"UPDATE {table} SET {assignments}")
+    logger.info(f"Added derived columns to {table}: {', '.join(missing)}")
+
+# Secondary indexes on prices: base index name -> columns.
+# Each filter column is followed by the default result order (ProductTitle,
+# SkuTitle, id), so a query filtered on any one of them reads its rows in
+# index order. Combinations of filters get indexes from indexes.auto_indexes.
+PRICE_INDEXES = {
+    'idx_title_sort': ('ProductTitle', 'SkuTitle'),
+    'idx_segment_sort': ('Segment', 'ProductTitle', 'SkuTitle'),
+    'idx_term_sort': ('TermDuration', 'ProductTitle', 'SkuTitle'),
+    'idx_billing_sort': ('BillingPlan', 'ProductTitle', 'SkuTitle'),
+    'idx_effective': ('EffectiveStartDate', 'EffectiveEndDate'),
+}
+
+def create_price_indexes(cursor, table='prices'):
+    """
+    Create any PRICE_INDEXES and usage-based auto indexes missing from table.
+    Indexes keep their names when a shadow table is renamed to prices, so an
+    index is matched by its columns, and named with a numeric suffix when its
+    base name is still taken by the table being replaced. Auto indexes no
+    longer chosen, and plain indexes made redundant by a longer one (a
+    leading-column prefix of it), are dropped.
+    """
+    indexes = dict(PRICE_INDEXES)
+    indexes.update(auto_indexes(cursor, exclude=set(PRICE_INDEXES.values())))
+    wanted = set(indexes.values())
+
+    existing = set()
+    for index in cursor.execute(f"PRAGMA index_list({table})").fetchall():
+        name = index[1]
+        columns = tuple(column[2] for column in cursor.execute(f"PRAGMA index_info({name})"))
+        redundant = index[3] == 'c' and columns not in wanted and (
+            name.startswith(AUTO_INDEX_PREFIX)
+            or any(len(columns) < len(w) and w[:len(columns)] == columns for w in wanted))
+        if redundant:
+            cursor.execute(f"DROP INDEX {name}")
+            logger.info(f"Dropped index {name} on {table}")
+            continue
+        existing.add(columns)
+
+    taken = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    for base_name, columns in indexes.items():
+        if columns in existing:
+            continue
+        name, suffix = base_name, 1
+        while name in taken:
+            name, suffix = f"{base_name}_{suffix}", suffix + 1
+        cursor.execute(f"CREATE INDEX {name} ON {table}({', '.join(columns)})")
+        taken.add(name)
+        if name.startswith(AUTO_INDEX_PREFIX):
+            logger.info(f"Created index {name} on {table}({', '.join(columns)})")
+
+def analyze_prices(cursor):
+    """Refresh the query planner statistics after prices or its indexes change"""
+    cursor.execute("ANALYZE prices")
+    cursor.execute("PRAGMA optimize")
+
+def refresh_price_indexes():
+    """
+    Save recorded query usage, bring the prices indexes in line with it and
+    refresh the planner statistics. Imports do the same as they run.
+    """
+    query_usage.flush()
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        create_price_indexes(cursor)
+        analyze_prices(cursor)
 
-    # Metadata table for tracking updates
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS metadata (
-            key TEXT PRIMARY KEY,
-            value TEXT,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+def create_search_table(cursor, name='prices_fts'):
+    """
+    Create an FTS5 table indexing prices (content is always read from prices).
+    The trigram tokenizer makes every search word a case-insensitive
+    substring match, as the LIKE search it replaces was.
+    """
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5(
+            ProductTitle,
+            SkuTitle,
+            SkuDescription,
+            content='prices',
+            content_rowid='id',
+            tokenize='trigram'
         )
     """)
 
-    conn.commit()
-    conn.close()
-    logger.info("Database initialized successfully")
+def create_search_triggers(cursor):
+    """Create the triggers keeping prices_fts in sync with prices"""
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS prices_fts_insert AFTER INSERT ON prices BEGIN
+            INSERT INTO prices_fts(rowid, ProductTitle, SkuTitle, SkuDescription)
+            VALUES (new.id, new.ProductTitle, new.SkuTitle, new.SkuDescription);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS prices_fts_delete AFTER DELETE ON prices BEGIN
+            INSERT INTO prices_fts(prices_fts, rowid, ProductTitle, SkuTitle, SkuDescription)
+            VALUES ('delete', old.id, old.ProductTitle, old.SkuTitle, old.SkuDescription);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS prices_fts_update AFTER UPDATE ON prices BEGIN
+            INSERT INTO prices_fts(prices_fts, rowid, ProductTitle, SkuTitle, SkuDescription)
+            VALUES ('delete', old.id, old.ProductTitle, old.SkuTitle, old.SkuDescription);
+            INSERT INTO prices_fts(rowid, ProductTitle, SkuTitle, SkuDescription)
+            VALUES (new.id, new.ProductTitle, new.SkuTitle, new.SkuDescription);
+        END
+    """)
+
+def table_exists(cursor, name):
+    """Check whether a table (or virtual table) exists"""
+    row = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+def create_search_index(cursor):
+    """
+    Create the FTS5 index used by product/SKU search.
+    It is an external-content table over prices, kept in sync by triggers,
+    tokenized into trigrams so substring searches stay index lookups.
+    """
+    exists = table_exists(cursor, 'prices_fts')
+    if exists and 'trigram' not in search_table_sql(cursor):
+        # Word-tokenized index from an older version: replace it, creating
+        # the new table first so a failure leaves the old one in place
+        create_search_table(cursor, 'prices_fts_trigram')
+        cursor.execute("DROP TABLE prices_fts")
+        cursor.execute("ALTER TABLE prices_fts_trigram RENAME TO prices_fts")
+        exists = False
+
+    create_search_table(cursor)
+    create_search_triggers(cursor)
+
+    if not exists:
+        # Index rows imported before the search index existed
+        cursor.execute("INSERT INTO prices_fts(prices_fts) VALUES ('rebuild')")
+
+def search_table_sql(cursor):
+    """Return the CREATE statement of prices_fts"""
+    row = cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'prices_fts'").fetchone()
+    return row[0] if row else ''
 
 def calculate_csv_hash(csv_path):
     """Calculate MD5 hash of CSV file to detect changes"""
@@ -84,37 +331,254 @@ def calculate_csv_hash(csv_path):
 def get_last_csv_hash():
     """Get the hash of the last imported CSV"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT value FROM metadata WHERE key = 'last_csv_hash'")
-        result = cursor.fetchone()
-        conn.close()
+        with read_connection() as conn:
+            result = conn.execute("SELECT value FROM metadata WHERE key = 'last_csv_hash'").fetchone()
         return result[0] if result else None
     except:
         return None
 
 def set_last_csv_hash(hash_value):
     """Store the hash of the imported CSV"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
+    with write_connection() as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO metadata (key, value, updated_at)
+            VALUES ('last_csv_hash', ?, CURRENT_TIMESTAMP)
+        """, (hash_value,))
+
+# Filter dropdown facets: response key -> prices column
+FILTER_FACETS = {
+    'products': 'ProductTitle',
+    'segments': 'Segment',
+    'terms': 'TermDuration',
+    'billing': 'BillingPlan',
+}
+
+def compute_filter_facets(conn):
+    """Compute the distinct values shown in the /api/filters dropdowns"""
+    facets = {}
+    for key, column in FILTER_FACETS.items():
+        rows = conn.execute(f"""
+            SELECT DISTINCT {column}
+            FROM prices
+            WHERE {column} IS NOT NULL
+            ORDER BY {column}
+        """).fetchall()
+        facets[key] = [row[0] for row in rows]
+    return facets
+
+def store_filter_facets(conn, version):
+    """Precompute filter facets and store them tagged with the import version"""
+    facets = compute_filter_facets(conn)
+    conn.execute("""
         INSERT OR REPLACE INTO metadata (key, value, updated_at)
-        VALUES ('last_csv_hash', ?, CURRENT_TIMESTAMP)
-    """, (hash_value,))
-    conn.commit()
-    conn.close()
+        VALUES ('filter_facets', ?, CURRENT_TIMESTAMP)
+    """, (json.dumps({'version': version, 'facets': facets}),))
+    return facets
 
 def filter_active_prices(df):
     """
     No filtering needed - all pricing rows in CSV are active (EffectiveEndDate = 9999-11-30 means 'never expires')
     Simply return all rows from CSV for import
     """
-    logger.info(f"Importing all {len(df)} pricing records from CSV")
-    return df.copy()
+    return df
+
+def read_price_chunks(csv_path, chunk_rows=IMPORT_CHUNK_ROWS):
+    """
+    Yield the pricelist CSV as DataFrames of at most chunk_rows rows, so
+    memory use depends on the chunk size rather than the file size.
+    Columns are read with CSV_DTYPES and 'ERP Price' is renamed to ERPPrice.
+    """
+    reader = pd.read_csv(
+        csv_path,
+        encoding='utf-8-sig',  # Handle BOM
+        dtype=CSV_DTYPES,
+        usecols=lambda column: column in CSV_DTYPES,
+        chunksize=chunk_rows,
+    )
+    with reader:
+        for chunk in reader:
+            chunk = chunk.rename(columns={'ERP Price': 'ERPPrice'})
+            yield filter_active_prices(chunk)
+
+def derive_price_columns(df):
+    """Compute DERIVED_COLUMNS for a chunk with PRICE_COLUMNS, column-wise"""
+    unit_price = pd.to_numeric(df['UnitPrice'], errors='coerce').fillna(0)
+    erp_price = pd.to_numeric(df['ERPPrice'], errors='coerce').fillna(0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        markup = np.where(unit_price > 0, (erp_price - unit_price) / unit_price * 100, 0)
+
+    df = df.copy()
+    df['MarkupPercent'] = np.round(markup, 1)
+    df['ProfitPerLicense'] = np.round(erp_price - unit_price, 2)
+    df['TermDurationHuman'] = df['TermDuration'].map(term_duration_to_human, na_action='ignore')
+    return df
+
+def price_rows(df):
+    """Return DataFrame rows as tuples in STORED_COLUMNS order, NaN as None"""
+    df = derive_price_columns(df.reindex(columns=PRICE_COLUMNS)).astype(object)
+    return df.where(df.notna(), None).itertuples(index=False, name=None)
+
+# Full imports are built here and renamed to prices/prices_fts once complete
+SHADOW_TABLE = 'prices_shadow'
+SHADOW_SEARCH_TABLE = 'prices_fts_shadow'
+
+def drop_shadow_tables(cursor):
+    """Drop a leftover shadow table from an interrupted full import"""
+    cursor.execute(f"DROP TABLE IF EXISTS {SHADOW_SEARCH_TABLE}")
+    cursor.execute(f"DROP TABLE IF EXISTS {SHADOW_TABLE}")
+    if table_exists(cursor, 'sqlite_stat1'):
+        cursor.execute("DELETE FROM sqlite_stat1 WHERE tbl = ?", (SHADOW_TABLE,))
+
+def build_shadow_prices(chunks):
+    """
+    First half of a full import: build the new pricelist from an iterable of
+    DataFrame chunks in the shadow table, with its indexes, search index and
+    planner statistics, and check it holds every row. Runs in its own
+    transaction; prices is not touched, so readers carry on with the current
+    pricelist. Returns the number of rows built.
+    """
+    columns = ', '.join(STORED_COLUMNS)
+    placeholders = ', '.join('?' * len(STORED_COLUMNS))
+    search_columns = 'ProductTitle, SkuTitle, SkuDescription'
+
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        drop_shadow_tables(cursor)
+        create_prices_table(cursor, SHADOW_TABLE)
+
+        # Continue the live id sequence so ids from the old pricelist are never reused
+        cursor.execute("""
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT ?, seq FROM sqlite_sequence WHERE name = 'prices'
+        """, (SHADOW_TABLE,))
+
+        expected = 0
+        for chunk in chunks:
+            cursor.executemany(f"INSERT INTO {SHADOW_TABLE} ({columns}) VALUES ({placeholders})",
+                               price_rows(chunk))
+            expected += len(chunk)
+        create_price_indexes(cursor, SHADOW_TABLE)
+
+        searchable = table_exists(cursor, 'prices_fts')
+        if searchable:
+            create_search_table(cursor, SHADOW_SEARCH_TABLE)
+            cursor.execute(f"""
+                INSERT INTO {SHADOW_SEARCH_TABLE} (rowid, {search_columns})
+                SELECT id, {search_columns} FROM {SHADOW_TABLE}
+            """)
+
+        cursor.execute(f"ANALYZE {SHADOW_TABLE}")
+
+        built = cursor.execute(f"SELECT COUNT(*) FROM {SHADOW_TABLE}").fetchone()[0]
+        if built != expected:
+            raise ValueError(f"Shadow table has {built} rows, expected {expected}")
+        if searchable:
+            # One docsize row per indexed document
+            indexed = cursor.execute(f"SELECT COUNT(*) FROM {SHADOW_SEARCH_TABLE}_docsize").fetchone()[0]
+            if indexed != built:
+                raise ValueError(f"Shadow search index has {indexed} rows, expected {built}")
+
+    return built
+
+def swap_in_shadow_prices(conn):
+    """
+    Second half of a full import: replace prices (and prices_fts) with the
+    shadow tables. Only renames and drops, so it is quick; it runs in the
+    caller's transaction and readers see the old pricelist until it commits.
+    Returns change counts.
+    """
+    cursor = conn.cursor()
+    if not table_exists(cursor, SHADOW_TABLE):
+        raise ValueError("No shadow table to swap in")
+
+    deleted = cursor.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+    inserted = cursor.execute(f"SELECT COUNT(*) FROM {SHADOW_TABLE}").fetchone()[0]
+    searchable = table_exists(cursor, SHADOW_SEARCH_TABLE)
+
+    # Dropping prices also drops its indexes and search triggers
+    cursor.execute("DROP TABLE prices")
+    cursor.execute("DROP TABLE IF EXISTS prices_fts")
+    cursor.execute(f"ALTER TABLE {SHADOW_TABLE} RENAME TO prices")
+    if searchable:
+        cursor.execute(f"ALTER TABLE {SHADOW_SEARCH_TABLE} RENAME TO prices_fts")
+        create_search_triggers(cursor)
+
+    # ANALYZE results are not renamed with the table
+    cursor.execute("DELETE FROM sqlite_stat1 WHERE tbl = 'prices'")
+    cursor.execute("UPDATE sqlite_stat1 SET tbl = 'prices' WHERE tbl = ?", (SHADOW_TABLE,))
 
-def ingest_csv(csv_path, force=False):
-    """Ingest CSV file into database"""
+    return {'inserted': inserted, 'updated': 0, 'deleted': deleted, 'unchanged': 0}
+
+def apply_differential_import(conn, chunks):
+    """
+    Differential import: stage the new pricelist from an iterable of
+    DataFrame chunks, then apply only the differences to prices, matching
+    rows on PRICE_KEY_COLUMNS. Existing rows keep their ids. Returns
+    insert/update/delete/unchanged counts.
+    """
+    cursor = conn.cursor()
+    columns = ', '.join(STORED_COLUMNS)
+    placeholders = ', '.join('?' * len(STORED_COLUMNS))
+    # IS rather than = so NULL key parts (e.g. a missing BillingPlan) still match
+    key_match = ' AND '.join(f"s.{c} IS prices.{c}" for c in PRICE_KEY_COLUMNS)
+    value_columns = [c for c in PRICE_COLUMNS if c not in PRICE_KEY_COLUMNS]
+
+    cursor.execute("DROP TABLE IF EXISTS temp.import_stage")
+    cursor.execute(f"CREATE TEMP TABLE import_stage AS SELECT {columns} FROM prices WHERE 0")
+    try:
+        staged = 0
+        for chunk in chunks:
+            cursor.executemany(f"INSERT INTO import_stage ({columns}) VALUES ({placeholders})",
+                               price_rows(chunk))
+            staged += len(chunk)
+        cursor.execute(f"CREATE INDEX temp.idx_import_stage_key ON import_stage ({', '.join(PRICE_KEY_COLUMNS)})")
+
+        cursor.execute(f"""
+            DELETE FROM prices
+            WHERE NOT EXISTS (SELECT 1 FROM import_stage AS s WHERE {key_match})
+        """)
+        deleted = cursor.rowcount
+
+        # Derived columns follow the pricelist columns they are computed from
+        assignments = ', '.join(f"{c} = s.{c}" for c in value_columns + DERIVED_COLUMNS)
+        changed = ' OR '.join(f"s.{c} IS NOT prices.{c}" for c in value_columns)
+        cursor.execute(f"""
+            UPDATE prices
+            SET {assignments}, imported_at = CURRENT_TIMESTAMP
+            FROM import_stage AS s
+            WHERE {key_match} AND ({changed})
+        """)
+        updated = cursor.rowcount
+
+        cursor.execute(f"""
+            INSERT INTO prices ({columns})
+            SELECT {columns} FROM import_stage AS s
+            WHERE NOT EXISTS (SELECT 1 FROM prices WHERE {key_match})
+        """)
+        inserted = cursor.rowcount
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.import_stage")
+
+    return {
+        'inserted': inserted,
+        'updated': updated,
+        'deleted': deleted,
+        'unchanged': staged - inserted - updated,
+    }
+
+def ingest_csv(csv_path, force=False, mode=None, chunk_rows=None):
+    """
+    Ingest CSV file into database.
+    mode is 'diff' (apply only changed rows, keeping row ids stable) or
+    'full' (replace every row); defaults to config.import_mode.
+    The file is read and written chunk_rows rows at a time
+    (default IMPORT_CHUNK_ROWS) so large pricelists fit in bounded memory.
+    """
     csv_path = Path(csv_path)
+    mode = mode or config.import_mode
+    if mode not in IMPORT_MODES:
+        logger.error(f"Unknown import mode: {mode}")
+        return False
 
     if not csv_path.exists():
         logger.error(f"CSV file not found: {csv_path}")
@@ -128,68 +592,141 @@ def ingest_csv(csv_path, force=False):
         logger.info("CSV unchanged, skipping import")
         return True
 
-    logger.info(f"Importing CSV: {csv_path}")
+    logger.info(f"Importing CSV ({mode} mode): {csv_path}")
 
     try:
-        # Read CSV
-        df = pd.read_csv(csv_path, encoding='utf-8-sig')  # Handle BOM
-
-        # Rename ERP Price column (has space)
-        if 'ERP Price' in df.columns:
-            df.rename(columns={'ERP Price': 'ERPPrice'}, inplace=True)
+        chunks = read_price_chunks(csv_path, chunk_rows or IMPORT_CHUNK_ROWS)
+        return import_prices(chunks, current_hash, mode=mode, source='csv')
+    except Exception as e:
+        logger.error(f"Error importing CSV: {e}", exc_info=True)
+        return False
 
-        # Get all pricing records (no date filtering needed)
-        active_df = filter_active_prices(df)
+def import_prices(chunks, content_hash, mode=None, source='csv'):
+    """
+    Write a pricelist, given as an iterable of DataFrame chunks with
+    PRICE_COLUMNS, to the database and record the import in metadata.
+    content_hash identifies the pricelist for change detection; for streamed
+    sources it can be a callable, evaluated once every chunk has been read.
+    Raises on failure; returns False if the pricelist is empty.
+    """
+    mode = mode or config.import_mode
+    started = time.perf_counter()
+
+    # Refuse an empty pricelist before touching the database
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None or first.empty:
+        logger.warning(f"No pricing records found in {source} pricelist")
+        return False
+    chunks = itertools.chain([first], chunks)
 
-        if active_df.empty:
-            logger.warning("No pricing records found in CSV")
-            return False
+    # Initialize database; picks up indexes for recently used filter combinations
+    query_usage.flush()
+    init_database()
 
-        # Initialize database
-        init_database()
+    if mode == 'full':
+        build_shadow_prices(chunks)
 
-        # Clear existing data
-        conn = sqlite3.connect(DB_PATH)
+    with write_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM prices")
-        conn.commit()
 
-        # Insert new data
-        active_df.to_sql('prices', conn, if_exists='append', index=False)
+        if mode == 'diff':
+            counts = apply_differential_import(conn, chunks)
+        else:
+            counts = swap_in_shadow_prices(conn)
+
+        try:
+            cursor.execute("INSERT INTO prices_fts(prices_fts) VALUES ('optimize')")
+        except sqlite3.OperationalError:
+            pass  # FTS5 unavailable
+
+        # A full import's shadow table was analyzed before the swap
+        if mode == 'diff':
+            analyze_prices(cursor)
+        else:
+            cursor.execute("PRAGMA optimize")
+
+        if callable(content_hash):
+            content_hash = content_hash()
+
+        rows = counts['inserted'] + counts['updated'] + counts['unchanged']
+        seconds = time.perf_counter() - started
+        rows_per_second = rows / seconds if seconds > 0 else 0.0
 
         # Update metadata
-        set_last_csv_hash(current_hash)
+        set_last_csv_hash(content_hash)
+        store_filter_facets(conn, content_hash)
         cursor.execute("""
             INSERT OR REPLACE INTO metadata (key, value, updated_at)
             VALUES ('last_import', ?, CURRENT_TIMESTAMP)
         """, (datetime.now().isoformat(),))
         cursor.execute("""
             INSERT OR REPLACE INTO metadata (key, value, updated_at)
-            VALUES ('import_source', 'csv', CURRENT_TIMESTAMP)
-        """)
-
-        conn.commit()
-        conn.close()
-
-        logger.info(f"Successfully imported {len(active_df)} active prices")
-        config.last_update = datetime.now().isoformat()
-        return True
+            VALUES ('import_source', ?, CURRENT_TIMESTAMP)
+        """, (source,))
+        cursor.execute("""
+            INSERT OR REPLACE INTO metadata (key, value, updated_at)
+            VALUES ('last_import_stats', ?, CURRENT_TIMESTAMP)
+        """, (json.dumps(dict(counts, mode=mode, rows=rows, seconds=round(seconds, 3),
+                              rows_per_second=round(rows_per_second))),))
+
+    record_import(source, mode, seconds, counts)
+    logger.info(f"Successfully imported {rows} active prices in {seconds:.1f}s "
+                f"({rows_per_second:,.0f} rows/sec; "
+                f"{counts['inserted']} inserted, {counts['updated']} updated, "
+                f"{counts['deleted']} deleted, {counts['unchanged']} unchanged)")
+    config.last_update = datetime.now().isoformat()
+    notify_import_listeners()
+    return True
+
+class EncryptedTokenCache(SerializableTokenCache):
+    """
+    MSAL token cache persisted to TOKEN_CACHE_FILE, encrypted with the
+    config cipher, so accounts and refresh tokens survive restarts and
+    scheduled updates can authenticate silently.
+    """
 
-    except Exception as e:
-        logger.error(f"Error importing CSV: {e}", exc_info=True)
-        return False
+    def __init__(self, path=TOKEN_CACHE_FILE):
+        super().__init__()
+        self.path = Path(path)
+        self._save_lock = threading.Lock()
+        if self.path.exists():
+            try:
+                self.deserialize(cipher.decrypt(self.path.read_bytes()).decode())
+            except (InvalidToken, ValueError) as e:
+                logger.warning(f"Ignoring unreadable token cache {self.path} ({type(e).__name__})")
+
+    def save(self):
+        """Write the cache to disk if MSAL has changed it"""
+        with self._save_lock:
+            if not self.has_state_changed:
+                return
+            partial = self.path.with_suffix('.tmp')
+            partial.write_bytes(cipher.encrypt(self.serialize().encode()))
+            os.replace(partial, self.path)
+            self.has_state_changed = False
+
+# One MSAL app (and token cache) per process, rebuilt if the credentials change
+_msal_app = None
+_msal_app_key = None
+_msal_lock = threading.Lock()
 
 def get_msal_app():
-    """Get MSAL PublicClientApplication instance"""
+    """Get the shared MSAL PublicClientApplication instance"""
+    global _msal_app, _msal_app_key
     if not config.client_id or not config.tenant_id:
         raise ValueError("Azure AD credentials not configured")
 
     authority_url = f"{AUTHORITY}/{config.tenant_id}"
-    app = PublicClientApplication(
-        config.client_id,
-        authority=authority_url
-    )
-    return app
+    with _msal_lock:
+        if _msal_app is None or _msal_app_key != (config.client_id, authority_url):
+            _msal_app = PublicClientApplication(
+                config.client_id,
+                authority=authority_url,
+                token_cache=EncryptedTokenCache()
+            )
+            _msal_app_key = (config.client_id, authority_url)
+        return _msal_app
 
 def acquire_token_interactive():
     """Acquire token via interactive browser login (first-time setup)"""
@@ -201,6 +738,7 @@ def acquire_token_interactive():
             scopes=SCOPE,
             prompt='select_account'
         )
+        app.token_cache.save()
 
         if "access_token" in result:
             config.access_token = result["access_token"]
@@ -217,8 +755,14 @@ def acquire_token_interactive():
         logger.error(f"Error during interactive authentication: {e}", exc_info=True)
         return None
 
-def acquire_token_silent():
-    """Acquire token silently using refresh token"""
+def acquire_token_silent(force_refresh=False):
+    """
+    Acquire token silently from the persistent token cache.
+    A cached access token is only used if it is valid for at least
+    TOKEN_REFRESH_MARGIN_SECONDS; otherwise it is refreshed now, so a long
+    download does not start with a token about to expire. force_refresh
+    always fetches a new token (e.g. after the API rejected the cached one).
+    """
     try:
         app = get_msal_app()
 
@@ -228,9 +772,20 @@ def acquire_token_silent():
         if accounts:
             result = app.acquire_token_silent(
                 scopes=SCOPE,
-                account=accounts[0]
+                account=accounts[0],
+                force_refresh=force_refresh
             )
 
+            if (result and "access_token" in result and not force_refresh
+                    and result.get("expires_in", 0) < TOKEN_REFRESH_MARGIN_SECONDS):
+                logger.info("Cached access token expires soon, refreshing")
+                result = app.acquire_token_silent(
+                    scopes=SCOPE,
+                    account=accounts[0],
+                    force_refresh=True
+                ) or result
+            app.token_cache.save()
+
             if result and "access_token" in result:
                 config.access_token = result["access_token"]
                 if "refresh_token" in result:
@@ -246,8 +801,57 @@ def acquire_token_silent():
         logger.error(f"Error during silent authentication: {e}", exc_info=True)
         return acquire_token_interactive()
 
-def fetch_from_partner_center_api():
-    """Fetch pricing data from Partner Center API"""
+def api_items_to_frame(items):
+    """
+    Convert a page of Partner Center pricelist items to a DataFrame chunk
+    with PRICE_COLUMNS. Item keys are matched to columns ignoring case and
+    spaces (productTitle -> ProductTitle, erpPrice -> ERPPrice).
+    """
+    frame = pd.DataFrame.from_records(items)
+    columns = {column.lower(): column for column in PRICE_COLUMNS}
+    frame = frame.rename(columns=lambda key: columns.get(str(key).replace(' ', '').lower(), key))
+    frame = frame.reindex(columns=PRICE_COLUMNS)
+
+    for column in PRICE_COLUMNS:
+        if column in NUMERIC_PRICE_COLUMNS:
+            frame[column] = pd.to_numeric(frame[column], errors='coerce')
+        else:
+            frame[column] = frame[column].where(frame[column].isna(), frame[column].astype(str))
+    return frame
+
+def get_api_validators():
+    """
+    Get the ETag/Last-Modified/content hash of the API pricelist currently
+    in the database, or {} if the last import did not come from the API.
+    """
+    try:
+        with read_connection() as conn:
+            rows = dict(conn.execute("""
+                SELECT key, value FROM metadata WHERE key IN ('import_source', 'api_validators')
+            """).fetchall())
+    except sqlite3.Error:
+        return {}
+    if rows.get('import_source') not in ('api', 'cache') or not rows.get('api_validators'):
+        return {}
+    return json.loads(rows['api_validators'])
+
+def set_api_validators(validators):
+    """Store the validators of the imported API pricelist"""
+    with write_connection() as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO metadata (key, value, updated_at)
+            VALUES ('api_validators', ?, CURRENT_TIMESTAMP)
+        """, (json.dumps(validators),))
+
+def fetch_from_partner_center_api(mode=None):
+    """
+    Fetch pricing data from Partner Center API and import it.
+    The request is conditional on the validators of the last import, so an
+    unchanged pricelist is neither downloaded nor imported; if the server
+    sends no validators, one whose content hash is unchanged is not imported. Otherwise pages
+    are downloaded concurrently to the spool, then imported from it; an
+    interrupted download resumes on the next run.
+    """
     try:
         # Acquire token
         token = acquire_token_silent()
@@ -255,39 +859,66 @@ def fetch_from_partner_center_api():
             logger.error("Failed to acquire access token")
             return False
 
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json"
-        }
+        # The downloader only asks for a token again after a 401
+        previous = get_api_validators()
+        downloader = PricelistDownloader(token_provider=functools.partial(acquire_token_silent, force_refresh=True),
+                                         token=token,
+                                         validators=previous)
+        logger.info(f"Fetching pricing from Partner Center API: {downloader.url}")
+
+        pages = downloader.pages()
+        first = next(pages, None)
+        if downloader.not_modified:
+            logger.info("Partner Center pricelist unchanged, skipping import")
+            return True
 
-        # Fetch pricing data - using the updatedlicensebased view for NCE
-        # Note: The actual endpoint may vary - this is a common pattern
-        url = f"{PARTNER_CENTER_API}/ratecards/azure"
+        # Finish the download before importing, so the import's write
+        # transaction is never held open while pages come off the network
+        for _ in pages:
+            pass
+
+        # Without ETag/Last-Modified every request downloads the pricelist;
+        # the content hash still tells whether it changed
+        if downloader.content_hash == previous.get('content_hash'):
+            logger.info("Partner Center pricelist content unchanged, skipping import")
+            set_api_validators(dict(downloader.validators, content_hash=downloader.content_hash))
+            downloader.discard()
+            return True
 
-        logger.info(f"Fetching pricing from Partner Center API: {url}")
-        response = requests.get(url, headers=headers, timeout=30)
+        spooled = CachedPricelist(downloader.spool_dir)
+        chunks = (api_items_to_frame(items) for items in spooled.pages() if items)
+        if not import_prices(chunks, downloader.content_hash, mode=mode, source='api'):
+            return False
 
-        if response.status_code == 200:
-            data = response.json()
-            logger.info("Successfully fetched pricing data from API")
+        set_api_validators(dict(downloader.validators, content_hash=downloader.content_hash))
+        # Keep the imported pages as the offline copy for source='cache'
+        downloader.keep_as_cache()
+        return True
 
-            # Process and store data
-            # The API response structure may vary - adapt as needed
-            # For now, we'll log success but recommend using CSV until API is validated
-            logger.warning("API fetch successful but CSV import is recommended for initial setup")
-            return True
-        else:
-            logger.error(f"API request failed: {response.status_code} - {response.text}")
+    except Exception as e:
+        logger.error(f"Error fetching from Partner Center API: {e}", exc_info=True)
+        return False
+
+def ingest_cached_pricelist(mode=None):
+    """Re-import the last API pricelist from its compressed copy on disk"""
+    try:
+        cached = CachedPricelist()
+        if not cached.exists():
+            logger.error("No cached API pricelist found")
             return False
 
+        logger.info(f"Importing cached API pricelist: {cached.cache_dir}")
+        chunks = (api_items_to_frame(items) for items in cached.pages() if items)
+        return import_prices(chunks, lambda: cached.content_hash, mode=mode, source='cache')
+
     except Exception as e:
-        logger.error(f"Error fetching from Partner Center API: {e}", exc_info=True)
+        logger.error(f"Error importing cached API pricelist: {e}", exc_info=True)
         return False
 
 def update_database(source='csv', csv_path=None):
     """
     Main update function
-    source: 'csv' or 'api'
+    source: 'csv', 'api' or 'cache' (re-import the last API download offline)
     """
     logger.info(f"Starting database update from {source}")
 
@@ -306,6 +937,9 @@ def update_database(source='csv', csv_path=None):
     elif source == 'api':
         return fetch_from_partner_center_api()
 
+    elif source == 'cache':
+        return ingest_cached_pricelist()
+
     else:
         logger.error(f"Unknown source: {source}")
         return False